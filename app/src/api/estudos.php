@@ -10,7 +10,11 @@ declare(strict_types=1);
 /**
  * POST /api/estudos
  * Create and launch a new study
- * Body: {tipo, data_inicio, data_fim, observacoes, workers_n}
+ * Body: {tipo, data_inicio, data_fim, observacoes, workers_n, executor, variantes}
+ *
+ * variantes (só substituicao, opcional): [{nome, parametros}, ...] — conjuntos
+ * de parâmetros simulados no mesmo passo sobre os mesmos dados; parametros
+ * tem a forma de parametros.json e altera apenas as categorias indicadas.
  */
 function store(): void
 {
@@ -49,6 +53,35 @@ function store(): void
     $observacoes = trim($body['observacoes'] ?? '');
     $workersN = max(1, min(16, (int)($body['workers_n'] ?? 4)));
 
+    $executor = $body['executor'] ?? 'thread';
+    if (!in_array($executor, ['thread', 'process'])) {
+        error_response('Executor deve ser "thread" ou "process"', 400);
+    }
+
+    $variantes = $body['variantes'] ?? null;
+    if ($variantes !== null) {
+        if ($body['tipo'] !== 'substituicao') {
+            error_response('variantes só se aplica a estudos de substituicao', 400);
+        }
+        if (!is_array($variantes) || !array_is_list($variantes) || count($variantes) === 0) {
+            error_response('variantes deve ser uma lista não vazia', 400);
+        }
+        $nomes = [];
+        foreach ($variantes as $v) {
+            $nome = is_array($v) ? trim((string)($v['nome'] ?? '')) : '';
+            if (!preg_match('/^[A-Za-z0-9_.-]{1,64}$/', $nome)) {
+                error_response('Cada variante precisa de um nome (letras, dígitos, _ . -)', 400);
+            }
+            if (isset($nomes[$nome])) {
+                error_response("Nome de variante repetido: {$nome}", 400);
+            }
+            if (isset($v['parametros']) && !is_array($v['parametros'])) {
+                error_response("parametros da variante {$nome} deve ser um objecto", 400);
+            }
+            $nomes[$nome] = true;
+        }
+    }
+
     // Create job record
     $jobs = new Jobs();
     $jobId = $jobs->create(
@@ -59,6 +92,49 @@ function store(): void
         $workersN
     );
 
+    if ($variantes !== null) {
+        // Lido pelo worker (--variantes) e reutilizado na retoma do job
+        file_put_contents(
+            variantesPath($jobId),
+            json_encode($variantes, JSON_PRETTY_PRINT | JSON_UNESCAPED_UNICODE)
+        );
+    }
+
+    launchWorker($jobId, $body['tipo'], $dataInicio, $dataFim, $workersN, $executor, false);
+
+    // Mark as running
+    $jobs->markRunning($jobId);
+
+    json_response([
+        'job_id' => $jobId,
+        'status' => 'RUNNING',
+        'message' => 'Estudo lançado com sucesso',
+    ]);
+}
+
+/**
+ * Path of the parameter variants file of a substitution job (shared /data volume).
+ */
+function variantesPath(string $jobId): string
+{
+    return "/data/outputs/{$jobId}_variantes.json";
+}
+
+/**
+ * Launch a study worker in the background via docker exec.
+ * With $resume the worker skips the dates already completed by the job
+ * (mibel.job_progresso) and the log file is appended to, not truncated.
+ * A job with a variants file (variantesPath) is launched with --variantes.
+ */
+function launchWorker(
+    string $jobId,
+    string $tipo,
+    string $dataInicio,
+    string $dataFim,
+    int $workersN,
+    string $executor,
+    bool $resume
+): void {
     // Ensure output directory exists and is writable
     $outputDir = '/data/outputs';
     if (!is_dir($outputDir)) {
@@ -66,7 +142,7 @@ function store(): void
     }
 
     // Determine worker script
-    $script = $body['tipo'] === 'otimizacao'
+    $script = $tipo === 'otimizacao'
         ? '/app/otimizacao_worker.py'
         : '/app/substituicao_worker.py';
 
@@ -74,26 +150,70 @@ function store(): void
     // The python-worker container runs with tail -f /dev/null, so we exec into it
     $logPath = "/data/outputs/{$jobId}.log";
 
+    $variantes = variantesPath($jobId);
+    $extra = $resume ? ' --resume' : '';
+    if ($tipo === 'substituicao' && is_file($variantes)) {
+        $extra .= ' --variantes ' . escapeshellarg($variantes);
+    }
+
     $cmd = sprintf(
-        'docker exec mibel-datalab-python-worker-1 python %s --job_id %s --data_inicio %s --data_fim %s --workers %d > %s 2>&1 &',
+        'docker exec mibel-datalab-python-worker-1 python %s --job_id %s --data_inicio %s --data_fim %s --workers %d --executor %s%s %s %s 2>&1 &',
         $script,
         escapeshellarg($jobId),
         escapeshellarg($dataInicio),
         escapeshellarg($dataFim),
         $workersN,
+        $executor,
+        $extra,
+        $resume ? '>>' : '>',
         $logPath
     );
 
     // Execute command
     exec($cmd, $output, $returnCode);
+}
 
-    // Mark as running
-    $jobs->markRunning($jobId);
+/**
+ * POST /api/estudos/{id}/retomar
+ * Resume a FAILED job from the dates it has not completed yet
+ * Body: {executor}
+ */
+function retomar(string $id): void
+{
+    $body = request_body();
+
+    $jobs = new Jobs();
+    $job = $jobs->get($id);
+
+    if (!$job) {
+        error_response('Estudo não encontrado', 404);
+    }
+
+    if ($job['status'] !== 'FAILED') {
+        error_response('Apenas estudos FAILED podem ser retomados', 400);
+    }
+
+    $executor = $body['executor'] ?? 'thread';
+    if (!in_array($executor, ['thread', 'process'])) {
+        error_response('Executor deve ser "thread" ou "process"', 400);
+    }
+
+    launchWorker(
+        $id,
+        $job['tipo'],
+        $job['data_inicio'],
+        $job['data_fim'],
+        (int)$job['workers_n'],
+        $executor,
+        true
+    );
+
+    $jobs->markRunning($id);
 
     json_response([
-        'job_id' => $jobId,
+        'job_id' => $id,
         'status' => 'RUNNING',
-        'message' => 'Estudo lançado com sucesso',
+        'message' => 'Estudo retomado',
     ]);
 }
 
@@ -192,7 +312,7 @@ function cancelar(string $id): void
 /**
  * DELETE /api/estudos/{id}
  * Delete a job (PENDING, FAILED or DONE — not RUNNING)
- * For DONE jobs also schedules ClickHouse data deletion (async mutation).
+ * For DONE/FAILED jobs also schedules ClickHouse data deletion (async mutation).
  */
 function destroy(string $id): void
 {
@@ -211,14 +331,16 @@ function destroy(string $id): void
         error_response('Estado inválido para remoção', 400);
     }
 
-    // For DONE jobs: schedule async ClickHouse mutation to remove result data
-    if ($job['status'] === 'DONE') {
+    // For DONE/FAILED jobs: schedule async ClickHouse mutation to remove result
+    // data (FAILED jobs keep the dates written before the failure, for resume)
+    if (in_array($job['status'], ['DONE', 'FAILED'])) {
         $table = $job['tipo'] === 'otimizacao'
             ? 'mibel.clearing_otimizacao'
             : 'mibel.clearing_substituicao';
         try {
             $db = Database::getInstance();
             $db->execute("ALTER TABLE {$table} DELETE WHERE job_id = '{$id}'");
+            $db->execute("ALTER TABLE mibel.job_progresso DELETE WHERE job_id = '{$id}'");
         } catch (\Exception $e) {
             // Non-fatal: ClickHouse mutation failure does not block SQLite deletion
         }
@@ -231,6 +353,9 @@ function destroy(string $id): void
         if (file_exists($logPath)) {
             @unlink($logPath);
         }
+        if (file_exists(variantesPath($id))) {
+            @unlink(variantesPath($id));
+        }
 
         json_response([
             'success' => true,
@@ -341,6 +341,69 @@ function dispersao(): void
     json_response($rows);
 }
 
+// ============================================================================
+// GET /api/explorador/curva?data=YYYY-MM-DD&hora=H&pais=MI
+// ============================================================================
+
+/**
+ * Curvas de compra (preço DESC) e venda (preço ASC) de um período, lidas das
+ * curvas agregadas por preço (mibel.curvas) em vez dos bids individuais.
+ * hora é o período tal como ingerido ("1"-"24" ou "H1Q1"-"H24Q4").
+ */
+function curva(): void
+{
+    $db   = Database::getInstance();
+    $data = get_param('data', '');
+    $hora = get_param('hora', '');
+    $pais = get_param('pais', 'MI');
+
+    if (!preg_match('/^\d{4}-\d{2}-\d{2}$/', $data)) {
+        error_response('Parâmetro data inválido (YYYY-MM-DD).', 400);
+    }
+    if (!preg_match('/^(\d{1,2}|H\d{1,2}Q[1-4])$/', $hora)) {
+        error_response('Parâmetro hora inválido ("1"-"24" ou "HxQy").', 400);
+    }
+    if (!in_array($pais, ['MI', 'ES', 'PT'], true)) {
+        error_response('Parâmetro pais inválido (MI|ES|PT).', 400);
+    }
+
+    $rows = $db->query("
+        SELECT
+            tipo_oferta,
+            precio,
+            energia,
+            volume_acumulado,
+            n_bids
+        FROM mibel.curvas
+        WHERE data_ficheiro = '{$data}'
+          AND hora_raw = '{$hora}'
+          AND pais = '{$pais}'
+        ORDER BY tipo_oferta, if(tipo_oferta = 'C', -precio, precio)
+    ");
+
+    if (empty($rows)) {
+        error_response("Sem curvas para {$data} hora {$hora} ({$pais}).", 404);
+    }
+
+    $curvas = ['C' => [], 'V' => []];
+    foreach ($rows as $r) {
+        $curvas[$r['tipo_oferta']][] = [
+            'precio'           => (float)$r['precio'],
+            'energia'          => (float)$r['energia'],
+            'volume_acumulado' => (float)$r['volume_acumulado'],
+            'n_bids'           => (int)$r['n_bids'],
+        ];
+    }
+
+    json_response([
+        'data'   => $data,
+        'hora'   => $hora,
+        'pais'   => $pais,
+        'compra' => $curvas['C'],
+        'venda'  => $curvas['V'],
+    ]);
+}
+
 // ============================================================================
 // POST /api/explorador/query
 // ============================================================================
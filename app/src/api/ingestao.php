@@ -8,6 +8,7 @@
  *   GET  /api/ingestao           — resumo dos meses já ingeridos no ClickHouse
  *   POST /api/ingestao           — upload de ZIP + lança ingestao_worker.py
  *   DELETE /api/ingestao/mes/{yyyymm} — elimina todos os bids de um mês do ClickHouse
+ *                                       (e a cache de clearing original e as curvas do mês)
  */
 
 declare(strict_types=1);
@@ -212,8 +213,12 @@ function destroyMes(string $yyyymm): void
         error_response("Não existem dados para o mês {$yyyymm} no ClickHouse.", 404);
     }
 
-    // Eliminar por partição (operação eficiente no ClickHouse)
+    // Eliminar por partição (operação eficiente no ClickHouse), com a versão
+    // dos dados, a cache de clearing original e as curvas agregadas do mês
     $db->execute("ALTER TABLE mibel.bids_raw DROP PARTITION {$yyyymm}");
+    $db->execute("ALTER TABLE mibel.bids_versao DROP PARTITION {$yyyymm}");
+    $db->execute("ALTER TABLE mibel.clearing_original DROP PARTITION {$yyyymm}");
+    $db->execute("ALTER TABLE mibel.curvas DROP PARTITION {$yyyymm}");
 
     json_response([
         'success'  => true,
@@ -33,8 +33,26 @@ function sanitizePais(string $pais): string
     return in_array($pais, ['MI', 'ES', 'PT'], true) ? $pais : '';
 }
 
+/**
+ * Nome de variante de parâmetros (estudos de substituição com variantes);
+ * mesmo formato validado em POST /api/estudos.
+ */
+function sanitizeVariante(string $variante): string
+{
+    return preg_match('/^[A-Za-z0-9_.-]{1,64}$/', $variante) ? $variante : '';
+}
+
+/**
+ * Filtro opcional ?variante= para as queries de clearing_substituicao.
+ */
+function filtroVariante(array $job): string
+{
+    $variante = isOtimizacao($job) ? '' : sanitizeVariante(get_param('variante', ''));
+    return $variante !== '' ? " AND variante = '{$variante}'" : '';
+}
+
 // ============================================================================
-// GET /api/resultados/{job_id}/stats
+// GET /api/resultados/{job_id}/stats?variante=
 // ============================================================================
 
 function stats(string $jobId): void
@@ -76,10 +94,16 @@ function stats(string $jobId): void
                 toString(max(data_date)) AS data_fim,
                 sum(n_bids_substituidos) AS total_bids_sub
             FROM mibel.clearing_substituicao
-            WHERE job_id = '{$jobId}'
+            WHERE job_id = '{$jobId}'" . filtroVariante($job) . "
         ");
         $stats = $info[0] ?? [];
         $stats['tipo']            = 'substituicao';
+        $stats['variantes']       = array_column($db->query("
+            SELECT DISTINCT variante
+            FROM mibel.clearing_substituicao
+            WHERE job_id = '{$jobId}' AND variante != ''
+            ORDER BY variante
+        "), 'variante');
         $stats['lucro_base_total'] = null;
         $stats['lucro_opt_total']  = null;
         $stats['delta_lucro_total'] = null;
@@ -93,7 +117,7 @@ function stats(string $jobId): void
 }
 
 // ============================================================================
-// GET /api/resultados/{job_id}/serie?pais=
+// GET /api/resultados/{job_id}/serie?pais=&variante=
 // ============================================================================
 
 function serie(string $jobId): void
@@ -106,6 +130,7 @@ function serie(string $jobId): void
     if ($pais !== '') {
         $where .= " AND pais = '{$pais}'";
     }
+    $where .= filtroVariante($job);
 
     if (isOtimizacao($job)) {
         $rows = $db->query("
@@ -153,7 +178,7 @@ function serie(string $jobId): void
 }
 
 // ============================================================================
-// GET /api/resultados/{job_id}/tabela?limit=50&offset=0&pais=
+// GET /api/resultados/{job_id}/tabela?limit=50&offset=0&pais=&variante=
 // ============================================================================
 
 function tabela(string $jobId): void
@@ -168,6 +193,7 @@ function tabela(string $jobId): void
     if ($pais !== '') {
         $where .= " AND pais = '{$pais}'";
     }
+    $where .= filtroVariante($job);
 
     if (isOtimizacao($job)) {
         $table = 'mibel.clearing_otimizacao';
@@ -204,6 +230,7 @@ function tabela(string $jobId): void
                 hora_raw,
                 hora_num,
                 pais,
+                variante,
                 preco_clearing_orig      AS preco_orig,
                 preco_clearing_orig      AS preco_base,
                 preco_clearing_sub       AS preco_sim,
@@ -216,7 +243,7 @@ function tabela(string $jobId): void
                 volume_clearing_sub      AS volume_sim
             FROM {$table}
             WHERE {$where}
-            ORDER BY data_date, hora_num, pais
+            ORDER BY data_date, hora_num, pais, variante
             LIMIT {$limit} OFFSET {$offset}
         ");
     }
@@ -248,7 +275,7 @@ function logs(string $jobId): void
 }
 
 // ============================================================================
-// GET /api/resultados/{job_id}/exportar?formato=csv|json
+// GET /api/resultados/{job_id}/exportar?formato=csv|json&variante=
 // ============================================================================
 
 function exportar(string $jobId): void
@@ -288,6 +315,7 @@ function exportar(string $jobId): void
                 hora_raw,
                 hora_num,
                 pais,
+                variante,
                 preco_clearing_orig,
                 preco_clearing_sub,
                 delta_preco,
@@ -295,8 +323,8 @@ function exportar(string $jobId): void
                 volume_clearing_sub,
                 n_bids_substituidos
             FROM mibel.clearing_substituicao
-            WHERE job_id = '{$jobId}'
-            ORDER BY data_date, hora_num, pais
+            WHERE job_id = '{$jobId}'" . filtroVariante($job) . "
+            ORDER BY data_date, hora_num, pais, variante
         ");
     }
 
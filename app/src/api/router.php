@@ -197,6 +197,11 @@ try {
         cancelar($matches[1]);
     }
 
+    if (preg_match('#^/estudos/([a-f0-9-]{36})/retomar$#', $path, $matches) && $method === 'POST') {
+        require_once __DIR__ . '/estudos.php';
+        retomar($matches[1]);
+    }
+
     if (preg_match('#^/estudos/([a-f0-9-]{36})$#', $path, $matches) && $method === 'DELETE') {
         require_once __DIR__ . '/estudos.php';
         destroy($matches[1]);
@@ -299,6 +304,11 @@ try {
         dispersao();
     }
 
+    if ($path === '/explorador/curva' && $method === 'GET') {
+        require_once __DIR__ . '/explorador.php';
+        curva();
+    }
+
     if ($path === '/explorador/query' && $method === 'POST') {
         require_once __DIR__ . '/explorador.php';
         query_custom();
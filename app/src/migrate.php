@@ -238,6 +238,48 @@ $clickhouseTables = [
         PARTITION BY toYYYYMM(data_ficheiro)
         ORDER BY (data_ficheiro, hora_num, pais, tipo_oferta, unidade)
     ",
+    'bids_versao' => "
+        CREATE TABLE IF NOT EXISTS mibel.bids_versao (
+            data_ficheiro   Date,
+            ficheiro_nome   String,
+            zip_nome        String,
+            fingerprint     String,
+            tamanho         UInt64 DEFAULT 0,
+            crc32           UInt32 DEFAULT 0,
+            n_bids          UInt32,
+            ingestao_ts     DateTime DEFAULT now()
+        ) ENGINE = MergeTree()
+        PARTITION BY toYYYYMM(data_ficheiro)
+        ORDER BY (data_ficheiro, ficheiro_nome)
+    ",
+    'clearing_original' => "
+        CREATE TABLE IF NOT EXISTS mibel.clearing_original (
+            data_ficheiro   Date,
+            versao          String,
+            hora_raw        String,
+            pais            String,
+            preco_clearing  Nullable(Float64),
+            volume_clearing Nullable(Float64),
+            created_at      DateTime DEFAULT now()
+        ) ENGINE = ReplacingMergeTree(created_at)
+        PARTITION BY toYYYYMM(data_ficheiro)
+        ORDER BY (data_ficheiro, versao, hora_raw, pais)
+    ",
+    'curvas' => "
+        CREATE TABLE IF NOT EXISTS mibel.curvas (
+            data_ficheiro    Date,
+            hora_raw         String,
+            hora_num         UInt8,
+            pais             LowCardinality(String),
+            tipo_oferta      FixedString(1),
+            precio           Float64,
+            energia          Float64 CODEC(Gorilla, ZSTD(1)),
+            volume_acumulado Float64 CODEC(Gorilla, ZSTD(1)),
+            n_bids           UInt32  CODEC(T64, ZSTD(1))
+        ) ENGINE = MergeTree()
+        PARTITION BY toYYYYMM(data_ficheiro)
+        ORDER BY (data_ficheiro, hora_num, hora_raw, pais, tipo_oferta, precio)
+    ",
     'clearing_substituicao' => "
         CREATE TABLE IF NOT EXISTS mibel.clearing_substituicao (
             job_id                  String,
@@ -246,6 +288,7 @@ $clickhouseTables = [
             hora_raw                String,
             hora_num                UInt8,
             pais                    String,
+            variante                String DEFAULT '',
             preco_clearing_orig     Nullable(Float64),
             volume_clearing_orig    Nullable(Float64),
             preco_clearing_sub      Nullable(Float64),
@@ -265,6 +308,7 @@ $clickhouseTables = [
             hora_raw        String,
             hora_num        UInt8,
             pais            String,
+            variante        String DEFAULT '',
             unidade         String,
             categoria       String,
             escalao_preco   Float64,
@@ -325,6 +369,36 @@ $clickhouseTables = [
         PARTITION BY toYYYYMM(data_date)
         ORDER BY (job_id, data_date, hora_num, pais, cenario)
     ",
+    'clearing_otimizacao_cenarios' => "
+        CREATE TABLE IF NOT EXISTS mibel.clearing_otimizacao_cenarios (
+            job_id           String,
+            data_ficheiro    String,
+            data_date        Date,
+            hora_raw         String,
+            hora_num         UInt8,
+            pais             String,
+            cenario          Array(String),
+            preco_clearing   Array(Nullable(Float64)),
+            volume_clearing  Array(Nullable(Float64)),
+            lucro_pre        Array(Float64),
+            n_bids_removidos Array(UInt32),
+            vol_removido     Array(Float64),
+            created_at       DateTime DEFAULT now()
+        ) ENGINE = MergeTree()
+        PARTITION BY toYYYYMM(data_date)
+        ORDER BY (job_id, data_date, hora_num, pais)
+    ",
+    'job_progresso' => "
+        CREATE TABLE IF NOT EXISTS mibel.job_progresso (
+            job_id          String,
+            tipo            String,
+            data_ficheiro   String,
+            n_periodos      UInt32,
+            n_logs          UInt64,
+            concluido_em    DateTime DEFAULT now()
+        ) ENGINE = ReplacingMergeTree(concluido_em)
+        ORDER BY (job_id, data_ficheiro)
+    ",
     'worker_logs' => "
         CREATE TABLE IF NOT EXISTS mibel.worker_logs (
             job_id        String,
@@ -356,6 +430,66 @@ if ($clickhouseOk) {
         $result = clickhouseQuery($clickhouseHost, $clickhousePort, $createSql, 'mibel');
         printStatus($result['success'], "Create table '{$tableName}'" . ($result['success'] ? '' : " - {$result['error']}"));
     }
+
+    // Colunas acrescentadas depois da criação inicial (idempotente em instalações existentes)
+    $clickhouseAlters = [
+        'clearing_substituicao.variante' =>
+            "ALTER TABLE mibel.clearing_substituicao ADD COLUMN IF NOT EXISTS variante String DEFAULT '' AFTER pais",
+        'clearing_substituicao_logs.variante' =>
+            "ALTER TABLE mibel.clearing_substituicao_logs ADD COLUMN IF NOT EXISTS variante String DEFAULT '' AFTER pais",
+        'bids_versao.tamanho' =>
+            "ALTER TABLE mibel.bids_versao ADD COLUMN IF NOT EXISTS tamanho UInt64 DEFAULT 0 AFTER fingerprint",
+        'bids_versao.crc32' =>
+            "ALTER TABLE mibel.bids_versao ADD COLUMN IF NOT EXISTS crc32 UInt32 DEFAULT 0 AFTER tamanho",
+    ];
+    foreach ($clickhouseAlters as $colName => $alterSql) {
+        $result = clickhouseQuery($clickhouseHost, $clickhousePort, $alterSql, 'mibel');
+        printStatus($result['success'], "Column '{$colName}'" . ($result['success'] ? '' : " - {$result['error']}"));
+    }
+
+    // Versão das datas ingeridas antes de mibel.bids_versao existir: derivada
+    // do conteúdo em bids_raw (idempotente — só datas ainda sem versão)
+    $result = clickhouseQuery($clickhouseHost, $clickhousePort, "
+        INSERT INTO mibel.bids_versao (data_ficheiro, ficheiro_nome, zip_nome, fingerprint, n_bids)
+        SELECT
+            data_ficheiro,
+            ficheiro_nome,
+            any(zip_nome),
+            concat('legado:', toString(count()), ':', toString(max(ingestao_ts))),
+            count()
+        FROM mibel.bids_raw
+        WHERE data_ficheiro NOT IN (SELECT data_ficheiro FROM mibel.bids_versao)
+        GROUP BY data_ficheiro, ficheiro_nome
+    ", 'mibel');
+    printStatus($result['success'], 'Backfill bids_versao' . ($result['success'] ? '' : " - {$result['error']}"));
+
+    // Curvas agregadas das datas ingeridas antes de mibel.curvas existir
+    // (mesma consulta que utils.materializa_curvas_ch; só datas sem curvas)
+    $result = clickhouseQuery($clickhouseHost, $clickhousePort, "
+        INSERT INTO mibel.curvas
+            (data_ficheiro, hora_raw, hora_num, pais, tipo_oferta, precio,
+             energia, volume_acumulado, n_bids)
+        SELECT
+            data_ficheiro, hora_raw, hora_num, pais, tipo_oferta, precio,
+            energia_total,
+            sum(energia_total) OVER (
+                PARTITION BY data_ficheiro, hora_raw, pais, tipo_oferta
+                ORDER BY if(tipo_oferta = 'C', -precio, precio)
+                ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+            ),
+            n
+        FROM (
+            SELECT
+                data_ficheiro, hora_raw, hora_num, pais, tipo_oferta, precio,
+                sum(energia) AS energia_total,
+                count()      AS n
+            FROM mibel.bids_raw
+            WHERE tipo_oferta IN ('C', 'V')
+              AND data_ficheiro NOT IN (SELECT DISTINCT data_ficheiro FROM mibel.curvas)
+            GROUP BY data_ficheiro, hora_raw, hora_num, pais, tipo_oferta, precio
+        )
+    ", 'mibel');
+    printStatus($result['success'], 'Backfill curvas' . ($result['success'] ? '' : " - {$result['error']}"));
 }
 
 // Step 3: Create data directories
@@ -21,6 +21,51 @@ CREATE TABLE IF NOT EXISTS mibel.bids_raw (
 PARTITION BY toYYYYMM(data_ficheiro)
 ORDER BY (data_ficheiro, hora_num, pais, tipo_oferta, unidade);
 
+-- Data version of each ingested date: one SHA-1 per CSV, written after its bids
+CREATE TABLE IF NOT EXISTS mibel.bids_versao (
+    data_ficheiro   Date,
+    ficheiro_nome   String,
+    zip_nome        String,
+    fingerprint     String,
+    tamanho         UInt64 DEFAULT 0,
+    crc32           UInt32 DEFAULT 0,
+    n_bids          UInt32,
+    ingestao_ts     DateTime DEFAULT now()
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(data_ficheiro)
+ORDER BY (data_ficheiro, ficheiro_nome);
+
+-- Cache of the unmodified clearing per (date, hora, pais), shared by all
+-- studies; keyed by the date's data version (see bids_versao)
+CREATE TABLE IF NOT EXISTS mibel.clearing_original (
+    data_ficheiro   Date,
+    versao          String,
+    hora_raw        String,
+    pais            String,
+    preco_clearing  Nullable(Float64),
+    volume_clearing Nullable(Float64),
+    created_at      DateTime DEFAULT now()
+) ENGINE = ReplacingMergeTree(created_at)
+PARTITION BY toYYYYMM(data_ficheiro)
+ORDER BY (data_ficheiro, versao, hora_raw, pais);
+
+-- Aggregated step curves: one row per distinct price of each
+-- (date, hora, pais, tipo), with the cumulative volume in curve order
+-- (compras by price DESC, vendas ASC). Materialized by the ingestion worker
+CREATE TABLE IF NOT EXISTS mibel.curvas (
+    data_ficheiro    Date,
+    hora_raw         String,
+    hora_num         UInt8,
+    pais             LowCardinality(String),
+    tipo_oferta      FixedString(1),
+    precio           Float64,
+    energia          Float64 CODEC(Gorilla, ZSTD(1)),
+    volume_acumulado Float64 CODEC(Gorilla, ZSTD(1)),
+    n_bids           UInt32  CODEC(T64, ZSTD(1))
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(data_ficheiro)
+ORDER BY (data_ficheiro, hora_num, hora_raw, pais, tipo_oferta, precio);
+
 -- Clearing results from substitution analysis
 CREATE TABLE IF NOT EXISTS mibel.clearing_substituicao (
     job_id                  String,
@@ -29,6 +74,7 @@ CREATE TABLE IF NOT EXISTS mibel.clearing_substituicao (
     hora_raw                String,
     hora_num                UInt8,
     pais                    String,
+    variante                String DEFAULT '',   -- nome da variante de parâmetros (--variantes)
     preco_clearing_orig     Nullable(Float64),
     volume_clearing_orig    Nullable(Float64),
     preco_clearing_sub      Nullable(Float64),
@@ -48,6 +94,7 @@ CREATE TABLE IF NOT EXISTS mibel.clearing_substituicao_logs (
     hora_raw        String,
     hora_num        UInt8,
     pais            String,
+    variante        String DEFAULT '',
     unidade         String,
     categoria       String,
     escalao_preco   Float64,
@@ -58,6 +105,18 @@ CREATE TABLE IF NOT EXISTS mibel.clearing_substituicao_logs (
 PARTITION BY toYYYYMM(data_date)
 ORDER BY (job_id, data_date, hora_num, pais, unidade);
 
+-- Per-date progress of study jobs (checkpoint for --resume)
+-- A row is written only after all result rows of that date were inserted
+CREATE TABLE IF NOT EXISTS mibel.job_progresso (
+    job_id          String,
+    tipo            String,   -- substituicao | otimizacao
+    data_ficheiro   String,
+    n_periodos      UInt32,
+    n_logs          UInt64,
+    concluido_em    DateTime DEFAULT now()
+) ENGINE = ReplacingMergeTree(concluido_em)
+ORDER BY (job_id, data_ficheiro);
+
 -- Worker execution logs
 CREATE TABLE IF NOT EXISTS mibel.worker_logs (
     job_id        String,
@@ -118,6 +177,26 @@ CREATE TABLE IF NOT EXISTS mibel.clearing_otimizacao_logs (
 PARTITION BY toYYYYMM(data_date)
 ORDER BY (job_id, data_date, hora_num, pais, cenario);
 
+-- Compact scenario logs (--formato_logs arrays): one row per (hora, pais, date)
+-- with the tested scenarios as parallel arrays
+CREATE TABLE IF NOT EXISTS mibel.clearing_otimizacao_cenarios (
+    job_id           String,
+    data_ficheiro    String,
+    data_date        Date,
+    hora_raw         String,
+    hora_num         UInt8,
+    pais             String,
+    cenario          Array(String),
+    preco_clearing   Array(Nullable(Float64)),
+    volume_clearing  Array(Nullable(Float64)),
+    lucro_pre        Array(Float64),
+    n_bids_removidos Array(UInt32),
+    vol_removido     Array(Float64),
+    created_at       DateTime DEFAULT now()
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(data_date)
+ORDER BY (job_id, data_date, hora_num, pais);
+
 -- Unit classification mapping loaded from LISTA_UNIDADES.csv (OMIE)
 -- Populated by scripts/unidades/carrega_unidades_ch.py
 -- Used by substituicao_worker.py to classify bid units by CODIGO
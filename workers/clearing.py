@@ -1,23 +1,34 @@
+import numpy as np
 import pandas as pd
 
 # ─────────────────────────────────────────────────────────────────────────────
 #  CLEARING ALGORITHM
 # ─────────────────────────────────────────────────────────────────────────────
 
-def clearing(
-    compras_df: pd.DataFrame,
-    vendas_df:  pd.DataFrame,
-    col_preco:  str  = "Precio",
-    col_vol:    str  = "Volume_Acumulado",
-    verbose:    bool = False
+def clearing_arrays(
+    cp: np.ndarray,
+    cv: np.ndarray,
+    vp: np.ndarray,
+    vv: np.ndarray,
+    verbose: bool = False
 ):
     """
-    Algoritmo de market clearing iterativo.
+    Núcleo do algoritmo de market clearing sobre arrays numpy.
+
+    Parâmetros
+    ----------
+    cp, cv — preços (DESC) e volumes acumulados da curva de compra
+    vp, vv — preços (ASC)  e volumes acumulados da curva de venda
 
     Percorre as curvas de compra (DESC) e venda (ASC) com dois ponteiros i, j.
     Guarda o último par (last_i, last_j) com preço de compra >= preço de venda
     e aplica as regras de decisão de preço após o cruzamento.
 
+    Os arredondamentos a 2 casas são calculados uma única vez por array com
+    np.round (a mesma rotina usada por round() sobre np.float64), pelo que o
+    resultado é idêntico, bit a bit, ao da versão que percorria DataFrames
+    com iloc. Os valores devolvidos são np.float64 retirados dos arrays.
+
     Caso especial — degrau de venda
     --------------------------------
     Quando a curva de venda contém um degrau vertical grande (um único bid com
@@ -41,20 +52,30 @@ def clearing(
     i avança para o degrau e pc < pv, last=(i_teto, j_atual) com vc < vv,
     e a regra `last_j > 0 → return pv_last, vc_last` retorna o preço correto.
     """
-    c = compras_df.reset_index(drop=True)
-    v = vendas_df.reset_index(drop=True)
+    cp = np.asarray(cp, dtype=np.float64)
+    cv = np.asarray(cv, dtype=np.float64)
+    vp = np.asarray(vp, dtype=np.float64)
+    vv = np.asarray(vv, dtype=np.float64)
+
+    n_c, n_v = len(cp), len(vp)
+
+    # Arredondamentos pré-calculados; listas de floats para comparações rápidas
+    cp_r_arr = np.round(cp, 2)
+    vp_r_arr = np.round(vp, 2)
+    cp_r = cp_r_arr.tolist()
+    vp_r = vp_r_arr.tolist()
+    cv_r = np.round(cv, 2).tolist()
+    vv_r = np.round(vv, 2).tolist()
 
     i = j = 0
     last_i = last_j = None
 
-    while i < len(c) and j < len(v):
-        pc = round(c.iloc[i][col_preco], 2)
-        pv = round(v.iloc[j][col_preco],  2)
-        vc = c.iloc[i][col_vol]
-        vv = v.iloc[j][col_vol]
+    while i < n_c and j < n_v:
+        pc = cp_r[i]
+        pv = vp_r[j]
 
         if verbose:
-            print(f"  C:{i}(P={pc:.4f}, V={vc:.2f})  V:{j}(P={pv:.4f}, V={vv:.2f})")
+            print(f"  C:{i}(P={pc:.4f}, V={cv[i]:.2f})  V:{j}(P={pv:.4f}, V={vv[j]:.2f})")
 
         if pc < pv:
             if verbose:
@@ -66,51 +87,203 @@ def clearing(
             # venda. Nesse caso o preço de casamento é o pé do degrau (pv[j-1])
             # e o volume é o vc do bid de compra que cruzou esse piso.
             if last_j is not None and last_j == j and j > 0:
-                pv_prev = round(v.iloc[j - 1][col_preco], 2)
+                pv_prev = vp_r[j - 1]
                 if pc >= pv_prev:
                     # Avança i até o primeiro bid com pc < pv_prev
-                    while i < len(c) and round(c.iloc[i][col_preco], 2) >= pv_prev:
+                    while i < n_c and cp_r[i] >= pv_prev:
                         i += 1
                     # Volume = vc do bid que cruzou o piso (primeiro rejeitado)
-                    vc_final = (c.iloc[i][col_vol] if i < len(c)
-                                else c.iloc[i - 1][col_vol])
+                    vc_final = cv[i] if i < n_c else cv[i - 1]
                     if verbose:
                         print(f"  → Degrau de venda detectado: "
                               f"pv_prev={pv_prev:.4f}, vc_final={vc_final:.2f}")
-                    return pv_prev, vc_final
+                    return vp_r_arr[j - 1], vc_final
 
             break
 
         last_i, last_j = i, j
 
-        if   round(vc, 2) < round(vv, 2): i += 1
-        elif round(vc, 2) > round(vv, 2): j += 1
-        else:                              i += 1; j += 1
+        if   cv_r[i] < vv_r[j]: i += 1
+        elif cv_r[i] > vv_r[j]: j += 1
+        else:                   i += 1; j += 1
 
     if last_i is None or last_j is None:
         return None, None
 
-    pc_last = c.iloc[last_i][col_preco]
-    pv_last = v.iloc[last_j][col_preco]
-    vc_last = c.iloc[last_i][col_vol]
-    vv_last = v.iloc[last_j][col_vol]
+    pc_last = cp[last_i]
+    pv_last = vp[last_j]
+    vc_last = cv[last_i]
+    vv_last = vv[last_j]
 
     if verbose:
         print(f"  last: C:{last_i}(P={pc_last:.4f}, V={vc_last:.2f})  "
               f"V:{last_j}(P={pv_last:.4f}, V={vv_last:.2f})")
 
-    if round(vc_last, 2) == round(vv_last, 2):
+    if cv_r[last_i] == vv_r[last_j]:
         return (pc_last + pv_last) / 2.0, vc_last
 
-    if round(vc_last, 2) > round(vv_last, 2):
+    if cv_r[last_i] > vv_r[last_j]:
         return pc_last, vv_last
 
     if last_j > 0:
         return pv_last, vc_last
     else:
         i_next = last_i + 1
-        if (i_next < len(c)
-                and round(c.iloc[i_next][col_preco], 2) < round(pv_last, 2)):
+        if i_next < n_c and cp_r[i_next] < vp_r[last_j]:
             return pv_last, vc_last
         else:
-            return pc_last, vc_last
\ No newline at end of file
+            return pc_last, vc_last
+
+
+def clearing(
+    compras_df: pd.DataFrame,
+    vendas_df:  pd.DataFrame,
+    col_preco:  str  = "Precio",
+    col_vol:    str  = "Volume_Acumulado",
+    verbose:    bool = False
+):
+    """
+    Algoritmo de market clearing iterativo sobre DataFrames.
+
+    Adaptador de clearing_arrays(): extrai as colunas de preço e volume
+    acumulado das curvas de compra (ordenada por preço DESC) e de venda
+    (ordenada por preço ASC) e delega no núcleo numpy.
+    """
+    return clearing_arrays(
+        compras_df[col_preco].to_numpy(dtype=np.float64),
+        compras_df[col_vol].to_numpy(dtype=np.float64),
+        vendas_df[col_preco].to_numpy(dtype=np.float64),
+        vendas_df[col_vol].to_numpy(dtype=np.float64),
+        verbose=verbose,
+    )
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  CLEARING SEGMENTADO (todos os pares Hora × País de uma vez)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def clearing_segmentado(
+    hora:    np.ndarray,
+    pais:    np.ndarray,
+    tipo:    np.ndarray,
+    precio:  np.ndarray,
+    energia: np.ndarray,
+    verbose: bool = False
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Clearing em lote de todos os segmentos (hora, pais) de um conjunto de bids
+    (um dia, um mês, …) numa única chamada.
+
+    Os bids são ordenados uma única vez por (hora, pais, tipo, precio) — compras
+    por preço DESC, vendas por preço ASC — com ordenação estável, pelo que bids
+    com o mesmo preço mantêm a ordem das linhas. A regra do degrau de venda
+    de clearing_arrays() depende dessa ordem: face à ordenação por hora
+    anterior (quicksort, ordem de empates indefinida), preço e volume de
+    clearing podem mudar em dias com muitos preços iguais. Os volumes acumulados são
+    calculados por segmento sobre fatias contíguas (vistas, sem cópia) e
+    cada segmento é resolvido por clearing_arrays().
+
+    Linhas com tipo diferente de 'C'/'V' são ignoradas. Só são devolvidos os
+    segmentos que têm simultaneamente compras e vendas.
+
+    Devolve (horas, paises, precos, volumes), um elemento por segmento,
+    ordenados por (hora, pais). Segmentos sem cruzamento das curvas têm
+    preço e volume NaN.
+    """
+    hora    = np.asarray(hora)
+    pais    = np.asarray(pais)
+    tipo    = np.asarray(tipo)
+    precio  = np.asarray(precio,  dtype=np.float64)
+    energia = np.asarray(energia, dtype=np.float64)
+
+    e_compra = tipo == 'C'
+    e_venda  = tipo == 'V'
+    validos  = np.flatnonzero(e_compra | e_venda)
+
+    vazio = np.array([], dtype=np.float64)
+    if len(validos) == 0:
+        return hora[:0], pais[:0], vazio, vazio
+
+    h_uni, h_cod = np.unique(hora[validos], return_inverse=True)
+    p_uni, p_cod = np.unique(pais[validos], return_inverse=True)
+    venda        = e_venda[validos]
+    chave_preco  = np.where(venda, precio[validos], -precio[validos])
+
+    # np.lexsort é estável: a última chave é a principal
+    ordem = np.lexsort((chave_preco, venda, p_cod, h_cod))
+    idx   = validos[ordem]
+
+    p_ord = precio[idx]
+    e_ord = energia[idx]
+
+    # Fronteiras dos segmentos (hora, pais, tipo) na ordem global
+    grupo   = (h_cod[ordem].astype(np.int64) * len(p_uni) + p_cod[ordem]) * 2 + venda[ordem]
+    inicios = np.flatnonzero(np.r_[True, grupo[1:] != grupo[:-1]])
+    fins    = np.r_[inicios[1:], len(grupo)]
+    g_seg   = grupo[inicios]
+
+    horas_out:   list = []
+    paises_out:  list = []
+    precos_out:  list = []
+    volumes_out: list = []
+
+    k = 0
+    n_seg = len(inicios)
+    while k < n_seg:
+        par = g_seg[k] // 2
+        # Segmento de compras seguido do de vendas do mesmo par (hora, pais)
+        if g_seg[k] % 2 == 0 and k + 1 < n_seg and g_seg[k + 1] == g_seg[k] + 1:
+            c_ini, c_fim = inicios[k],     fins[k]
+            v_ini, v_fim = inicios[k + 1], fins[k + 1]
+
+            if verbose:
+                print(f"  Segmento H={h_uni[par // len(p_uni)]} P={p_uni[par % len(p_uni)]}")
+
+            preco, volume = clearing_arrays(
+                p_ord[c_ini:c_fim], np.cumsum(e_ord[c_ini:c_fim]),
+                p_ord[v_ini:v_fim], np.cumsum(e_ord[v_ini:v_fim]),
+                verbose=verbose,
+            )
+            horas_out.append(h_uni[par // len(p_uni)])
+            paises_out.append(p_uni[par % len(p_uni)])
+            precos_out.append(np.nan if preco is None else preco)
+            volumes_out.append(np.nan if volume is None else volume)
+            k += 2
+        else:
+            k += 1
+
+    return (
+        np.array(horas_out,  dtype=hora.dtype),
+        np.array(paises_out, dtype=pais.dtype),
+        np.array(precos_out,  dtype=np.float64),
+        np.array(volumes_out, dtype=np.float64),
+    )
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  ADAPTADOR PARA DATAFRAMES DE BIDS
+# ─────────────────────────────────────────────────────────────────────────────
+
+def clearing_bids_df(df: pd.DataFrame) -> dict:
+    """
+    Clearing de todos os pares (Hora, Pais) de um DataFrame de bids
+    (colunas Hora, Pais, Tipo Oferta, Precio, Energia) numa única chamada a
+    clearing_segmentado().
+
+    Devolve {(Hora, Pais): (preco, volume)} apenas para os pares com compras e
+    vendas; (None, None) quando as curvas não se cruzam.
+    """
+    if df.empty:
+        return {}
+
+    horas, paises, precos, volumes = clearing_segmentado(
+        df['Hora'].to_numpy(dtype=object),
+        df['Pais'].to_numpy(dtype=object),
+        df['Tipo Oferta'].to_numpy(dtype=object),
+        df['Precio'].to_numpy(dtype=float),
+        df['Energia'].to_numpy(dtype=float),
+    )
+    return {
+        (h, p): (None, None) if np.isnan(pr) else (pr, vol)
+        for h, p, pr, vol in zip(horas, paises, precos, volumes)
+    }
@@ -2,41 +2,77 @@
 """
 MIBEL Platform — Ingestão Worker
 ==================================
-Lê um ficheiro ZIP mensal de bids OMIE (curva_pbc_uof_YYYYMM.zip) e insere
-os dados na tabela mibel.bids_raw do ClickHouse.
+Lê um ou mais ficheiros ZIP mensais de bids OMIE (curva_pbc_uof_YYYYMM.zip),
+indicados directamente ou num directório, e insere os dados na tabela
+mibel.bids_raw do ClickHouse. Em modo --watch continua a vigiar o
+directório e ingere os ZIPs que lá forem aparecendo.
 
 Fluxo:
-  1. Abre o ZIP e lista os ficheiros CSV internos
-  2. Para cada ficheiro CSV interno:
-     a. Verifica se a data já existe em bids_raw (evita duplicados)
-     b. Lê o CSV (sep=";", encoding="latin-1", skiprows=2)
+  1. Abre cada ZIP e lista os ficheiros CSV internos; uma data coberta por
+     vários ficheiros é lida só do último
+  2. Para cada ficheiro CSV interno de todos os ZIPs (num único
+     ProcessPoolExecutor):
+     a. Se a data já tem versão com o mesmo SHA-1, ignora-o (sem alterações);
+        o SHA-1 prévio só é calculado se o tamanho e o CRC32 do membro forem
+        iguais aos registados
+     b. Lê o CSV em streaming, em blocos de BLOCO_LINHAS linhas
+        (sep=";", encoding="latin-1", skiprows=2)
      c. Aplica MAPA_COLUNAS para normalizar nomes de colunas
      d. Normaliza o campo Hora e extrai data do nome do ficheiro
-     e. Insere em lote em mibel.bids_raw
-  3. Regista [STATUS] DONE ou [STATUS] FAILED
+     e. Envia cada bloco de colunas tipadas ao processo principal por uma
+        fila limitada, à medida que é lido
+  3. Um único escritor agrupa os blocos em lotes de até LOTE_LINHAS linhas:
+     cada lote é um INSERT colunar no staging de mibel.bids_raw (uma part
+     no ClickHouse), seguido da versão dos ficheiros concluídos (SHA-1 do
+     CSV) no staging de mibel.bids_versao
+  4. Valida o staging (bids e soma de energia por data e hora) e publica
+     cada mês com ALTER TABLE … REPLACE PARTITION: as datas ingeridas
+     substituem as existentes de forma atómica
+  5. Invalida a cache de clearing original (mibel.clearing_original) das
+     datas publicadas
+  6. Materializa as curvas agregadas por preço (mibel.curvas) das datas
+     publicadas
+  7. Regista [STATUS] DONE ou [STATUS] FAILED
 
 Uso:
     python ingestao_worker.py \\
         --job_id  <UUID> \\
-        --zip_path /data/bids/curva_pbc_uof_YYYYMM.zip \\
+        --zip_path /data/bids/curva_pbc_uof_YYYYMM.zip [...] \\
         [--workers N]
+
+    python ingestao_worker.py --job_id <UUID> --dir /data/bids [--watch [--intervalo S]]
 """
 
 import argparse
+import contextlib
+import hashlib
+import io
+import multiprocessing
 import os
+import queue
+import re
+import signal
 import sys
 import threading
 import traceback
+import uuid
 import zipfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import date, datetime
-from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Optional
 
+import numpy as np
 import pandas as pd
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from utils import get_ch, ch_insert_batch, normaliza_hora, extrai_data, ensure_output_dir
+from utils import (
+    get_ch,
+    StreamingInserter,
+    log, flush_worker_logs,
+    normaliza_hora, extrai_data, concatena_colunas, ensure_output_dir,
+    materializa_curvas_ch,
+)
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  MAPEAMENTO DE COLUNAS — combina todas as variantes conhecidas dos ficheiros OMIE
@@ -70,259 +106,764 @@ MAPA_COLUNAS: dict[str, str] = {
 COLUNAS_OBRIGATORIAS = ('Hora', 'Pais', 'Tipo Oferta', 'Unidad', 'Energia', 'Precio')
 
 # ══════════════════════════════════════════════════════════════════════════════
-#  LOGGING THREAD-SAFE
+#  VERIFICAÇÃO DE DADOS JÁ INGERIDOS
 # ══════════════════════════════════════════════════════════════════════════════
 
-_print_lock = threading.Lock()
+def fingerprints_existentes(ch, datas) -> dict:
+    """
+    {'YYYY-MM-DD': {(fingerprint, tamanho, crc32), …}} das datas indicadas já
+    ingeridas, de qualquer ZIP (mibel.bids_versao). Uma data ingerida de
+    vários CSVs tem vários fingerprints; tamanho e crc32 (do ZipInfo do
+    membro) são 0 nas versões gravadas antes de existirem.
+    """
+    if not datas:
+        return {}
+    rows = ch.execute(
+        "SELECT toString(data_ficheiro), fingerprint, tamanho, crc32 "
+        "FROM mibel.bids_versao "
+        "WHERE data_ficheiro IN %(datas)s",
+        {'datas': tuple(sorted(datas))}
+    )
+    existentes: dict = {}
+    for data_str, fingerprint, tamanho, crc32 in rows:
+        existentes.setdefault(data_str, set()).add((fingerprint, tamanho, crc32))
+    return existentes
+
 
+# ══════════════════════════════════════════════════════════════════════════════
+#  LEITURA EM STREAMING
+# ══════════════════════════════════════════════════════════════════════════════
 
-def log(nivel: str, mensagem: str, job_id: str = '', ch=None) -> None:
-    ts   = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    line = f'[{ts}] [{nivel}] {mensagem}'
-    with _print_lock:
-        print(line, flush=True)
+# Linhas por bloco do parser: o texto do CSV em memória fica limitado a um
+# bloco; só as colunas tipadas do ficheiro seguem para o processo principal
+BLOCO_LINHAS = 100_000
 
-    if ch and job_id:
-        try:
-            ch.execute(
-                'INSERT INTO mibel.worker_logs (job_id, nivel, mensagem) VALUES',
-                [{'job_id': job_id, 'nivel': nivel, 'mensagem': mensagem}]
-            )
-        except Exception:
-            pass
+# Linhas por INSERT do escritor (~60-80 MB não comprimidos). Abaixo do
+# insert_block_size do clickhouse-driver (1 048 576), cada lote chega ao
+# ClickHouse como um único bloco, i.e. uma única part por lote
+LOTE_LINHAS = 1_000_000
 
+# Colunas de mibel.bids_raw devolvidas por le_csv_interno; data_ficheiro,
+# ficheiro_nome e zip_nome são constantes por ficheiro
+COLUNAS_FICHEIRO = (
+    'hora_raw', 'hora_num', 'periodo_formato', 'pais',
+    'tipo_oferta', 'unidade', 'energia', 'precio',
+)
+COLUNAS_BIDS = ('data_ficheiro', 'ficheiro_nome', 'zip_nome') + COLUNAS_FICHEIRO
 
-# ══════════════════════════════════════════════════════════════════════════════
-#  VERIFICAÇÃO DE DADOS JÁ INGERIDOS
-# ══════════════════════════════════════════════════════════════════════════════
 
-def datas_ja_ingeridas(ch, zip_nome: str) -> set:
+class LeitorComHash(io.RawIOBase):
     """
-    Devolve o conjunto de datas (strings 'YYYY-MM-DD') já presentes em
-    mibel.bids_raw para o ZIP indicado, para evitar duplicados.
+    Stream binário que calcula o SHA-1 dos bytes à medida que são lidos.
+
+    Envolve o membro descomprimido do ZIP, para que a impressão digital da
+    data (mibel.bids_versao) seja obtida na mesma passagem do parser, sem
+    guardar o ficheiro em memória.
     """
-    rows = ch.execute(
-        "SELECT DISTINCT toString(data_ficheiro) "
-        "FROM mibel.bids_raw "
-        "WHERE zip_nome = %(zip)s",
-        {'zip': zip_nome}
+
+    def __init__(self, origem):
+        self._origem = origem
+        self._sha1   = hashlib.sha1()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        dados = self._origem.read(len(b))
+        n = len(dados)
+        b[:n] = dados
+        self._sha1.update(dados)
+        return n
+
+    def hexdigest(self) -> str:
+        """SHA-1 do ficheiro completo (consome o que o parser não leu)."""
+        while dados := self._origem.read(1 << 20):
+            self._sha1.update(dados)
+        return self._sha1.hexdigest()
+
+
+def colunas_bloco(df: pd.DataFrame) -> dict:
+    """
+    Converte um bloco do CSV (colunas já normalizadas por MAPA_COLUNAS) nas
+    COLUNAS_FICHEIRO de mibel.bids_raw (arrays numpy), só com as linhas C/V.
+    """
+    # Converter Energia e Precio (formato ibérico: ponto=milhar, vírgula=decimal)
+    energia, precio = (
+        pd.to_numeric(
+            df[col].astype(str)
+            .str.replace('.', '', regex=False)
+            .str.replace(',', '.', regex=False),
+            errors='coerce',
+        ).fillna(0.0).to_numpy(dtype=np.float64)
+        for col in ('Energia', 'Precio')
     )
-    return {r[0] for r in rows}
+
+    tipo    = df['Tipo Oferta'].astype(str).str.strip().str.upper()
+    validas = tipo.isin(('C', 'V')).to_numpy()
+
+    # normaliza_hora só é aplicada aos poucos valores distintos do período
+    # (24, 25 ou 96 por ficheiro) e o resultado é expandido pelos códigos
+    codigos, distintos = pd.factorize(df['Hora'].astype(str).str.strip().to_numpy()[validas])
+    horas = [normaliza_hora(v) for v in distintos]
+
+    return {
+        'hora_raw':        np.array([h[0] for h in horas], dtype=object)[codigos],
+        'hora_num':        np.array([h[1] for h in horas], dtype=np.int64)[codigos],
+        'periodo_formato': np.array([h[2] for h in horas], dtype=object)[codigos],
+        'pais':            df['Pais'].astype(str).str.strip().to_numpy()[validas],
+        'tipo_oferta':     tipo.to_numpy()[validas],
+        'unidade':         df['Unidad'].astype(str).str.strip().to_numpy()[validas],
+        'energia':         energia[validas],
+        'precio':          precio[validas],
+    }
 
 
 # ══════════════════════════════════════════════════════════════════════════════
-#  PROCESSAMENTO DE UM FICHEIRO CSV INTERNO AO ZIP
+#  PROCESSAMENTO DE UM FICHEIRO CSV INTERNO AO ZIP (processo filho)
 # ══════════════════════════════════════════════════════════════════════════════
 
-def processa_csv_interno(
-    zip_path:       str,
-    internal_file:  str,
-    zip_nome:       str,
-    datas_existentes: set,
-    job_id:         str,
-) -> tuple[int, str]:
-    """
-    Lê um ficheiro CSV de dentro do ZIP, faz parsing e insere em mibel.bids_raw.
+# Motivo devolvido por le_csv_interno quando o conteúdo é igual ao já ingerido
+INALTERADO = 'inalterado'
+
+# Fila limitada pela qual os processos de leitura enviam os blocos ao processo
+# principal (definida pelo initializer do pool, _inicia_processo)
+_FILA_BLOCOS = None
+
+
+def _inicia_processo(fila) -> None:
+    """Initializer do ProcessPoolExecutor: guarda a fila de blocos do pool."""
+    global _FILA_BLOCOS
+    _FILA_BLOCOS = fila
 
-    Cada thread cria a sua própria ligação ao ClickHouse para inserir em paralelo.
 
-    Devolve (n_inserido, status):
-      n_inserido ≥ 0  — número de linhas inseridas
-      n_inserido = -1 — data já existia (ignorado)
-      status: 'ok' | 'skip' | 'error'
+def sha1_membro(zip_path: str, internal_file: str) -> str:
+    """SHA-1 de um membro do ZIP, lido em streaming."""
+    sha1 = hashlib.sha1()
+    with zipfile.ZipFile(zip_path, 'r') as z, z.open(internal_file) as f:
+        while dados := f.read(1 << 20):
+            sha1.update(dados)
+    return sha1.hexdigest()
+
+
+def le_csv_interno(membro: tuple[str, str, str, str]) -> None:
     """
-    data_str = extrai_data(internal_file)
+    Lê o ficheiro CSV membro = (execucao, zip_path, internal_file,
+    fingerprint_actual) em streaming e converte-o, bloco a bloco, nas
+    COLUNAS_FICHEIRO de mibel.bids_raw. Corre num processo do pool, sem
+    ligação ao ClickHouse: a escrita é feita pelo processo principal.
+
+    O membro descomprimido alimenta directamente o parser (latin-1, blocos de
+    BLOCO_LINHAS linhas) e cada bloco segue pela fila _FILA_BLOCOS antes de o
+    seguinte ser lido: a memória do processo fica limitada a um bloco e a
+    fila limitada trava a leitura quando o escritor não acompanha. O SHA-1
+    do ficheiro é calculado na mesma passagem.
+
+    Mensagens enviadas, sempre terminadas por 'fim' ou 'falha':
+      ('bloco', membro, colunas)       — um bloco com linhas C/V
+      ('fim',   membro, fingerprint)   — ficheiro lido por completo
+      ('falha', membro, motivo, erro)  — ficheiro sem dados válidos (erro
+                                         False) ou excepção na leitura (erro
+                                         True), possivelmente após alguns blocos
+
+    Se a data já tem um único fingerprint (fingerprint_actual) e o SHA-1 do
+    membro é igual, o ficheiro não é lido: termina com ('falha', membro,
+    INALTERADO, False), para que reenviar os mesmos dados não altere nada.
+    Este SHA-1 prévio descomprime o membro uma vez a mais quando afinal
+    mudou; ingere_zips só o pede se o tamanho e o CRC32 do ZipInfo forem
+    iguais aos da versão registada (ou desconhecidos).
+    """
+    _, zip_path, internal_file, fingerprint_actual = membro
+    try:
+        if fingerprint_actual and sha1_membro(zip_path, internal_file) == fingerprint_actual:
+            _FILA_BLOCOS.put(('falha', membro, INALTERADO, False))
+            return
+
+        n_blocos = 0
+        with zipfile.ZipFile(zip_path, 'r') as z, z.open(internal_file) as f:
+            leitor = LeitorComHash(f)
+            for df in pd.read_csv(
+                io.BufferedReader(leitor), sep=';', dtype=str, skiprows=2,
+                encoding='latin-1', chunksize=BLOCO_LINHAS,
+            ):
+                df.columns = [c.strip() for c in df.columns]
+                df = df.rename(columns=MAPA_COLUNAS)
+
+                # Verificar colunas obrigatórias (cabeçalho, primeiro bloco)
+                faltam = [c for c in COLUNAS_OBRIGATORIAS if c not in df.columns]
+                if faltam:
+                    _FILA_BLOCOS.put(('falha', membro, f'colunas em falta {faltam} — ignorado', False))
+                    return
+
+                bloco = colunas_bloco(df)
+                if len(bloco['tipo_oferta']):
+                    _FILA_BLOCOS.put(('bloco', membro, bloco))
+                    n_blocos += 1
+            fingerprint = leitor.hexdigest()
+
+        if not n_blocos:
+            _FILA_BLOCOS.put(('falha', membro, 'nenhuma linha C/V válida após parsing', False))
+        else:
+            _FILA_BLOCOS.put(('fim', membro, fingerprint))
+    except Exception as e:
+        _FILA_BLOCOS.put(('falha', membro, f'falha na leitura — {e}', True))
+
 
-    # Ignorar se a data já está no ClickHouse
-    if data_str in datas_existentes:
-        return -1, 'skip'
+def le_em_processos(pool: ProcessPoolExecutor, fila, membros, max_em_curso: int):
+    """
+    Lê os membros (zip_path, internal_file, fingerprint_actual) com
+    le_csv_interno nos processos do pool, com no máximo max_em_curso
+    ficheiros em leitura, e produz as mensagens da fila pela ordem de
+    chegada, com o membro sem o identificador da execução. Os blocos de
+    ficheiros diferentes chegam intercalados; os de cada ficheiro chegam por
+    ordem e antes da sua mensagem final.
+
+    Ao terminar antes do fim (excepção no consumidor), esvazia a fila até os
+    ficheiros em leitura terminarem, para que nenhum processo fique bloqueado
+    na fila; mensagens de execuções interrompidas são ignoradas.
+    """
+    execucao  = uuid.uuid4().hex
+    pendentes = iter(membros)
+    em_curso: dict = {}   # {(execucao, zip_path, ficheiro, fingerprint): futuro}
+
+    def _enche() -> None:
+        while len(em_curso) < max(1, max_em_curso):
+            membro = next(pendentes, None)
+            if membro is None:
+                return
+            chave = (execucao, *membro)
+            em_curso[chave] = pool.submit(le_csv_interno, chave)
 
-    # ── Leitura do CSV ───────────────────────────────────────────────────────
     try:
-        with zipfile.ZipFile(zip_path, 'r') as z:
-            with z.open(internal_file) as f:
-                content = f.read().decode('latin-1')
+        _enche()
+        while em_curso:
+            try:
+                mensagem = fila.get(timeout=1.0)
+            except queue.Empty:
+                # Processo terminado sem mensagem final (ex.: pool interrompido)
+                for chave, fut in list(em_curso.items()):
+                    if fut.done() and fut.exception() is not None:
+                        del em_curso[chave]
+                        yield 'falha', chave[1:], f'falha na leitura — {fut.exception()}', True
+                _enche()
+                continue
+
+            tipo, chave = mensagem[0], mensagem[1]
+            if chave not in em_curso:
+                continue
+            if tipo != 'bloco':
+                del em_curso[chave]
+                _enche()
+            yield (tipo, chave[1:], *mensagem[2:])
+    finally:
+        for fut in em_curso.values():
+            fut.cancel()
+        while not all(fut.done() for fut in em_curso.values()):
+            try:
+                fila.get(timeout=0.1)
+            except queue.Empty:
+                pass
 
-        df = pd.read_csv(StringIO(content), sep=';', dtype=str, skiprows=2)
-        df.columns = [c.strip() for c in df.columns]
-        df = df.rename(columns=MAPA_COLUNAS)
-        df = df.dropna(axis=1, how='all').dropna(axis=0, how='all')
 
-    except Exception as e:
-        with _print_lock:
-            print(f'[ERRO] {internal_file}: falha na leitura — {e}', flush=True)
-        return 0, 'error'
+# ══════════════════════════════════════════════════════════════════════════════
+#  ESCRITOR EM LOTES
+# ══════════════════════════════════════════════════════════════════════════════
 
-    # Verificar colunas obrigatórias
-    faltam = [c for c in COLUNAS_OBRIGATORIAS if c not in df.columns]
-    if faltam:
-        with _print_lock:
-            print(f'[AVISO] {internal_file}: colunas em falta {faltam} — ignorado', flush=True)
-        return 0, 'error'
+class LotesBids:
+    """
+    Agrupa blocos já lidos (de um ou vários ficheiros e ZIPs) em lotes de até
+    LOTE_LINHAS bids e entrega cada lote ao StreamingInserter como uma
+    unidade: um INSERT colunar nos bids e, depois dele, a versão de cada
+    ficheiro concluído desde o lote anterior, nas tabelas de staging
+    indicadas. A versão de um ficheiro segue sempre no lote do seu último
+    bloco ou num posterior, i.e. depois de todos os seus bids.
+
+    Guarda também o controlo de cada (data, hora_raw) escrita — número de
+    bids e soma da energia — para validar o staging antes da publicação.
+    """
 
-    # Converter Energia e Precio (formato ibérico: ponto=milhar, vírgula=decimal)
-    for col in ('Energia', 'Precio'):
-        df[col] = (
-            df[col].astype(str)
-            .str.replace('.', '', regex=False)
-            .str.replace(',', '.', regex=False)
-            .apply(pd.to_numeric, errors='coerce')
-            .fillna(0.0)
+    def __init__(self, escritor: StreamingInserter, tabela_bids: str, tabela_versao: str):
+        self._escritor      = escritor
+        self._tabela_bids   = tabela_bids
+        self._tabela_versao = tabela_versao
+        self._blocos: list   = []
+        self._versoes: list  = []
+        self._n = 0
+        self.n_lotes = 0
+        self.controlo: dict = {}   # {(YYYY-MM-DD, hora_raw): (n, soma energia)}
+        self._n_data: dict  = {}   # {YYYY-MM-DD: bids recebidos}
+
+    def adiciona(self, zip_nome: str, data_date: date, internal_file: str, colunas: dict) -> int:
+        """Junta um bloco de um ficheiro ao lote; devolve o número de bids."""
+        n = len(colunas['tipo_oferta'])
+        # Envia o lote antes de o bloco o fazer passar de LOTE_LINHAS
+        if self._n and self._n + n > LOTE_LINHAS:
+            self.envia()
+        self._blocos.append({
+            'data_ficheiro': np.full(n, data_date, dtype=object),
+            'ficheiro_nome': np.full(n, internal_file, dtype=object),
+            'zip_nome':      np.full(n, zip_nome, dtype=object),
+            **colunas,
+        })
+        self._n += n
+
+        data_str = data_date.isoformat()
+        self._n_data[data_str] = self._n_data.get(data_str, 0) + n
+        horas, codigos = np.unique(colunas['hora_raw'], return_inverse=True)
+        contagens = np.bincount(codigos, minlength=len(horas))
+        somas     = np.bincount(codigos, weights=colunas['energia'], minlength=len(horas))
+        for h, c, soma in zip(horas, contagens, somas):
+            n_ant, soma_ant = self.controlo.get((data_str, h), (0, 0.0))
+            self.controlo[(data_str, h)] = (n_ant + int(c), soma_ant + float(soma))
+
+        if self._n >= LOTE_LINHAS:
+            self.envia()
+        return n
+
+    def conclui(self, zip_nome: str, data_date: date, internal_file: str, fingerprint: str,
+                tamanho: int, crc32: int) -> int:
+        """
+        Regista a versão de um ficheiro lido por completo (SHA-1, tamanho e
+        CRC32 do membro), escrita com o lote pendente; devolve o número de
+        bids do ficheiro.
+        """
+        n = self._n_data.get(data_date.isoformat(), 0)
+        self._versoes.append({
+            'data_ficheiro': data_date,
+            'ficheiro_nome': internal_file,
+            'zip_nome':      zip_nome,
+            'fingerprint':   fingerprint,
+            'tamanho':       tamanho,
+            'crc32':         crc32,
+            'n_bids':        n,
+        })
+        return n
+
+    def descarta(self, data_date: date) -> bool:
+        """
+        Esquece o controlo de uma data cujo ficheiro falhou a meio. Devolve
+        True se já tinham sido recebidos bids dela (a retirar do staging).
+        """
+        data_str = data_date.isoformat()
+        self.controlo = {k: v for k, v in self.controlo.items() if k[0] != data_str}
+        return self._n_data.pop(data_str, 0) > 0
+
+    def envia(self) -> None:
+        """Entrega o lote pendente ao escritor (bloqueia se a fila estiver cheia)."""
+        if not self._blocos and not self._versoes:
+            return
+        inserts = []
+        if self._blocos:
+            inserts.append((self._tabela_bids, concatena_colunas(self._blocos, COLUNAS_BIDS), True))
+            self.n_lotes += 1
+        if self._versoes:
+            inserts.append((self._tabela_versao, self._versoes, False))
+        self._escritor.put(inserts)
+        self._blocos, self._versoes, self._n = [], [], 0
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  STAGING E PUBLICAÇÃO POR PARTIÇÃO
+# ══════════════════════════════════════════════════════════════════════════════
+
+class Staging:
+    """
+    Tabelas de staging de uma ingestão, com a estrutura, o particionamento
+    mensal e a ordenação de mibel.bids_raw e mibel.bids_versao (CREATE TABLE
+    … AS), para que as suas partições possam substituir as das tabelas
+    principais com ALTER TABLE … REPLACE PARTITION.
+
+    Os bids novos são escritos no staging e validados contra o controlo do
+    escritor (bids e soma da energia por data e hora). Cada mês é então
+    completado com as datas que não mudam e trocado de uma só vez: os
+    estudos vêem o mês antigo ou o novo, nunca um dia parcial ou duplicado.
+    Duas ingestões do mesmo mês não devem correr em simultâneo — a última
+    publicação prevalece.
+    """
+
+    def __init__(self, ch):
+        self._ch = ch
+        sufixo   = uuid.uuid4().hex[:12]
+        self.bids   = f'mibel.bids_raw_staging_{sufixo}'
+        self.versao = f'mibel.bids_versao_staging_{sufixo}'
+
+    def cria(self) -> None:
+        self._ch.execute(f'CREATE TABLE {self.bids} AS mibel.bids_raw')
+        self._ch.execute(f'CREATE TABLE {self.versao} AS mibel.bids_versao')
+
+    def remove(self) -> None:
+        for tabela in (self.bids, self.versao):
+            self._ch.execute(f'DROP TABLE IF EXISTS {tabela}')
+
+    def remove_datas(self, datas) -> None:
+        """Retira do staging os bids das datas indicadas (ficheiros que falharam a meio)."""
+        self._ch.execute(
+            f'ALTER TABLE {self.bids} DELETE WHERE data_ficheiro IN %(datas)s',
+            {'datas': tuple(sorted(datas))},
+            settings={'mutations_sync': 2},
         )
 
-    # Converter data_str para objecto date
-    try:
-        data_date = date.fromisoformat(data_str) if data_str != '1970-01-01' else None
-    except ValueError:
-        data_date = None
-
-    if data_date is None:
-        with _print_lock:
-            print(f'[AVISO] {internal_file}: data não reconhecida ("{data_str}") — ignorado', flush=True)
-        return 0, 'error'
-
-    # ── Construção das linhas para inserção ──────────────────────────────────
-    rows: list[dict] = []
-    for _, row in df.iterrows():
-        hora_val = str(row.get('Hora', '')).strip()
-        hora_raw, hora_num, periodo_fmt = normaliza_hora(hora_val)
-
-        tipo = str(row.get('Tipo Oferta', '')).strip().upper()
-        if tipo not in ('C', 'V'):
+    def datas_invalidas(self, controlo: dict) -> dict:
+        """
+        Compara o staging com o controlo {(data, hora_raw): (n, soma energia)}
+        do escritor. Devolve {data: motivo} das datas que não coincidem.
+        """
+        rows = self._ch.execute(
+            f"SELECT toString(data_ficheiro), hora_raw, count(), sum(energia) "
+            f"FROM {self.bids} "
+            f"GROUP BY data_ficheiro, hora_raw"
+        )
+        escritas = {(d, h): (n, soma) for d, h, n, soma in rows}
+
+        invalidas: dict = {}
+        for chave in controlo.keys() | escritas.keys():
+            esperado = controlo.get(chave, (0, 0.0))
+            obtido   = escritas.get(chave, (0, 0.0))
+            if esperado[0] != obtido[0]:
+                invalidas[chave[0]] = f'hora {chave[1]}: {obtido[0]} bids em vez de {esperado[0]}'
+            elif not np.isclose(esperado[1], obtido[1], rtol=1e-9, atol=1e-6):
+                invalidas[chave[0]] = f'hora {chave[1]}: soma de energia {obtido[1]} em vez de {esperado[1]}'
+        return invalidas
+
+    def publica_mes(self, mes: int, datas: list) -> None:
+        """
+        Troca a partição mes (YYYYMM) de mibel.bids_raw e mibel.bids_versao
+        pela do staging, depois de lhe juntar as datas do mês que não estão
+        a ser (re)ingeridas. Os bids são trocados antes da versão: uma falha
+        entre as duas deixa a versão antiga, e a data volta a ser ingerida.
+        """
+        params = {'mes': mes, 'datas': tuple(date.fromisoformat(d) for d in datas)}
+        for principal, staging in (('mibel.bids_raw', self.bids), ('mibel.bids_versao', self.versao)):
+            self._ch.execute(
+                f'INSERT INTO {staging} '
+                f'SELECT * FROM {principal} '
+                f'WHERE toYYYYMM(data_ficheiro) = %(mes)s AND data_ficheiro NOT IN %(datas)s',
+                params,
+            )
+        for principal, staging in (('mibel.bids_raw', self.bids), ('mibel.bids_versao', self.versao)):
+            self._ch.execute(f'ALTER TABLE {principal} REPLACE PARTITION {int(mes)} FROM {staging}')
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  INGESTÃO DE UM CONJUNTO DE ZIPs
+# ══════════════════════════════════════════════════════════════════════════════
+
+def membros_do_zip(zip_path: str, job_id: str, ch, totais: dict) -> dict:
+    """
+    Lista os ficheiros CSV de um ZIP com data reconhecida:
+    {(zip_path, ficheiro): (date, tamanho, crc32)}, com o tamanho
+    descomprimido e o CRC32 do ZipInfo. Ficheiros com data inválida são
+    contados em totais.
+    """
+    zip_nome = os.path.basename(zip_path)
+
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        infos = {
+            i.filename: (i.file_size, i.CRC) for i in z.infolist()
+            if not i.is_dir()  # excluir directórios
+        }
+    internal_files = list(infos)
+
+    log('INFO', f'{zip_nome}: {len(internal_files)} ficheiro(s) interno(s) encontrado(s)', job_id, ch)
+    if not internal_files:
+        log('AVISO', f'{zip_nome}: ZIP vazio — nada a processar', job_id, ch)
+        return {}
+
+    membros: dict = {}
+    for ifile in internal_files:
+        data_str = extrai_data(ifile)
+        try:
+            data_date = date.fromisoformat(data_str) if data_str != '1970-01-01' else None
+        except ValueError:
+            data_date = None
+        if data_date is None:
+            totais['erros'] += 1
+            log('AVISO', f'{ifile}: data não reconhecida ("{data_str}") — ignorado', job_id, ch)
             continue
+        membros[(zip_path, ifile)] = (data_date, *infos[ifile])
+    return membros
 
-        rows.append({
-            'data_ficheiro':   data_date,
-            'ficheiro_nome':   internal_file,
-            'zip_nome':        zip_nome,
-            'hora_raw':        hora_raw,
-            'hora_num':        hora_num,
-            'periodo_formato': periodo_fmt,
-            'pais':            str(row.get('Pais', '')).strip(),
-            'tipo_oferta':     tipo,
-            'unidade':         str(row.get('Unidad', '')).strip(),
-            'energia':         float(row.get('Energia', 0.0) or 0.0),
-            'precio':          float(row.get('Precio', 0.0) or 0.0),
-        })
 
-    if not rows:
-        with _print_lock:
-            print(f'[AVISO] {internal_file}: nenhuma linha C/V válida após parsing', flush=True)
-        return 0, 'error'
+def ingere_zips(zip_paths: list, pool: ProcessPoolExecutor, fila, n_workers: int,
+                job_id: str, ch) -> dict:
+    """
+    Ingere um conjunto de ZIPs com um único pool de processos e um único
+    escritor: os ficheiros CSV de todos os ZIPs entram na mesma janela de
+    2 × n_workers leituras em curso, os seus blocos chegam pela fila
+    limitada do pool (fila) e seguem nos mesmos lotes de escrita, pelo que
+    a concorrência e a memória não dependem do número de ZIPs.
+
+    Cada data é identificada pela data, qualquer que seja o ZIP de origem:
+    um ficheiro com o mesmo conteúdo (SHA-1) que a versão já ingerida é
+    ignorado; caso contrário substitui a data inteira. A escrita passa pelo
+    staging e cada mês afectado é publicado atomicamente (Staging).
+
+    Devolve os totais {'inseridos', 'ignorados', 'erros', 'datas'}.
+    """
+    totais = {'inseridos': 0, 'ignorados': 0, 'erros': 0, 'datas': set()}
 
-    # ── Inserção no ClickHouse (ligação própria da thread) ───────────────────
-    ch_thread = get_ch()
+    # Um ficheiro por data: se vários ZIPs (ou ficheiros) cobrem a mesma
+    # data, prevalece o último, pela ordem dos ZIPs e dos ficheiros
+    por_data: dict = {}      # {date: (zip_path, ficheiro)}
+    assinaturas: dict = {}   # {(zip_path, ficheiro): (tamanho, crc32)}
+    for zip_path in zip_paths:
+        try:
+            membros = membros_do_zip(zip_path, job_id, ch, totais)
+        except Exception as e:
+            totais['erros'] += 1
+            log('ERRO', f'Não foi possível abrir o ZIP {zip_path}: {e}', job_id, ch)
+            continue
+        for membro, (data_date, *assinatura) in membros.items():
+            assinaturas[membro] = tuple(assinatura)
+            if data_date in por_data:
+                totais['ignorados'] += 1
+                log('AVISO',
+                    f'{data_date}: {por_data[data_date][1]} substituído por {membro[1]} '
+                    f'({os.path.basename(membro[0])})',
+                    job_id, ch)
+            por_data[data_date] = membro
+
+    if not por_data:
+        return totais
+
+    # Conteúdo já ingerido: só uma data com um único fingerprint pode
+    # coincidir. Se o tamanho ou o CRC32 do membro diferem dos registados, o
+    # conteúdo mudou e o SHA-1 prévio (uma descompressão a mais) é evitado
+    existentes = fingerprints_existentes(ch, list(por_data))
+    a_ler: dict = {}   # {(zip_path, ficheiro, fingerprint_actual): date}
+    for data_date, (zip_path, ifile) in sorted(por_data.items()):
+        fps = existentes.get(data_date.isoformat(), set())
+        fingerprint_actual = ''
+        if len(fps) == 1:
+            fingerprint, tamanho, crc32 = next(iter(fps))
+            if not tamanho or (tamanho, crc32) == assinaturas[(zip_path, ifile)]:
+                fingerprint_actual = fingerprint
+        a_ler[(zip_path, ifile, fingerprint_actual)] = data_date
+    log('INFO',
+        f'{len(a_ler)} data(s) a ingerir ({len(existentes)} já existente(s): '
+        f'ignoradas se o conteúdo não mudou, substituídas caso contrário)',
+        job_id, ch)
+
+    # ── Leitura em processos, escrita em lotes no staging ────────────────────
+    # A janela de ficheiros em curso e a fila limitada do escritor mantêm a
+    # memória limitada, qualquer que seja o número de ficheiros.
+    staging  = Staging(ch)
+    escritor: Optional[StreamingInserter] = None
     try:
-        inserted = ch_insert_batch(ch_thread, 'mibel.bids_raw', rows)
+        staging.cria()
+        escritor = StreamingInserter(max_pending=2, batch_size=LOTE_LINHAS)
+        lotes    = LotesBids(escritor, staging.bids, staging.versao)
+        lidos    = 0
+        concluidos = 0
+        parciais: list = []   # datas com bids no staging cujo ficheiro falhou
+        mensagens = le_em_processos(pool, fila, a_ler, 2 * n_workers)
+        with contextlib.closing(mensagens):
+            for tipo, membro, *resto in mensagens:
+                zip_path, ifile, _ = membro
+                zip_nome  = os.path.basename(zip_path)
+                data_date = a_ler[membro]
+                if tipo == 'bloco':
+                    lidos += lotes.adiciona(zip_nome, data_date, ifile, resto[0])
+                    continue
+
+                concluidos += 1
+                prefixo = f'[{concluidos}/{len(a_ler)}] {ifile}'
+                if tipo == 'fim':
+                    n = lotes.conclui(zip_nome, data_date, ifile, resto[0],
+                                      *assinaturas[(zip_path, ifile)])
+                    log('OK', f'{prefixo}: {n} bids lidos  (total: {lidos})', job_id, ch)
+                    continue
+
+                motivo, erro = resto
+                if motivo == INALTERADO:
+                    totais['ignorados'] += 1
+                    log('INFO', f'{prefixo}: conteúdo igual ao já ingerido — ignorado', job_id, ch)
+                    continue
+                totais['erros'] += 1
+                log('ERRO' if erro else 'AVISO', f'{prefixo}: {motivo}', job_id, ch)
+                if lotes.descarta(data_date):
+                    parciais.append(data_date)
+
+        lotes.envia()
+        escritor.close()
+        if parciais:
+            staging.remove_datas(parciais)
+            log('AVISO', f'Staging: retirados os bids parciais de {len(parciais)} data(s)', job_id, ch)
+        log('INFO', f'Staging: {lidos} bids em {lotes.n_lotes} lote(s)', job_id, ch)
+
+        # ── Validação (bids e soma de energia por data e hora) ────────────────
+        invalidas = staging.datas_invalidas(lotes.controlo)
+        por_mes: dict = {}   # {YYYYMM: [datas]}
+        for data_str, _ in lotes.controlo:
+            por_mes.setdefault(int(data_str[:4] + data_str[5:7]), set()).add(data_str)
+
+        # ── Publicação atómica por mês ────────────────────────────────────────
+        for mes, datas in sorted(por_mes.items()):
+            erradas = sorted(d for d in datas if d in invalidas)
+            if erradas:
+                totais['erros'] += len(datas)
+                for d in erradas:
+                    log('ERRO', f'{d}: staging inválido ({invalidas[d]})', job_id, ch)
+                log('ERRO', f'Mês {mes} não publicado: {len(erradas)} data(s) inválida(s)', job_id, ch)
+                continue
+            staging.publica_mes(mes, sorted(datas))
+            n_mes = sum(n for (d, _), (n, _) in lotes.controlo.items() if d in datas)
+            totais['inseridos'] += n_mes
+            totais['datas'] |= datas
+            log('OK', f'Mês {mes} publicado: {len(datas)} data(s), {n_mes} bids', job_id, ch)
     finally:
+        if escritor is not None:
+            escritor.close(raise_error=False)
         try:
-            ch_thread.disconnect()
-        except Exception:
-            pass
+            staging.remove()
+        except Exception as e:
+            log('AVISO', f'Não foi possível remover o staging {staging.bids}: {e}', job_id, ch)
+
+    datas_novas = totais['datas']
+    if datas_novas:
+        # ── Invalidar a cache de clearing original das datas publicadas ──────
+        # (as novas versões já não coincidem; isto só liberta as entradas antigas)
+        ch.execute(
+            'DELETE FROM mibel.clearing_original WHERE data_ficheiro IN %(datas)s',
+            {'datas': tuple(date.fromisoformat(d) for d in sorted(datas_novas))},
+        )
+        log('INFO',
+            f'Cache de clearing original invalidada para {len(datas_novas)} data(s)',
+            job_id, ch)
+
+        # ── Curvas agregadas por preço (vista de curvas do explorador) ───────
+        materializa_curvas_ch(ch, datas_novas)
+        log('INFO', f'Curvas materializadas para {len(datas_novas)} data(s)', job_id, ch)
+
+    return totais
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  DIRECTÓRIO VIGIADO
+# ══════════════════════════════════════════════════════════════════════════════
 
-    return inserted, 'ok'
+PADRAO_ZIP = re.compile(r'^curva_pbc_uof_\d{6}\.zip$')
+
+
+def zips_no_directorio(directorio: str) -> dict:
+    """{caminho: (tamanho, mtime)} dos ZIPs OMIE (curva_pbc_uof_YYYYMM.zip) do directório."""
+    zips = {}
+    for nome in sorted(os.listdir(directorio)):
+        caminho = os.path.join(directorio, nome)
+        if PADRAO_ZIP.match(nome) and os.path.isfile(caminho):
+            st = os.stat(caminho)
+            zips[caminho] = (st.st_size, st.st_mtime)
+    return zips
+
+
+def vigia_directorio(directorio: str, intervalo: float, pool: ProcessPoolExecutor, fila,
+                     n_workers: int, job_id: str, ch, parar: threading.Event) -> dict:
+    """
+    Ingere os ZIPs novos ou alterados do directório a cada intervalo
+    segundos, até parar ser assinalado (SIGTERM / SIGINT). Um ZIP só é
+    ingerido quando o tamanho e o mtime se mantêm entre duas leituras do
+    directório, para não ler ficheiros ainda a ser copiados.
+    """
+    totais  = {'inseridos': 0, 'ignorados': 0, 'erros': 0, 'datas': set()}
+    vistos: dict    = {}   # {caminho: (tamanho, mtime)} já ingeridos
+    anterior: dict  = {}
+
+    while not parar.is_set():
+        actual   = zips_no_directorio(directorio)
+        estaveis = [
+            c for c, assinatura in actual.items()
+            if vistos.get(c) != assinatura and anterior.get(c) == assinatura
+        ]
+        if estaveis:
+            log('INFO', f'{len(estaveis)} ZIP(s) novo(s) em {directorio}', job_id, ch)
+            parcial = ingere_zips(estaveis, pool, fila, n_workers, job_id, ch)
+            for chave in ('inseridos', 'ignorados', 'erros'):
+                totais[chave] += parcial[chave]
+            totais['datas'] |= parcial['datas']
+            vistos.update((c, actual[c]) for c in estaveis)
+        anterior = actual
+        parar.wait(intervalo)
+
+    return totais
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  ORQUESTRADOR PRINCIPAL
 # ══════════════════════════════════════════════════════════════════════════════
 
-def run_worker(job_id: str, zip_path: str, n_workers: int = 4) -> bool:
+def run_worker(job_id: str, zip_paths: list = (), n_workers: int = 4,
+               directorio: str = '', watch: bool = False, intervalo: float = 30.0) -> bool:
     """
     Ponto de entrada principal do worker de ingestão.
-    Lê o ZIP, processa em paralelo e insere em mibel.bids_raw.
+
+    Ingere os ZIPs indicados em zip_paths e/ou todos os ZIPs OMIE do
+    directorio. Com watch=True, continua a vigiar o directório e ingere os
+    ZIPs que lá forem aparecendo, até receber SIGTERM/SIGINT.
+
+    Os CSVs são lidos em paralelo por um único pool de n_workers processos,
+    partilhado por todos os ZIPs (o parsing é limitado por CPU); os blocos
+    de colunas voltam ao processo principal por uma fila limitada e um único
+    escritor insere-os em lotes de até LOTE_LINHAS bids, em vez de um INSERT
+    por ficheiro e por thread — menos parts e maiores no ClickHouse.
     """
     ch = None
+    pool: Optional[ProcessPoolExecutor] = None
+    zip_paths = [zip_paths] if isinstance(zip_paths, str) else list(zip_paths)
 
     try:
         ensure_output_dir()
         ch = get_ch()
 
-        zip_nome = os.path.basename(zip_path)
-
         log('INFO', '═' * 60, job_id, ch)
         log('INFO', f'Job ID    : {job_id}', job_id, ch)
-        log('INFO', f'ZIP       : {zip_path}', job_id, ch)
+        for zip_path in zip_paths:
+            log('INFO', f'ZIP       : {zip_path}', job_id, ch)
+        if directorio:
+            log('INFO', f'Directório: {directorio}' + (f' (vigiado, {intervalo:g}s)' if watch else ''),
+                job_id, ch)
         log('INFO', f'Workers   : {n_workers}', job_id, ch)
         log('INFO', '═' * 60, job_id, ch)
 
-        # Verificar existência do ficheiro
-        if not os.path.isfile(zip_path):
-            log('ERRO', f'Ficheiro não encontrado: {zip_path}', job_id, ch)
+        # Verificar existência dos ficheiros / directório
+        for zip_path in zip_paths:
+            if not os.path.isfile(zip_path):
+                log('ERRO', f'Ficheiro não encontrado: {zip_path}', job_id, ch)
+                log('STATUS', 'FAILED', job_id, ch)
+                return False
+        if directorio and not os.path.isdir(directorio):
+            log('ERRO', f'Directório não encontrado: {directorio}', job_id, ch)
             log('STATUS', 'FAILED', job_id, ch)
             return False
 
-        # Listar ficheiros internos do ZIP
-        try:
-            with zipfile.ZipFile(zip_path, 'r') as z:
-                internal_files = [
-                    f for f in z.namelist()
-                    if not f.endswith('/')  # excluir directórios
-                ]
-        except Exception as e:
-            log('ERRO', f'Não foi possível abrir o ZIP: {e}', job_id, ch)
-            log('STATUS', 'FAILED', job_id, ch)
-            return False
-
-        log('INFO', f'{zip_nome}: {len(internal_files)} ficheiro(s) interno(s) encontrado(s)', job_id, ch)
-
-        if not internal_files:
-            log('AVISO', f'{zip_nome}: ZIP vazio — nada a processar', job_id, ch)
-            log('STATUS', 'DONE', job_id, ch)
-            return True
+        if directorio and not watch:
+            zip_paths += [c for c in zips_no_directorio(directorio) if c not in zip_paths]
+            log('INFO', f'{directorio}: {len(zip_paths)} ZIP(s) a ingerir', job_id, ch)
+
+        # spawn: processos filho limpos, sem herdar ligações nem threads; os
+        # blocos lidos voltam por uma fila limitada a 2 × n_workers blocos
+        contexto = multiprocessing.get_context('spawn')
+        fila = contexto.Queue(maxsize=2 * n_workers)
+        pool = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=contexto,
+            initializer=_inicia_processo,
+            initargs=(fila,),
+        )
 
-        # Verificar datas já ingeridas para este ZIP
-        datas_existentes = datas_ja_ingeridas(ch, zip_nome)
-        if datas_existentes:
-            log('INFO',
-                f'{zip_nome}: {len(datas_existentes)} data(s) já ingerida(s) — serão ignoradas',
-                job_id, ch)
+        totais = ingere_zips(zip_paths, pool, fila, n_workers, job_id, ch)
 
-        # ── Processamento paralelo ────────────────────────────────────────────
-        total_inserido = 0
-        total_ignorado = 0
-        total_erro     = 0
-
-        with ThreadPoolExecutor(max_workers=n_workers) as ex:
-            futures = {
-                ex.submit(
-                    processa_csv_interno,
-                    zip_path, ifile, zip_nome, datas_existentes, job_id,
-                ): ifile
-                for ifile in internal_files
-            }
-
-            concluidos = 0
-            for fut in as_completed(futures):
-                ifile      = futures[fut]
-                concluidos += 1
-                try:
-                    n, status = fut.result()
-                    if status == 'ok' and n > 0:
-                        total_inserido += n
-                        log('OK',
-                            f'[{concluidos}/{len(internal_files)}] {ifile}: '
-                            f'{n} bids inseridos  (total: {total_inserido})',
-                            job_id, ch)
-                    elif status == 'skip':
-                        total_ignorado += 1
-                        log('INFO',
-                            f'[{concluidos}/{len(internal_files)}] {ifile}: já existia — ignorado',
-                            job_id, ch)
-                    else:
-                        total_erro += 1
-                        log('AVISO',
-                            f'[{concluidos}/{len(internal_files)}] {ifile}: sem dados inseridos',
-                            job_id, ch)
-                except Exception as e:
-                    total_erro += 1
-                    log('ERRO', f'{ifile}: {e}', job_id, ch)
+        if watch:
+            parar = threading.Event()
+            for sinal in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(sinal, lambda *_: parar.set())
+            log('INFO', f'A vigiar {directorio} (SIGTERM para terminar)…', job_id, ch)
+            vigiados = vigia_directorio(directorio, intervalo, pool, fila, n_workers, job_id, ch, parar)
+            for chave in ('inseridos', 'ignorados', 'erros'):
+                totais[chave] += vigiados[chave]
 
         # ── Resumo final ──────────────────────────────────────────────────────
         log('INFO', '═' * 60, job_id, ch)
-        log('INFO', f'Bids inseridos      : {total_inserido}', job_id, ch)
-        log('INFO', f'Ficheiros ignorados : {total_ignorado} (dados já existentes)', job_id, ch)
-        log('INFO', f'Ficheiros com erro  : {total_erro}', job_id, ch)
+        log('INFO', f'Bids inseridos      : {totais["inseridos"]}', job_id, ch)
+        log('INFO', f'Ficheiros ignorados : {totais["ignorados"]} (conteúdo já ingerido ou substituído)', job_id, ch)
+        log('INFO', f'Ficheiros com erro  : {totais["erros"]}', job_id, ch)
         log('INFO', '═' * 60, job_id, ch)
         log('STATUS', 'DONE', job_id, ch)
         return True
@@ -334,6 +875,9 @@ def run_worker(job_id: str, zip_path: str, n_workers: int = 4) -> bool:
         return False
 
     finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        flush_worker_logs()
         if ch:
             try:
                 ch.disconnect()
@@ -347,18 +891,33 @@ def run_worker(job_id: str, zip_path: str, n_workers: int = 4) -> bool:
 
 def main() -> None:
     parser = argparse.ArgumentParser(
-        description='MIBEL Ingestão Worker — lê ZIP de bids OMIE e insere em mibel.bids_raw'
+        description='MIBEL Ingestão Worker — lê ZIPs de bids OMIE e insere em mibel.bids_raw'
     )
     parser.add_argument('--job_id',   required=True, help='UUID do job')
-    parser.add_argument('--zip_path', required=True, help='Caminho absoluto para o ficheiro ZIP')
+    parser.add_argument('--zip_path', nargs='+', default=[],
+                        help='Caminho(s) absoluto(s) para ficheiro(s) ZIP')
+    parser.add_argument('--dir',      default='',
+                        help='Directório com ZIPs curva_pbc_uof_YYYYMM.zip (ex.: /data/bids)')
+    parser.add_argument('--watch',    action='store_true',
+                        help='Com --dir: continuar a vigiar o directório e ingerir os ZIPs novos')
+    parser.add_argument('--intervalo', type=float, default=30.0,
+                        help='Segundos entre leituras do directório vigiado (default: 30)')
     parser.add_argument('--workers',  type=int, default=4,
-                        help='Threads paralelas para processamento dos CSVs (default: 4)')
+                        help='Processos paralelos para leitura dos CSVs (default: 4)')
     args = parser.parse_args()
 
+    if not args.zip_path and not args.dir:
+        parser.error('indique --zip_path e/ou --dir')
+    if args.watch and not args.dir:
+        parser.error('--watch requer --dir')
+
     ok = run_worker(
-        job_id    = args.job_id,
-        zip_path  = args.zip_path,
-        n_workers = args.workers,
+        job_id     = args.job_id,
+        zip_paths  = args.zip_path,
+        n_workers  = args.workers,
+        directorio = args.dir,
+        watch      = args.watch,
+        intervalo  = args.intervalo,
     )
     sys.exit(0 if ok else 1)
 
@@ -10,16 +10,21 @@ a plataforma:
 
 Algoritmo (por par Hora × País)
 ────────────────────────────────
-  1. Clearing ORIGINAL (sem escala) — baseline OMIE real.
+  1. Clearing ORIGINAL (sem escala) — baseline OMIE real; partilhado com os
+     estudos de substituição pela cache mibel.clearing_original (empates de
+     preço pela ordem das linhas — ver clearing_segmentado).
   2. Aplica escala de volumes (aplica_escalao) a compras e vendas.
   3. Comprime curvas em step tables (arrays numpy, um registo por preço único)
      e calcula o clearing BASE analítico — O(n_preços_únicos).
   4. Para cada nível de preço de venda acima do clearing base:
        a. Calcula o volume mínimo de bids PRE (Precio≈0) a remover para que
           o clearing salte para esse nível.
-       b. Remove bids PRE acumulando os de menor energia primeiro.
+       b. Remove bids PRE segundo a estratégia escolhida (--estrategia):
+          menores ou maiores primeiro, por tecnologia, por agente titular,
+          ou o óptimo exacto por knapsack (mochila).
        c. Recalcula o clearing analítico com vol_rem como offset escalar
-          sobre o volume acumulado da curva de venda — sem reconstruir arrays.
+          sobre o volume acumulado da curva de venda — sem reconstruir arrays,
+          por pesquisa binária sobre step tables pré-processadas uma vez.
        d. Calcula o lucro PRE = volume_pre_despachado × preco_clearing.
   5. Regista o cenário de lucro máximo.
 
@@ -28,16 +33,25 @@ Uso:
         --job_id  <UUID> \\
         --data_inicio YYYY-MM-DD \\
         --data_fim    YYYY-MM-DD \\
-        [--workers N]
+        [--workers N] [--executor thread|process] [--resume]
+        [--prefetch N] [--fila_escrita N]
+        [--estrategia menor|maior|tecnologia|agente|mochila]
+        [--busca exaustiva|poda]
+        [--logs_cenarios todos|top|optimo|nenhum] [--logs_n N]
+        [--formato_logs linhas|arrays]
 """
 
 import argparse
+import bisect
+import multiprocessing
 import os
+import shutil
 import sys
-import threading
 import traceback
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import date, datetime
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import date
+from functools import partial
 from typing import Optional
 
 import numpy as np
@@ -46,96 +60,58 @@ import pandas as pd
 sys.path.insert(0, '/app')
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from clearing import clearing
+from clearing import clearing_bids_df
 from utils import (
-    get_ch, ch_insert_batch,
+    get_ch,
+    log, flush_worker_logs,
+    carrega_bids_dia_ch,
+    StreamingInserter,
+    executa_em_janela,
+    prefetch,
+    registo_progresso,
+    datas_concluidas,
+    versoes_bids_ch,
+    carrega_clearing_original_ch,
+    cache_clearing_completa,
+    registo_clearing_original,
+    limpa_datas_incompletas,
     carrega_escaloes,
     carrega_mapa_unidades_ch,
+    carrega_agentes_unidades_ch,
+    distribui_escaloes,
+    concatena_colunas,
+    indexa_categorias,
+    lista_categorias,
+    posicoes_por_categoria,
+    particiona_bids,
+    cria_dir_mmap,
+    exporta_bids_mmap,
+    le_fatia_mmap,
+    limites_fatia,
     normaliza_hora,
     extrai_data,
     ensure_output_dir,
 )
 
-# ══════════════════════════════════════════════════════════════════════════════
-#  LOGGING THREAD-SAFE
-# ══════════════════════════════════════════════════════════════════════════════
-
-_print_lock = threading.Lock()
-
-
-def log(nivel: str, mensagem: str, job_id: str = '', ch=None) -> None:
-    ts   = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    line = f'[{ts}] [{nivel}] {mensagem}'
-    with _print_lock:
-        print(line, flush=True)
-
-    if ch and job_id:
-        try:
-            ch.execute(
-                'INSERT INTO mibel.worker_logs (job_id, nivel, mensagem) VALUES',
-                [{'job_id': job_id, 'nivel': nivel, 'mensagem': mensagem}]
-            )
-        except Exception:
-            pass
-
-
-# ══════════════════════════════════════════════════════════════════════════════
-#  CONSTRUÇÃO DO MAPA DE UNIDADES  (idêntico ao substituicao_worker)
-# ══════════════════════════════════════════════════════════════════════════════
-
-def build_mapa_unidades(
-    df: pd.DataFrame,
-    mapa_unidades_ch: dict,
-    escaloes: dict,
-) -> dict:
-    """
-    Filtra o mapa pré-classificado da tabela mibel.unidades pelas unidades
-    presentes neste DataFrame.  Devolve {CODIGO_upper → (regime, categoria_zona)}.
-    """
-    unidades_no_ficheiro = set(
-        df['Unidad'].astype(str).str.strip().str.upper().unique()
-    )
-    mapa: dict = {}
-    for unidade in unidades_no_ficheiro:
-        if unidade not in mapa_unidades_ch:
-            continue
-        regime, cat_zona = mapa_unidades_ch[unidade]
-        if regime in escaloes and isinstance(escaloes[regime], dict):
-            if cat_zona in escaloes[regime]:
-                mapa[unidade] = (regime, cat_zona)
-    return mapa
-
-
 # ══════════════════════════════════════════════════════════════════════════════
 #  VOLUMES DIÁRIOS (suporte a perfil_hora)
 # ══════════════════════════════════════════════════════════════════════════════
 
 def calcula_volumes_diarios(
     df: pd.DataFrame,
-    mapa_unidades: dict,
+    indice: dict,
     escaloes: dict,
 ) -> dict:
     volumes: dict = {}
-    unidades_upper = df['Unidad'].astype(str).str.strip().str.upper()
-
-    for classe, cats_dict in escaloes.items():
-        for categoria, cfg in cats_dict.items():
-            if 'perfil_hora' not in cfg:
-                continue
-            codigos = {
-                cod for cod, (reg, cat) in mapa_unidades.items()
-                if reg == classe and cat == categoria
-            }
-            if not codigos:
-                continue
-            mask = unidades_upper.isin(codigos)
-            if not mask.any():
-                continue
-            df_cat = df[mask].copy()
-            df_cat['_h'] = pd.to_numeric(df_cat['Hora'], errors='coerce')
-            volumes[(classe, categoria)] = (
-                df_cat.groupby('_h')['Energia'].sum().to_dict()
-            )
+    for k, pos in indice['posicoes'].items():
+        classe, categoria = indice['categorias'][k]
+        if 'perfil_hora' not in escaloes[classe][categoria]:
+            continue
+        df_cat = df.iloc[pos].copy()
+        df_cat['_h'] = pd.to_numeric(df_cat['Hora'], errors='coerce')
+        volumes[(classe, categoria)] = (
+            df_cat.groupby('_h')['Energia'].sum().to_dict()
+        )
     return volumes
 
 
@@ -166,94 +142,75 @@ def calcula_factor_horario(
 #  APLICAÇÃO DE ESCALA  (sem substituição de preço — apenas volume)
 # ══════════════════════════════════════════════════════════════════════════════
 
+# Colunas do log de substituições (formato colunar: {coluna: np.ndarray})
+COLUNAS_LOG = ('Unidad', 'classe', 'categoria', 'escalao_preco', 'preco_original', 'Energia_MW')
+
+
 def aplica_escalao(
     df: pd.DataFrame,
-    mapa_unidades: dict,
+    categorias: list,
     escaloes: dict,
     Hora: str = '',
-    pais: str = '',
-    internal_file: str = '',
     volumes_diarios: Optional[dict] = None,
-) -> tuple[pd.DataFrame, list]:
+) -> tuple[pd.DataFrame, dict]:
     """
     Aplica escala de volume (e opcionalmente escalões de preço e delta_preco)
     a todas as classes.  Idêntico ao substituicao_worker — usado aqui apenas
     para a componente de escala; a substituição de preço é ignorada na
     optimização (o preço óptimo é calculado analiticamente).
     """
-    df   = df.copy()
-    logs = []
-    unidades_upper = df['Unidad'].astype(str).str.strip().str.upper()
-
-    for classe, cats_dict in escaloes.items():
-        for categoria, cfg in cats_dict.items():
-            codigos = {
-                cod for cod, (reg, cat) in mapa_unidades.items()
-                if reg == classe and cat == categoria
-            }
-            if not codigos:
-                continue
-            mask_cat = unidades_upper.isin(codigos)
-            if not mask_cat.any():
+    energia = df['Energia'].to_numpy(dtype=float, copy=True)
+    precio  = df['Precio'].to_numpy(dtype=float, copy=True)
+    blocos  = []
+
+    for k, pos_cat in posicoes_por_categoria(df['cat_cod'].to_numpy()).items():
+        classe, categoria = categorias[k]
+        cfg = escaloes[classe][categoria]
+
+        # ── Escala de volume ──────────────────────────────────────────────────
+        if 'escala' in cfg:
+            if 'perfil_hora' in cfg and volumes_diarios is not None:
+                factor = calcula_factor_horario(Hora, cfg, volumes_diarios, classe, categoria)
+            else:
+                factor = cfg['escala']
+            if factor != 1.0:
+                energia[pos_cat] = energia[pos_cat] * factor
+
+        # ── Escalões de preço (apenas para registo; não altera o preço
+        #    na optimização — o algoritmo trabalha com Precio≈0) ──────────────
+        if 'escaloes' in cfg:
+            escalonamento = cfg['escaloes']
+            p_cat    = precio[pos_cat]
+            pos_zero = pos_cat[(p_cat >= -0.001) & (p_cat <= 0.001)]
+            if len(pos_zero) == 0:
                 continue
+            esc_idx      = distribui_escaloes(energia[pos_zero], escalonamento)
+            precos_novos = np.array([esc['preco'] for esc in escalonamento])[esc_idx]
+            alterar      = precos_novos != 0
+            if alterar.any():
+                pos = pos_zero[alterar]
+                precos_orig = precio[pos]
+                precio[pos] = precos_novos[alterar]
+                n = len(pos)
+                blocos.append({
+                    'Unidad':         df['Unidad'].to_numpy(dtype=object)[pos],
+                    'classe':         np.full(n, classe, dtype=object),
+                    'categoria':      np.full(n, categoria, dtype=object),
+                    'escalao_preco':  precos_novos[alterar].astype(float),
+                    'preco_original': precos_orig,
+                    'Energia_MW':     energia[pos],
+                })
 
-            # ── Escala de volume ──────────────────────────────────────────────
-            if 'escala' in cfg:
-                if 'perfil_hora' in cfg and volumes_diarios is not None:
-                    factor = calcula_factor_horario(Hora, cfg, volumes_diarios, classe, categoria)
-                else:
-                    factor = cfg['escala']
-                if factor != 1.0:
-                    df.loc[mask_cat, 'Energia'] = df.loc[mask_cat, 'Energia'] * factor
-                    unidades_upper = df['Unidad'].astype(str).str.strip().str.upper()
-
-            # ── Escalões de preço (apenas para registo; não altera o preço
-            #    na optimização — o algoritmo trabalha com Precio≈0) ──────────
-            if 'escaloes' in cfg:
-                escalonamento = cfg['escaloes']
-                mask_zero = mask_cat & df['Precio'].between(-0.001, 0.001)
-                df_zero   = df[mask_zero]
-                if df_zero.empty:
-                    continue
-                vol_total = df_zero['Energia'].sum()
-                vol_acum  = 0.0
-                esc_idx   = 0
-                limiares: list[float] = []
-                acum = 0.0
-                for esc in escalonamento[:-1]:
-                    acum += esc['pct_bids'] * vol_total
-                    limiares.append(acum)
-                limiares.append(float('inf'))
-                for idx in df_zero.index:
-                    energia_bid = df.at[idx, 'Energia']
-                    vol_acum   += energia_bid
-                    while (esc_idx < len(limiares) - 1
-                           and vol_acum > limiares[esc_idx] + 1e-9):
-                        esc_idx += 1
-                    preco_novo = escalonamento[esc_idx]['preco']
-                    if preco_novo == 0:
-                        continue
-                    preco_orig           = df.at[idx, 'Precio']
-                    df.at[idx, 'Precio'] = preco_novo
-                    logs.append({
-                        'internal_file': internal_file,
-                        'Hora':          Hora,
-                        'pais':          pais,
-                        'Unidad':        df.at[idx, 'Unidad'],
-                        'classe':        classe,
-                        'categoria':     categoria,
-                        'escalao_preco': preco_novo,
-                        'preco_original': preco_orig,
-                        'Energia_MW':    energia_bid,
-                    })
-
-            # ── Delta de preço ────────────────────────────────────────────────
-            if 'delta_preco' in cfg:
-                delta = cfg['delta_preco']
-                if delta != 0.0:
-                    df.loc[mask_cat, 'Precio'] = df.loc[mask_cat, 'Precio'] + delta
-
-    return df, logs
+        # ── Delta de preço ────────────────────────────────────────────────────
+        if 'delta_preco' in cfg:
+            delta = cfg['delta_preco']
+            if delta != 0.0:
+                precio[pos_cat] = precio[pos_cat] + delta
+
+    df = df.copy()
+    df['Energia'] = energia
+    df['Precio']  = precio
+    return df, concatena_colunas(blocos, COLUNAS_LOG)
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -342,6 +299,24 @@ def _clearing_analitico(
     if last_i < 0:
         return None, None
 
+    return _resultado_clearing(cp, cv, vp, vv, j_shift, vol_rem, last_i, last_j)
+
+
+def _resultado_clearing(
+    cp: np.ndarray,
+    cv: np.ndarray,
+    vp: np.ndarray,
+    vv: np.ndarray,
+    j_shift: int,
+    vol_rem: float,
+    last_i: int,
+    last_j: int,
+) -> tuple[float, float]:
+    """
+    Preço e volume de clearing a partir do último par (last_i, last_j) de
+    step tables ainda não cruzado — regras de desempate de clearing.py.
+    """
+    n_c = len(cp)
     pc_last = cp[last_i]
     pv_last = vp[last_j]
     vc_last = cv[last_i]
@@ -361,13 +336,532 @@ def _clearing_analitico(
         return pc_last, vc_last
 
 
-def _identifica_codigos_pre(mapa_unidades: dict, escaloes: dict) -> set:
-    """Devolve o conjunto de códigos (upper) classificados como regime PRE."""
-    categorias_pre = set(escaloes.get('PRE', {}).keys())
-    return {
-        cod for cod, (reg, cat) in mapa_unidades.items()
-        if reg == 'PRE' and cat in categorias_pre
-    }
+class _MotorClearing:
+    """
+    Clearing incremental sobre step tables fixas, para muitos vol_rem.
+
+    O pré-processamento (volumes e preços arredondados, limite de cruzamento
+    de preços por degrau de compra) é feito uma vez por (Hora, País); cada
+    clearing(vol_rem) localiza depois o ponto de paragem do algoritmo de dois
+    ponteiros por pesquisa binária — O(log² n) em vez de O(n) por cenário.
+
+    Caminho do algoritmo de dois ponteiros, com a = round(cv), b = round(vv_ef)
+    ambos não decrescentes e v = a[i], k = i - #{a < v}, q = #{b == v}:
+      • a coluna i termina em  j_last(i) = #{b < v} + min(k, q)
+      • se k > 0 começa em j_last(i); se k = 0 (i > 0), com u = a[i-1] e
+        p = #{a == u}, começa em  #{b < u} + min(p, #{b == u})
+    O cruzamento de preços é monótono ao longo do caminho, pelo que a última
+    coluna com algum ponto válido é encontrada por bissecção.
+
+    Se as curvas não forem monótonas (energias negativas ou vol_rem que
+    inverte o degrau j_shift) recorre a _clearing_analitico.
+    """
+
+    def __init__(
+        self,
+        cp: np.ndarray,
+        cv: np.ndarray,
+        vp: np.ndarray,
+        ve: np.ndarray,
+        vv: np.ndarray,
+        j_shift: int,
+    ) -> None:
+        self.cp, self.cv, self.vp, self.ve, self.vv = cp, cv, vp, ve, vv
+        self.j_shift = j_shift
+        self.n_c, self.n_v = len(cp), len(vp)
+
+        # Mesmo arredondamento (numpy) do algoritmo de dois ponteiros
+        self._a = np.round(cv, 2)
+        pc_r    = np.round(cp, 2)
+        pv_r    = np.round(vp, 2)
+
+        # (i, j) não cruzado  ⇔  j < j_lim[i]   (j_lim não crescente em i)
+        self._j_lim = np.searchsorted(pv_r, pc_r, side='right')
+
+        self._monotono = bool(
+            np.all(np.diff(self._a) >= 0) and np.all(np.diff(vv) >= 0)
+        )
+        self._ultimo: Optional[tuple] = None
+        self._vv_l = vv.tolist()
+
+    def _b(self, j: int, vol_rem: float) -> float:
+        # round(x * 100) / 100 sobre floats Python: igual a np.round(x, 2)
+        # (rint de x * 100), sem o custo de round() em escalares numpy
+        return round((self._vv_l[j] - (vol_rem if j >= self.j_shift else 0.0)) * 100.0) / 100.0
+
+    def clearing(self, vol_rem: float = 0.0) -> tuple[Optional[float], Optional[float]]:
+        """Equivalente a _clearing_analitico(..., vol_rem)."""
+        # Níveis consecutivos que não acrescentam bids removidos repetem vol_rem
+        if self._ultimo is not None and self._ultimo[0] == vol_rem:
+            return self._ultimo[1]
+        resultado = self._clearing(vol_rem)
+        self._ultimo = (vol_rem, resultado)
+        return resultado
+
+    def preco_maximo(self, vol_rem_max: float) -> float:
+        """
+        Majorante do preço de clearing para qualquer vol_rem <= vol_rem_max
+        (base da pesquisa com poda, --busca poda).
+
+        Com b monótono, j_first(i) <= #{b <= a[i-1]}, que só cresce com
+        vol_rem: se #{b <= a[i-1]} < j_lim[i] em vol_rem_max, a coluna i é
+        alcançada para todo o vol_rem menor, logo last_i >= i. O preço
+        devolvido (pc_last, pv_last ou o ponto médio, com
+        round(pv_last) <= round(pc_last)) nunca excede cp[last_i] + 0.01.
+        """
+        js = self.j_shift
+        if (not self._monotono
+                or (0 < js < self.n_v and self._b(js - 1, vol_rem_max) > self._b(js, vol_rem_max))):
+            return np.inf
+
+        a, j_lim = self._a, self._j_lim
+        indices  = range(self.n_v)
+        chave    = lambda j: self._b(j, vol_rem_max)
+
+        lo, hi = 0, self.n_c - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if bisect.bisect_right(indices, a[mid - 1], key=chave) < j_lim[mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return float(self.cp[lo]) + 0.01
+
+    def _clearing(self, vol_rem: float) -> tuple[Optional[float], Optional[float]]:
+        js = self.j_shift
+        if (not self._monotono
+                or (0 < js < self.n_v and self._b(js - 1, vol_rem) > self._b(js, vol_rem))):
+            return _clearing_analitico(self.cp, self.cv, self.vp, self.ve, self.vv,
+                                       js, vol_rem=vol_rem)
+
+        a, j_lim = self._a, self._j_lim
+        indices  = range(self.n_v)
+        chave    = lambda j: self._b(j, vol_rem)
+
+        def _bloco_b(v: float) -> tuple[int, int]:
+            lo = bisect.bisect_left(indices, v, key=chave)
+            return lo, bisect.bisect_right(indices, v, lo=lo, key=chave) - lo
+
+        def _j_last(i: int) -> int:
+            lo, q = _bloco_b(a[i])
+            return lo + min(i - int(np.searchsorted(a, a[i], side='left')), q)
+
+        def _j_first(i: int) -> int:
+            if i == 0:
+                return 0
+            if a[i - 1] == a[i]:
+                return _j_last(i)
+            lo, q = _bloco_b(a[i - 1])
+            return lo + min(i - int(np.searchsorted(a, a[i - 1], side='left')), q)
+
+        if _j_first(0) >= j_lim[0]:
+            return None, None
+
+        # Última coluna i com ponto válido: j_first(i) < j_lim[i]
+        lo, hi = 0, self.n_c - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if _j_first(mid) < j_lim[mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+
+        last_i = lo
+        last_j = min(_j_last(last_i), int(j_lim[last_i]) - 1)
+        return _resultado_clearing(self.cp, self.cv, self.vp, self.vv, js,
+                                   vol_rem, last_i, last_j)
+
+
+def _volumes_minimos(
+    cp: np.ndarray,
+    cv: np.ndarray,
+    vp: np.ndarray,
+    vv: np.ndarray,
+    precos_alvo: np.ndarray,
+) -> np.ndarray:
+    """
+    Volume mínimo a remover da curva de venda para que o clearing suba a
+    cada preço alvo, avaliado directamente sobre as step tables.
+
+        sell_abaixo = Σ energia de venda com Precio <  p_alvo - 1e-6
+        buy_acima   = Σ energia de compra com Precio >= p_alvo - 1e-6
+        vol_min     = max(0, sell_abaixo - buy_acima)
+
+    As somas são lidas dos volumes acumulados (vv ASC, cv DESC) por
+    searchsorted — O(log n) por nível em vez de uma máscara sobre os bids.
+    """
+    limiar = precos_alvo - 1e-6
+
+    k_v = np.searchsorted(vp, limiar, side='left')
+    sell_abaixo = np.where(k_v > 0, vv[np.maximum(k_v - 1, 0)], 0.0)
+
+    k_c = np.searchsorted(-cp, -limiar, side='right')
+    buy_acima = np.where(k_c > 0, cv[np.maximum(k_c - 1, 0)], 0.0)
+
+    return np.maximum(0.0, sell_abaixo - buy_acima)
+
+
+def _identifica_codigos_pre(categorias: list) -> list:
+    """Devolve os códigos de categoria (índices em categorias) do regime PRE."""
+    return [k for k, (classe, _) in enumerate(categorias) if classe == 'PRE']
+
+
+class _DespachoPre:
+    """
+    Energia PRE despachada para um conjunto de candidatos removidos.
+
+    Os candidatos PRE trazem a sua posição na curva de venda (Volume_Acumulado);
+    um candidato presente é despachado se vacum <= vol_clearing + vol_rem + 1e-6.
+
+    Estrutura:
+      • índice dos candidatos ordenados por vacum + energia acumulada nessa
+        ordem → energia de todos os candidatos até ao limite por searchsorted;
+      • árvore de Fenwick com a energia dos removidos, na mesma ordem,
+        actualizada à medida que as estratégias removem candidatos.
+    Cada consulta custa O(log n) em vez de uma máscara sobre os candidatos.
+    """
+
+    def __init__(self, vacum: np.ndarray, energia: np.ndarray, unidades: np.ndarray) -> None:
+        self.vacum, self.energia, self.unidades = vacum, energia, unidades
+        self.n = len(vacum)
+
+        self._ordem     = np.argsort(vacum, kind='stable')
+        self._vacum_ord = vacum[self._ordem]
+        self._acum      = np.concatenate(([0.0], np.cumsum(energia[self._ordem])))
+        self._posicao   = np.empty(self.n, dtype=np.int64)
+        self._posicao[self._ordem] = np.arange(self.n)
+
+        self._posicao_l = self._posicao.tolist()
+        self._energia_l = energia.tolist()
+        self.repoe()
+
+    def repoe(self) -> None:
+        """Volta ao estado sem candidatos removidos."""
+        self.removido = np.zeros(self.n, dtype=bool)
+        self._arvore  = [0.0] * (self.n + 1)
+
+    def remove(self, indices) -> None:
+        """Remove os candidatos indicados (índices na ordem dos candidatos)."""
+        arvore = self._arvore
+        for k in indices:
+            if self.removido[k]:
+                continue
+            self.removido[k] = True
+            i, e = self._posicao_l[k] + 1, self._energia_l[k]
+            while i <= self.n:
+                arvore[i] += e
+                i += i & -i
+
+    def define_removidos(self, indices) -> None:
+        self.repoe()
+        self.remove(indices)
+
+    def removidos(self) -> np.ndarray:
+        return np.flatnonzero(self.removido)
+
+    def _energia_removida(self, k: int) -> float:
+        soma, arvore = 0.0, self._arvore
+        while k > 0:
+            soma += arvore[k]
+            k -= k & -k
+        return soma
+
+    def n_ate(self, vol_limite: float) -> int:
+        """Número de candidatos com vacum <= limite (posição de corte na ordem de vacum)."""
+        return int(np.searchsorted(self._vacum_ord, vol_limite + 1e-6, side='right'))
+
+    def posicoes(self) -> np.ndarray:
+        """Posição de cada candidato na ordem de vacum (despachado ⇔ posição < corte)."""
+        return self._posicao
+
+    def energia_ate(self, corte: int) -> float:
+        """Σ energia de todos os candidatos antes da posição de corte."""
+        return float(self._acum[corte])
+
+    def energia_despachada(self, vol_limite: float) -> float:
+        """Σ energia dos candidatos presentes com vacum <= limite."""
+        k = self.n_ate(vol_limite)
+        return float(self._acum[k]) - self._energia_removida(k)
+
+    def lucro(self, vol_clearing: float, vol_rem: float, preco_clearing: float) -> float:
+        """Lucro PRE de um cenário: energia despachada × preço de clearing."""
+        return self.energia_despachada(vol_clearing + vol_rem) * preco_clearing
+
+    def despachados(self, vol_limite: float) -> np.ndarray:
+        """
+        Índices (pela ordem dos candidatos) dos presentes despachados — para
+        o cenário final, onde a soma na ordem original evita diferenças de
+        arredondamento face à soma acumulada.
+        """
+        indices = self._ordem[:self.n_ate(vol_limite)]
+        return np.sort(indices[~self.removido[indices]])
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  ESTRATÉGIAS DE REMOÇÃO PRE  (--estrategia)
+# ══════════════════════════════════════════════════════════════════════════════
+#
+# Uma estratégia decide, para cada nível de preço alvo, que candidatos PRE
+# (Precio≈0) retirar da curva de venda para cobrir vol_min. Todas partilham o
+# mesmo avaliador: _MotorClearing (clearing por vol_rem) e _DespachoPre
+# (lucro por conjunto removido), criados uma vez por (Hora, País).
+#
+# Interface (_EstrategiaRemocao):
+#             Estrategia(candidatos, despacho, motor, opcoes)
+#             .remove(vol_min) -> (n_bids_removidos, vol_removido)
+#             .folga           -> vol_min - vol_removido nunca excede este valor
+#             .cenario_global  -> avaliar antes dos níveis o cenário 'global',
+#                                 remove(0.0) (estratégias exactas)
+# deixando em despacho o conjunto removido do cenário.
+
+class _EstrategiaRemocao(ABC):
+    """Estratégia de remoção PRE: escolhe o conjunto removido em cada nível."""
+
+    # Quanto vol_removido pode ficar abaixo de vol_min (usado na poda)
+    folga = 1e-6
+    # remove(0.0) é o óptimo global, avaliado como cenário próprio
+    cenario_global = False
+
+    def __init__(self, candidatos: pd.DataFrame, despacho: _DespachoPre,
+                 motor: _MotorClearing, opcoes: dict) -> None:
+        self.despacho = despacho
+        self.motor    = motor
+
+    @abstractmethod
+    def remove(self, vol_min: float) -> tuple[int, float]:
+        """
+        Remove (em despacho) o conjunto do cenário de nível vol_min; devolve
+        (n_bids_removidos, vol_removido).
+        """
+
+
+class _EstrategiaOrdem(_EstrategiaRemocao):
+    """
+    Remoção por prefixos de uma ordem fixa dos candidatos. vol_min não
+    decresce com o nível de preço, pelo que cada nível só acrescenta bids.
+    """
+
+    def __init__(self, candidatos: pd.DataFrame, despacho: _DespachoPre,
+                 motor: _MotorClearing, opcoes: dict) -> None:
+        super().__init__(candidatos, despacho, motor, opcoes)
+        self._ordem   = self.ordem(candidatos, opcoes).tolist()
+        self._energia = despacho.energia
+        self.n_bids   = 0
+        self.vol_rem  = 0.0
+
+    @abstractmethod
+    def ordem(self, candidatos: pd.DataFrame, opcoes: dict) -> np.ndarray:
+        """Permutação dos candidatos pela ordem de remoção."""
+
+    def remove(self, vol_min: float) -> tuple[int, float]:
+        novos = []
+        while self.n_bids < len(self._ordem) and self.vol_rem < vol_min - 1e-6:
+            k = self._ordem[self.n_bids]
+            self.vol_rem += self._energia[k]
+            self.n_bids  += 1
+            novos.append(k)
+        self.despacho.remove(novos)
+        return self.n_bids, self.vol_rem
+
+
+class _RemocaoMenores(_EstrategiaOrdem):
+    """Menores bids primeiro (os candidatos já vêm por energia crescente)."""
+
+    def ordem(self, candidatos, opcoes):
+        return np.arange(len(candidatos))
+
+
+class _RemocaoMaiores(_EstrategiaOrdem):
+    """Maiores bids primeiro."""
+
+    def ordem(self, candidatos, opcoes):
+        return np.argsort(-candidatos['Energia'].to_numpy(dtype=float), kind='stable')
+
+
+class _RemocaoPorGrupo(_EstrategiaOrdem):
+    """
+    Remove grupos inteiros de candidatos, do grupo de menor energia total
+    para o maior; dentro de cada grupo, menores bids primeiro.
+    """
+
+    @abstractmethod
+    def grupos(self, candidatos, opcoes) -> np.ndarray:
+        """Chave de grupo de cada candidato."""
+
+    def ordem(self, candidatos, opcoes):
+        codigos, _ = pd.factorize(self.grupos(candidatos, opcoes))
+        totais     = np.bincount(codigos, weights=candidatos['Energia'].to_numpy(dtype=float))
+        return np.lexsort((np.arange(len(codigos)), codigos, totais[codigos]))
+
+
+class _RemocaoTecnologia(_RemocaoPorGrupo):
+    """Por tecnologia (categoria de parametros.json, ex.: EOLICA_ES)."""
+
+    def grupos(self, candidatos, opcoes):
+        return candidatos['cat_cod'].to_numpy()
+
+
+class _RemocaoAgente(_RemocaoPorGrupo):
+    """
+    Por agente titular (mibel.unidades.agente). Unidades sem agente
+    conhecido formam um grupo próprio.
+    """
+
+    def grupos(self, candidatos, opcoes):
+        agentes  = opcoes.get('agentes', {})
+        unidades = candidatos['Unidad'].astype(str).str.strip().str.upper()
+        return np.array([agentes.get(u) or f'#{u}' for u in unidades], dtype=object)
+
+
+def _somas_atingiveis(pesos: np.ndarray, capacidade: int) -> np.ndarray:
+    """
+    Knapsack 0/1 sobre pesos inteiros: para cada soma 0..capacidade, o índice
+    do item com que foi atingida pela primeira vez (-1 se inatingível; a
+    soma 0 é atingível sem itens). Pesos <= 0 são ignorados. _reconstroi
+    recupera daqui um subconjunto com uma dada soma.
+    """
+    atingivel = np.zeros(capacidade + 1, dtype=bool)
+    item      = np.full(capacidade + 1, -1, dtype=np.int64)
+    atingivel[0] = True
+    for k, w in enumerate(pesos.tolist()):
+        if w <= 0 or w > capacidade:
+            continue
+        novos = np.flatnonzero(atingivel[:capacidade + 1 - w] & ~atingivel[w:]) + w
+        atingivel[novos] = True
+        item[novos]      = k
+    return item
+
+
+def _reconstroi(pesos: np.ndarray, item: np.ndarray, soma: int) -> np.ndarray:
+    """Índices de um subconjunto de pesos com a soma indicada (ver _somas_atingiveis)."""
+    escolhidos = []
+    while soma > 0:
+        k = int(item[soma])
+        escolhidos.append(k)
+        soma -= int(pesos[k])
+    return np.sort(np.array(escolhidos, dtype=np.int64))
+
+
+def _custo_minimo(pesos: np.ndarray, custos: np.ndarray, capacidade: int) -> np.ndarray:
+    """
+    Knapsack 0/1 de custo mínimo: custo[V] = menor Σ custos de um
+    subconjunto com Σ pesos == V, para V = 0..capacidade (inf se V não é
+    atingível). Pesos <= 0 são ignorados.
+    """
+    custo    = np.full(capacidade + 1, np.inf)
+    custo[0] = 0.0
+    for w, c in zip(pesos.tolist(), custos.tolist()):
+        if w <= 0 or w > capacidade:
+            continue
+        np.minimum(custo[w:], custo[:-w] + c, out=custo[w:])
+    return custo
+
+
+class _RemocaoMochila(_EstrategiaRemocao):
+    """
+    Óptimo exacto de lucro_pre (à resolução de 0.1 MW) por knapsack.
+
+    O clearing depende só do total removido V (_MotorClearing.clearing), pelo
+    que basta um clearing por total atingível, não por subconjunto:
+      • para cada V (em décimos de MW, por ordem crescente) o clearing fixa o
+        limite de despacho volume + V; os candidatos acima dele saem sem
+        custo e os restantes custam a sua energia;
+      • um knapsack de duas classes (_custo_minimo, um por limite distinto)
+        dá a menor energia despachada removida com soma V — despachado =
+        energia até ao limite - esse custo;
+      • a enumeração pára quando preco_maximo × energia restante já não
+        supera o melhor lucro.
+    O conjunto do V escolhido é reconstruído separadamente nas duas classes.
+
+    remove(vol_min) devolve o melhor V >= vol_min: o cenário 'global'
+    (vol_min = 0) é o óptimo, incluindo totais abaixo do primeiro nível, e
+    cada nível o melhor cenário que cobre o seu vol_min.
+    """
+
+    cenario_global = True
+
+    def __init__(self, candidatos: pd.DataFrame, despacho: _DespachoPre,
+                 motor: _MotorClearing, opcoes: dict) -> None:
+        super().__init__(candidatos, despacho, motor, opcoes)
+        self._energia = despacho.energia
+        self._pesos   = np.rint(self._energia * 10).astype(np.int64)
+        self._n_pos   = despacho.posicoes()
+        # Arredondamento dos pesos a 0.1 MW: até 0.05 MW por bid escolhido
+        self.folga    = 0.05 * despacho.n + 1e-6
+        self._lucros, self._cortes, self._custos = self._enumera()
+        self._ultimo: Optional[tuple] = None
+
+    def _enumera(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Lucro estimado, posição de corte do despacho e custo mínimo (décimos
+        de MW) de cada total V; lucro -inf onde V não é atingível ou não foi
+        avaliado.
+        """
+        pesos  = self._pesos
+        total  = int(pesos[pesos > 0].sum())
+        lucros = np.full(total + 1, -np.inf)
+        cortes = np.zeros(total + 1, dtype=np.int64)
+        custos = np.zeros(total + 1, dtype=np.int64)
+
+        # Majorante do lucro dos V seguintes: preço máximo × energia que fica
+        # (com o arredondamento dos pesos, até 0.05 MW por bid)
+        preco_max = self.motor.preco_maximo(total / 10 * (1 + 1e-9) + 1e-6)
+        energia   = float(self._energia.sum())
+        margem    = 0.05 * self.despacho.n + 1e-6
+
+        por_corte: dict = {}   # {corte: custo mínimo por V}
+        melhor = -np.inf
+        for v in range(total + 1):
+            if (melhor > -np.inf and preco_max < np.inf
+                    and max(0.0, preco_max) * max(0.0, energia - v / 10 + margem) <= melhor + 1e-6):
+                break
+            preco, volume = self.motor.clearing(v / 10)
+            if preco is None:
+                continue
+            corte = int(self.despacho.n_ate(volume + v / 10))
+            if corte not in por_corte:
+                pagos = self._n_pos < corte
+                por_corte[corte] = _custo_minimo(pesos, np.where(pagos, pesos, 0), total)
+            custo = por_corte[corte][v]
+            if not np.isfinite(custo):
+                continue
+            lucros[v] = (self.despacho.energia_ate(corte) - custo / 10) * preco
+            cortes[v], custos[v] = corte, int(custo)
+            melhor = max(melhor, lucros[v])
+        return lucros, cortes, custos
+
+    def _conjunto(self, v: int) -> np.ndarray:
+        """Candidatos removidos do total v: soma custos[v] nos pagos, o resto nos livres."""
+        pagos    = np.flatnonzero(self._n_pos < self._cortes[v])
+        livres   = np.flatnonzero(self._n_pos >= self._cortes[v])
+        custo    = int(self._custos[v])
+        escolhidos = []
+        for classe, soma in ((pagos, custo), (livres, v - custo)):
+            item = _somas_atingiveis(self._pesos[classe], soma)
+            escolhidos.append(classe[_reconstroi(self._pesos[classe], item, soma)])
+        return np.sort(np.concatenate(escolhidos))
+
+    def remove(self, vol_min: float) -> tuple[int, float]:
+        v_min = max(0, int(np.ceil(vol_min * 10 - 1e-6)))
+        if v_min >= len(self._lucros) or not np.isfinite(self._lucros[v_min:]).any():
+            escolhidos = np.flatnonzero(self._pesos > 0)
+        else:
+            v = v_min + int(np.argmax(self._lucros[v_min:]))
+            if self._ultimo is None or self._ultimo[0] != v:
+                self._ultimo = (v, self._conjunto(v))
+            escolhidos = self._ultimo[1]
+
+        self.despacho.define_removidos(escolhidos)
+        return len(escolhidos), float(self._energia[escolhidos].sum())
+
+
+ESTRATEGIAS_REMOCAO = {
+    'menor':      _RemocaoMenores,
+    'maior':      _RemocaoMaiores,
+    'tecnologia': _RemocaoTecnologia,
+    'agente':     _RemocaoAgente,
+    'mochila':    _RemocaoMochila,
+}
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -375,51 +869,51 @@ def _identifica_codigos_pre(mapa_unidades: dict, escaloes: dict) -> set:
 # ══════════════════════════════════════════════════════════════════════════════
 
 def _processa_hora_pais(
-    df: pd.DataFrame,
+    compras: Optional[pd.DataFrame],
+    vendas: Optional[pd.DataFrame],
     internal_file: str,
     Hora: str,
     pais: str,
-    mapa_unidades: dict,
+    categorias: list,
     escaloes: dict,
     volumes_diarios: dict,
+    opcoes: Optional[dict] = None,
+    orig: Optional[tuple] = None,
 ) -> tuple[Optional[dict], list]:
     """
-    Clearing original + optimização analítica do lucro PRE para um par (Hora, Pais).
+    Clearing original + optimização analítica do lucro PRE para um par (Hora, Pais),
+    a partir das fatias de compras e vendas da partição do dia (particiona_bids).
     Função pura e thread-safe.
 
     Algoritmo
     ─────────
-    1. Clearing ORIGINAL (sem escala).
+    1. Clearing ORIGINAL (sem escala), salvo se já recebido em orig (clearing
+       do dia em lote, ou da cache mibel.clearing_original).
     2. Aplica escala de volumes → step tables → clearing BASE analítico.
-    3. Remove bids PRE (Precio≈0), menores primeiro, para cada nível de preço
-       de venda acima do base → recalcula clearing analítico com offset escalar.
+    3. Remove bids PRE (Precio≈0) segundo a estratégia opcoes['estrategia']
+       (ESTRATEGIAS_REMOCAO, menores primeiro por omissão), para cada nível de
+       preço de venda acima do base → recalcula clearing analítico com offset
+       escalar. Com opcoes['busca'] == 'poda' a varredura termina quando o
+       majorante do lucro dos níveis restantes não supera o melhor cenário.
+       Estratégias exactas (mochila) avaliam antes o cenário 'global'.
     4. Regista o cenário de lucro máximo.
     """
-    compras = df[
-        (df['Hora'] == Hora) & (df['Tipo Oferta'] == 'C') & (df['Pais'] == pais)
-    ].copy()
-    vendas = df[
-        (df['Hora'] == Hora) & (df['Tipo Oferta'] == 'V') & (df['Pais'] == pais)
-    ].copy()
-
-    if compras.empty or vendas.empty:
+    opcoes = opcoes or {}
+    if compras is None or vendas is None or compras.empty or vendas.empty:
         return None, []
 
     # ── Clearing ORIGINAL (sem escala) ───────────────────────────────────────
-    compras_orig = compras.sort_values('Precio', ascending=False).reset_index(drop=True)
-    vendas_orig  = vendas.sort_values( 'Precio', ascending=True ).reset_index(drop=True)
-    compras_orig['Volume_Acumulado'] = compras_orig['Energia'].cumsum()
-    vendas_orig ['Volume_Acumulado'] = vendas_orig ['Energia'].cumsum()
-
-    preco_orig, volume_orig = clearing(compras_df=compras_orig, vendas_df=vendas_orig)
+    if orig is None:
+        orig = clearing_bids_df(pd.concat([compras, vendas])).get((Hora, pais), (None, None))
+    preco_orig, volume_orig = orig
 
     # ── Aplicar escala de volumes ────────────────────────────────────────────
     compras_scaled, _ = aplica_escalao(
-        compras, mapa_unidades, escaloes,
+        compras, categorias, escaloes,
         Hora=Hora, volumes_diarios=volumes_diarios,
     )
     vendas_scaled, _ = aplica_escalao(
-        vendas, mapa_unidades, escaloes,
+        vendas, categorias, escaloes,
         Hora=Hora, volumes_diarios=volumes_diarios,
     )
 
@@ -429,6 +923,8 @@ def _processa_hora_pais(
     vendas_s ['Volume_Acumulado'] = vendas_s ['Energia'].cumsum()
 
     # ── Step tables + clearing BASE analítico ────────────────────────────────
+    # Construídas depois de aplica_escalao reescalar compras e vendas: as
+    # curvas por data de mibel.curvas (volumes em bruto) não servem aqui.
     cp, cv, vp, ve, vv, j_shift = _build_step_arrays(compras_s, vendas_s)
     preco_base, volume_base = _clearing_analitico(cp, cv, vp, ve, vv, j_shift, vol_rem=0.0)
 
@@ -436,9 +932,8 @@ def _processa_hora_pais(
         return None, []
 
     # ── Identificar bids PRE com Precio ≈ 0 ─────────────────────────────────
-    codigos_pre  = _identifica_codigos_pre(mapa_unidades, escaloes)
-    unids_upper  = vendas_s['Unidad'].astype(str).str.strip().str.upper()
-    mask_pre_zero = unids_upper.isin(codigos_pre) & vendas_s['Precio'].between(-0.001, 0.001)
+    codigos_pre   = _identifica_codigos_pre(categorias)
+    mask_pre_zero = vendas_s['cat_cod'].isin(codigos_pre) & vendas_s['Precio'].between(-0.001, 0.001)
 
     pre_candidatos = (
         vendas_s[mask_pre_zero]
@@ -446,29 +941,24 @@ def _processa_hora_pais(
         .reset_index(drop=True)
     )
 
-    pre_vacum_ord  = pre_candidatos['Volume_Acumulado'].values
-    pre_energy_ord = pre_candidatos['Energia'].values
-    pre_unidad_ord = pre_candidatos['Unidad'].values
-
-    def _lucro_pre(vol_clearing: float, vol_rem: float,
-                   preco_clearing: float, n_rem: int) -> float:
-        """Lucro PRE sem reconstruir DataFrames."""
-        vacum_presentes  = pre_vacum_ord[n_rem:]
-        energy_presentes = pre_energy_ord[n_rem:]
-        desp_mask = vacum_presentes <= vol_clearing + vol_rem + 1e-6
-        return float(energy_presentes[desp_mask].sum()) * preco_clearing
+    despacho = _DespachoPre(
+        pre_candidatos['Volume_Acumulado'].to_numpy(dtype=float),
+        pre_candidatos['Energia'].to_numpy(dtype=float),
+        pre_candidatos['Unidad'].to_numpy(),
+    )
+    pre_energy_ord = despacho.energia
 
     # ── Estado inicial ────────────────────────────────────────────────────────
-    vol_pre_total      = float(pre_candidatos['Energia'].sum())
-    n_bids_acum        = 0
-    vol_rem_acum       = 0.0
+    vol_pre_total = float(pre_candidatos['Energia'].sum())
 
-    lucro_base    = _lucro_pre(volume_base, 0.0, preco_base, n_rem=0)
+    lucro_base    = despacho.lucro(volume_base, 0.0, preco_base)
     lucro_melhor  = lucro_base
     preco_melhor  = preco_base
     volume_melhor = volume_base
     vol_rem_melhor    = 0.0
     n_bids_rem_melhor = 0
+    removidos_melhor  = despacho.removidos()
+    i_melhor          = 0
 
     logs_cenarios = [{
         'data_ficheiro':    internal_file,
@@ -483,38 +973,53 @@ def _processa_hora_pais(
     }]
 
     if not pre_candidatos.empty:
-        escaloes_acima = sorted(
-            vendas_s[vendas_s['Precio'] > preco_base + 1e-6]['Precio'].unique()
+        motor      = _MotorClearing(cp, cv, vp, ve, vv, j_shift)
+        estrategia = ESTRATEGIAS_REMOCAO[opcoes.get('estrategia', 'menor')](
+            pre_candidatos, despacho, motor, opcoes,
         )
 
-        for p_alvo in escaloes_acima:
-            sell_abaixo = vendas_s[vendas_s['Precio'] < p_alvo - 1e-6]['Energia'].sum()
-            buy_acima   = compras_s[compras_s['Precio'] >= p_alvo - 1e-6]['Energia'].sum()
-            vol_min     = max(0.0, sell_abaixo - buy_acima)
-
+        # Níveis de venda acima do base (vp já é único e ascendente)
+        escaloes_acima = vp[vp > preco_base + 1e-6]
+        vols_min       = _volumes_minimos(cp, cv, vp, vv, escaloes_acima)
+
+        # Poda: lucro de um cenário <= preço × energia PRE que fica, com
+        # preço <= preco_max (qualquer vol_rem possível) e energia que fica
+        # <= vol_pre_total - vol_min + folga. vol_min não decresce com o
+        # nível, logo o majorante também não cresce: quando não supera o
+        # melhor lucro, nenhum nível seguinte o pode substituir — o óptimo é
+        # o mesmo da varredura exaustiva.
+        preco_max = 0.0
+        if opcoes.get('busca') == 'poda':
+            preco_max = max(0.0, motor.preco_maximo(vol_pre_total * (1 + 1e-9) + 1e-6))
+        margem = estrategia.folga + vol_pre_total * 1e-9
+
+        niveis = [(f'esc_{p_alvo:.4f}', vol_min)
+                  for p_alvo, vol_min in zip(escaloes_acima.tolist(), vols_min.tolist())]
+        if estrategia.cenario_global:
+            niveis.insert(0, ('global', 0.0))
+
+        for cenario, vol_min in niveis:
             if vol_min > vol_pre_total + 1e-6:
                 continue
+            if (preco_max
+                    and preco_max * max(0.0, vol_pre_total - vol_min + margem)
+                        <= lucro_melhor + 1e-6):
+                break
 
-            # Acumular bids PRE (menores primeiro) até cobrir vol_min
-            while (n_bids_acum < len(pre_energy_ord)
-                   and vol_rem_acum < vol_min - 1e-6):
-                vol_rem_acum += pre_energy_ord[n_bids_acum]
-                n_bids_acum  += 1
+            # Remover bids PRE (segundo a estratégia) até cobrir vol_min
+            n_bids_acum, vol_rem_acum = estrategia.remove(vol_min)
 
-            preco_iter, volume_iter = _clearing_analitico(
-                cp, cv, vp, ve, vv, j_shift, vol_rem=vol_rem_acum
-            )
+            preco_iter, volume_iter = motor.clearing(vol_rem_acum)
             if preco_iter is None:
                 continue
 
-            lucro_iter = _lucro_pre(volume_iter, vol_rem_acum, preco_iter,
-                                    n_rem=n_bids_acum)
+            lucro_iter = despacho.lucro(volume_iter, vol_rem_acum, preco_iter)
 
             logs_cenarios.append({
                 'data_ficheiro':    internal_file,
                 'Hora':             Hora,
                 'pais':             pais,
-                'cenario':          f'esc_{p_alvo:.4f}',
+                'cenario':          cenario,
                 'preco_clearing':   preco_iter,
                 'volume_clearing':  volume_iter,
                 'lucro_pre':        lucro_iter,
@@ -528,17 +1033,18 @@ def _processa_hora_pais(
                 volume_melhor     = volume_iter
                 vol_rem_melhor    = vol_rem_acum
                 n_bids_rem_melhor = n_bids_acum
+                removidos_melhor  = despacho.removidos()
+                i_melhor          = len(logs_cenarios) - 1
 
     # ── Resultado do cenário óptimo ───────────────────────────────────────────
-    vacum_opt  = pre_vacum_ord[n_bids_rem_melhor:]
-    energy_opt = pre_energy_ord[n_bids_rem_melhor:]
-    unidad_opt = pre_unidad_ord[n_bids_rem_melhor:]
-    desp_mask_opt      = vacum_opt <= volume_melhor + vol_rem_melhor + 1e-6
-    vol_pre_despachado = float(energy_opt[desp_mask_opt].sum())
-    unidades_pre_desp  = list(dict.fromkeys(unidad_opt[desp_mask_opt].tolist()))
+    despacho.define_removidos(removidos_melhor)
+    desp_opt           = despacho.despachados(volume_melhor + vol_rem_melhor)
+    vol_pre_despachado = float(pre_energy_ord[desp_opt].sum())
+    unidades_pre_desp  = list(dict.fromkeys(despacho.unidades[desp_opt].tolist()))
 
-    desp_mask_base    = pre_vacum_ord <= volume_base + 1e-6
-    vol_pre_desp_base = float(pre_energy_ord[desp_mask_base].sum())
+    despacho.repoe()
+    desp_base         = despacho.despachados(volume_base)
+    vol_pre_desp_base = float(pre_energy_ord[desp_base].sum())
 
     log('OK',
         f'{internal_file}|H{Hora}|{pais} '
@@ -572,58 +1078,130 @@ def _processa_hora_pais(
         'unidades_pre_despachadas': ';'.join(unidades_pre_desp),
         'n_cenarios_testados':      len(logs_cenarios),
     }
-    return row, logs_cenarios
+    return row, _retem_cenarios(logs_cenarios, i_melhor, *opcoes.get('logs', ('todos', 0)))
+
+
+def _retem_cenarios(logs_cenarios: list, i_melhor: int, politica: str, n: int) -> list:
+    """
+    Política de retenção dos cenários de um (Hora, País) (--logs_cenarios):
+      todos  — todos os cenários testados
+      top    — os n cenários de maior lucro
+      optimo — os n níveis de cada lado do cenário óptimo
+      nenhum — nenhum
+    O cenário base (logs_cenarios[0]) é mantido em todas excepto 'nenhum'.
+    """
+    if politica == 'todos':
+        return logs_cenarios
+    if politica == 'nenhum':
+        return []
+
+    if politica == 'top':
+        melhores = sorted(range(1, len(logs_cenarios)),
+                          key=lambda k: logs_cenarios[k]['lucro_pre'], reverse=True)
+        manter = {0, *melhores[:n]}
+    else:
+        manter = {0, *range(max(1, i_melhor - n), min(len(logs_cenarios), i_melhor + n + 1))}
+    return [c for k, c in enumerate(logs_cenarios) if k in manter]
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  EXECUÇÃO EM PROCESSOS  (--executor process)
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Contexto constante do job em cada processo filho (definido por _inicia_processo)
+_CONTEXTO_PROCESSO: dict = {}
+
+
+def _inicia_processo(escaloes: dict, opcoes: dict) -> None:
+    """Initializer do ProcessPoolExecutor: guarda escalões, categorias e opções do job."""
+    _CONTEXTO_PROCESSO['escaloes']   = escaloes
+    _CONTEXTO_PROCESSO['categorias'] = lista_categorias(escaloes)
+    _CONTEXTO_PROCESSO['opcoes']     = opcoes
+
+
+def _tarefa_hora_pais(
+    caminhos: dict,
+    limites_c: tuple,
+    limites_v: tuple,
+    internal_file: str,
+    Hora: str,
+    pais: str,
+    volumes_diarios: dict,
+    orig: Optional[tuple] = None,
+) -> tuple[Optional[dict], list]:
+    """
+    Tarefa executada num processo filho: lê as fatias de compras e vendas do
+    par a partir das colunas mapeadas em memória (exporta_bids_mmap) e
+    devolve (row, logs_cenarios) de _processa_hora_pais().
+    """
+    compras = le_fatia_mmap(caminhos, *limites_c, Hora, pais, 'C')
+    vendas  = le_fatia_mmap(caminhos, *limites_v, Hora, pais, 'V')
+    return _processa_hora_pais(
+        compras, vendas, internal_file, Hora, pais,
+        _CONTEXTO_PROCESSO['categorias'], _CONTEXTO_PROCESSO['escaloes'],
+        volumes_diarios, _CONTEXTO_PROCESSO['opcoes'], orig,
+    )
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  NÍVEL 2 — PROCESSAMENTO DE UMA DATA A PARTIR DO CLICKHOUSE
 # ══════════════════════════════════════════════════════════════════════════════
 
+def _carrega_data(data_str: str, job_id: str, versoes: dict) -> tuple:
+    """
+    Estágio de leitura do pipeline (prefetch): bids de uma data, em leitura
+    colunar (numpy + categoricals) numa ligação própria da thread leitora,
+    e o clearing original da cache para a versão dos dados da data.
+
+    Devolve (df, clearing_orig) com clearing_orig = None se a data não tem
+    versão (mibel.bids_versao) ou não está na cache.
+    """
+    log('INFO', f'A carregar data {data_str} de mibel.bids_raw…', job_id)
+    versao = versoes.get(data_str)
+    return (
+        carrega_bids_dia_ch(data_str),
+        carrega_clearing_original_ch(data_str, versao) if versao else None,
+    )
+
+
 def _processa_data_ch(
-    data_str: str,
+    carregada: tuple,
     mapa_unidades_ch: dict,
     escaloes: dict,
     workers_hora_pais: int,
     job_id: str,
     ch,
-) -> tuple[list, list]:
+    pool_processos: Optional[ProcessPoolExecutor] = None,
+    dir_mmap: str = '',
+    opcoes: Optional[dict] = None,
+) -> tuple[list, list, Optional[dict]]:
     """
-    Carrega todos os bids de uma data a partir de mibel.bids_raw e paraleliza
-    o clearing/optimização por (Hora, Pais).  Cada thread cria a sua própria
-    ligação ao ClickHouse para a leitura.
+    Recebe os bids de uma data, lidos de mibel.bids_raw pelo estágio de
+    prefetch, e paraleliza o clearing/optimização por (Hora, Pais).
+    opcoes são as opções da optimização (ex.: estratégia de remoção PRE),
+    passadas a _processa_hora_pais.
+    carregada = (data_str, futuro) como produzido por prefetch(); o futuro
+    devolve (df, clearing_orig) de _carrega_data().
+
+    Devolve (rows, logs, clearing_novo); clearing_novo é o clearing original
+    de todos os pares do dia, calculado para preencher a cache, ou None (lido
+    da cache).
+
+    Com pool_processos (--executor process), as colunas do dia são escritas
+    em dir_mmap como ficheiros mapeados em memória e cada (Hora, Pais) é
+    enviado ao pool como tarefa.
     """
+    data_str, futuro_bids = carregada
     internal_file = f'bids_{data_str.replace("-", "")}'
-    log('INFO', f'A carregar data {data_str} de mibel.bids_raw…', job_id, ch)
 
-    ch_local = get_ch()
-    try:
-        rows_ch, cols_meta = ch_local.execute(
-            """
-            SELECT
-                hora_raw       AS Hora,
-                pais           AS Pais,
-                tipo_oferta    AS `Tipo Oferta`,
-                unidade        AS Unidad,
-                energia        AS Energia,
-                precio         AS Precio
-            FROM mibel.bids_raw
-            WHERE data_ficheiro = toDate(%(data)s)
-            """,
-            {'data': data_str},
-            with_column_types=True,
-        )
-    finally:
-        try:
-            ch_local.disconnect()
-        except Exception:
-            pass
-
-    if not rows_ch:
+    # Bids do ClickHouse (já lidos, ou em leitura, pelo prefetch)
+    df, clearing_cache = futuro_bids.result()
+    if df.empty:
         log('AVISO', f'{data_str}: sem dados em mibel.bids_raw', job_id, ch)
-        return [], []
-
-    col_names = [c[0] for c in cols_meta]
-    df = pd.DataFrame(rows_ch, columns=col_names)
+        return [], [], None
+    if clearing_cache is not None:
+        log('INFO', f'{data_str}: clearing original lido da cache ({len(clearing_cache)} pares)',
+            job_id, ch)
 
     n_rows  = len(df)
     n_units = df['Unidad'].nunique()
@@ -634,8 +1212,9 @@ def _processa_data_ch(
         f'países={paises} | horas {horas[0]}–{horas[-1]}',
         job_id, ch)
 
-    # Construção do mapa de unidades para esta data
-    mapa_unidades = build_mapa_unidades(df, mapa_unidades_ch, escaloes)
+    # Índice de categorias (mapa de unidades) para esta data
+    indice        = indexa_categorias(df, mapa_unidades_ch, escaloes)
+    mapa_unidades = indice['mapa_unidades']
 
     contagem_regime: dict[str, int] = {}
     for reg, _ in mapa_unidades.values():
@@ -646,28 +1225,22 @@ def _processa_data_ch(
         job_id, ch)
 
     # Volumes diários (para perfil_hora)
-    volumes_diarios = calcula_volumes_diarios(df, mapa_unidades, escaloes)
-
-    # Combinações (Hora, Pais)
-    combinacoes = [
-        (h, p)
-        for h in sorted(df['Hora'].unique())
-        for p in sorted(df[df['Hora'] == h]['Pais'].unique())
-    ]
+    volumes_diarios = calcula_volumes_diarios(df, indice, escaloes)
+
+    # Partição única do dia em fatias contíguas (Hora, Pais, Tipo)
+    df, particoes = particiona_bids(df)
+    combinacoes   = list(particoes)
     log('INFO', f'{data_str}: {len(combinacoes)} combinações (Hora × País)', job_id, ch)
 
+    if clearing_cache is not None and not cache_clearing_completa(clearing_cache, particoes):
+        log('AVISO', f'{data_str}: cache do clearing original incompleta — recalculado',
+            job_id, ch)
+        clearing_cache = None
+
     rows: list = []
     logs: list = []
 
-    with ThreadPoolExecutor(max_workers=workers_hora_pais) as ex:
-        futures = {
-            ex.submit(
-                _processa_hora_pais,
-                df, internal_file, h, p,
-                mapa_unidades, escaloes, volumes_diarios,
-            ): (h, p)
-            for h, p in combinacoes
-        }
+    def _recolhe(futures: dict) -> None:
         for fut in as_completed(futures):
             h, p = futures[fut]
             try:
@@ -678,6 +1251,43 @@ def _processa_data_ch(
             except Exception as e:
                 log('ERRO', f'{data_str}|H{h}|{p}: {e}', job_id, ch)
 
+    # Clearing ORIGINAL: da cache ou de todo o dia numa só chamada. Preenche a
+    # cache com todos os pares do dia, incluindo os que a optimização ignora
+    # (clearing base sem cruzamento), de que a substituição também precisa
+    clearing_orig = clearing_cache
+    if clearing_orig is None:
+        clearing_orig = clearing_bids_df(df)
+
+    if pool_processos is not None:
+        dir_dia  = os.path.join(dir_mmap, data_str)
+        caminhos = exporta_bids_mmap(df, dir_dia)
+        try:
+            _recolhe({
+                pool_processos.submit(
+                    _tarefa_hora_pais,
+                    caminhos,
+                    limites_fatia(particoes[(h, p)].get('C')),
+                    limites_fatia(particoes[(h, p)].get('V')),
+                    internal_file, h, p, volumes_diarios,
+                    clearing_orig.get((h, p)),
+                ): (h, p)
+                for h, p in combinacoes
+            })
+        finally:
+            shutil.rmtree(dir_dia, ignore_errors=True)
+    else:
+        with ThreadPoolExecutor(max_workers=workers_hora_pais) as ex:
+            _recolhe({
+                ex.submit(
+                    _processa_hora_pais,
+                    particoes[(h, p)].get('C'), particoes[(h, p)].get('V'),
+                    internal_file, h, p,
+                    indice['categorias'], escaloes, volumes_diarios, opcoes,
+                    clearing_orig.get((h, p)),
+                ): (h, p)
+                for h, p in combinacoes
+            })
+
     if rows:
         deltas = [r['delta_lucro_pre'] for r in rows if r['delta_lucro_pre'] is not None]
         avg_d  = sum(deltas) / len(deltas) if deltas else None
@@ -690,7 +1300,135 @@ def _processa_data_ch(
     else:
         log('AVISO', f'{data_str}: sem resultados', job_id, ch)
 
-    return rows, logs
+    clearing_novo = clearing_orig if clearing_cache is None else None
+    return rows, logs, clearing_novo
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  CONVERSÃO PARA O CLICKHOUSE  (por data, para o escritor em streaming)
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Tabelas de resultados do job (limpas por data incompleta em --resume)
+TABELAS_RESULTADO = (
+    'mibel.clearing_otimizacao',
+    'mibel.clearing_otimizacao_logs',
+    'mibel.clearing_otimizacao_cenarios',
+)
+
+# Colunas de cada cenário (uma linha por cenário em _logs, arrays em _cenarios)
+COLUNAS_CENARIOS = ('cenario', 'preco_clearing', 'volume_clearing',
+                    'lucro_pre', 'n_bids_removidos', 'vol_removido')
+
+
+def _linhas_ch(rows: list, job_id: str) -> list:
+    """Linhas de clearing_otimizacao a partir dos resultados de uma data."""
+    rows_ch = []
+    for r in rows:
+        hora_raw, hora_num, _ = normaliza_hora(r['Hora'])
+        data_str = extrai_data(r['internal_file'])
+        try:
+            data_date = date.fromisoformat(data_str)
+        except ValueError:
+            data_date = date(1970, 1, 1)
+
+        rows_ch.append({
+            'job_id':                   job_id,
+            'data_ficheiro':             data_str,
+            'data_date':                 data_date,
+            'hora_raw':                  hora_raw,
+            'hora_num':                  hora_num,
+            'pais':                      r['pais'],
+            'preco_clearing_orig':        r['preco_clearing_orig'],
+            'volume_clearing_orig':       r['volume_clearing_orig'],
+            'preco_clearing_base':        r['preco_clearing_base'],
+            'volume_clearing_base':       r['volume_clearing_base'],
+            'preco_clearing_opt':         r['preco_clearing_opt'],
+            'volume_clearing_opt':        r['volume_clearing_opt'],
+            'vol_pre_despachado_base':    r['vol_pre_despachado_base'],
+            'lucro_pre_base':             r['lucro_pre_base'],
+            'vol_pre_despachado_opt':     r['vol_pre_despachado_opt'],
+            'lucro_pre_opt':              r['lucro_pre_opt'],
+            'delta_preco':               r['delta_preco'],
+            'delta_vol_pre_despachado':  r['delta_vol_pre_despachado'],
+            'delta_lucro_pre':           r['delta_lucro_pre'],
+            'delta_lucro_pre_pct':       r['delta_lucro_pre_pct'],
+            'vol_pre_removido_opt':      r['vol_pre_removido_opt'],
+            'n_bids_pre_removidos':      r['n_bids_pre_removidos'],
+            'unidades_pre_despachadas':  r['unidades_pre_despachadas'],
+            'n_cenarios_testados':       r['n_cenarios_testados'],
+        })
+    return rows_ch
+
+
+def _linhas_logs_ch(logs: list, job_id: str) -> list:
+    """Linhas de clearing_otimizacao_logs a partir dos cenários de uma data."""
+    logs_ch = []
+    for l in logs:
+        hora_raw, hora_num, _ = normaliza_hora(l.get('Hora', '0'))
+        data_str = extrai_data(l.get('data_ficheiro', ''))
+        try:
+            data_date = date.fromisoformat(data_str)
+        except ValueError:
+            data_date = date(1970, 1, 1)
+
+        logs_ch.append({
+            'job_id':           job_id,
+            'data_ficheiro':    data_str,
+            'data_date':        data_date,
+            'hora_raw':         hora_raw,
+            'hora_num':         hora_num,
+            'pais':             l.get('pais', ''),
+            'cenario':          l.get('cenario', ''),
+            'preco_clearing':   l.get('preco_clearing'),
+            'volume_clearing':  l.get('volume_clearing'),
+            'lucro_pre':        float(l.get('lucro_pre', 0) or 0),
+            'n_bids_removidos': int(l.get('n_bids_removidos', 0) or 0),
+            'vol_removido':     float(l.get('vol_removido', 0) or 0),
+        })
+    return logs_ch
+
+
+def _linhas_cenarios_ch(logs: list, job_id: str) -> list:
+    """
+    Formato compacto (--formato_logs arrays): uma linha de
+    clearing_otimizacao_cenarios por (data, Hora, País), com os cenários em
+    arrays paralelos, em vez de uma linha por cenário.
+    """
+    linhas: dict = {}
+    for l in _linhas_logs_ch(logs, job_id):
+        chave = (l['data_ficheiro'], l['hora_raw'], l['pais'])
+        linha = linhas.get(chave)
+        if linha is None:
+            linha = linhas[chave] = {
+                **{k: l[k] for k in ('job_id', 'data_ficheiro', 'data_date',
+                                     'hora_raw', 'hora_num', 'pais')},
+                **{k: [] for k in COLUNAS_CENARIOS},
+            }
+        for k in COLUNAS_CENARIOS:
+            linha[k].append(l[k])
+    return list(linhas.values())
+
+
+def _novo_resumo() -> dict:
+    """Acumuladores do resumo final (tamanho constante, sem guardar linhas)."""
+    return {
+        'periodos': 0, 'n_logs': 0, 'n_cenarios': 0,
+        'soma_base': 0.0,  'n_base': 0,
+        'soma_opt': 0.0,   'n_opt': 0,
+        'soma_delta': 0.0, 'n_delta': 0,
+    }
+
+
+def _acumula_resumo(resumo: dict, rows: list, logs: list) -> None:
+    resumo['periodos'] += len(rows)
+    resumo['n_logs']   += len(logs)
+    resumo['n_cenarios'] += sum(r['n_cenarios_testados'] for r in rows)
+    for r in rows:
+        for chave, col in (('base', 'lucro_pre_base'), ('opt', 'lucro_pre_opt'),
+                           ('delta', 'delta_lucro_pre')):
+            if r.get(col) is not None:
+                resumo[f'soma_{chave}'] += r[col]
+                resumo[f'n_{chave}']    += 1
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -702,8 +1440,20 @@ def run_worker(
     data_inicio: str,
     data_fim: str,
     n_workers: int = 4,
+    executor: str = 'thread',
+    resume: bool = False,
+    prefetch_datas: int = 2,
+    fila_escrita: int = 2,
+    estrategia: str = 'menor',
+    busca: str = 'exaustiva',
+    logs_cenarios: str = 'todos',
+    logs_n: int = 5,
+    formato_logs: str = 'linhas',
 ) -> bool:
     ch = None
+    escritor: Optional[StreamingInserter] = None
+    pool_processos: Optional[ProcessPoolExecutor] = None
+    dir_mmap = ''
 
     try:
         ensure_output_dir()
@@ -712,7 +1462,12 @@ def run_worker(
         log('INFO', '═' * 60, job_id, ch)
         log('INFO', f'Job ID       : {job_id}', job_id, ch)
         log('INFO', f'Intervalo    : {data_inicio} → {data_fim}', job_id, ch)
-        log('INFO', f'Workers      : {n_workers}', job_id, ch)
+        log('INFO', f'Workers      : {n_workers} ({executor})', job_id, ch)
+        log('INFO', f'Estratégia   : {estrategia} (busca {busca})', job_id, ch)
+        log('INFO',
+            f'Cenários     : {logs_cenarios}'
+            f'{f" (n={logs_n})" if logs_cenarios in ("top", "optimo") else ""} '
+            f'em {formato_logs}', job_id, ch)
         log('INFO', '═' * 60, job_id, ch)
 
         # ── 1. Carregar configuração ─────────────────────────────────────────
@@ -727,6 +1482,16 @@ def run_worker(
             f'{n_pre} categorias PRE | {n_outras} categorias outras',
             job_id, ch)
 
+        opcoes = {
+            'estrategia': estrategia,
+            'busca':      busca,
+            'logs':       (logs_cenarios, logs_n),
+        }
+        if estrategia == 'agente':
+            opcoes['agentes'] = carrega_agentes_unidades_ch(ch)
+            log('INFO', f'{len(set(opcoes["agentes"].values()))} agentes titulares',
+                job_id, ch)
+
         # ── 2. Descobrir datas em mibel.bids_raw ─────────────────────────────
         rows_datas = ch.execute(
             "SELECT DISTINCT toString(data_ficheiro) "
@@ -746,151 +1511,132 @@ def run_worker(
             log('STATUS', 'DONE', job_id, ch)
             return True
 
-        log('INFO', f'Encontradas {len(datas)} data(s) em mibel.bids_raw:', job_id, ch)
+        versoes = versoes_bids_ch(ch, data_inicio, data_fim)
+        log('INFO', f'Encontradas {len(datas)} data(s) em mibel.bids_raw '
+                    f'({sum(d in versoes for d in datas)} com versão para a cache de clearing):',
+            job_id, ch)
         for d in datas[:10]:
             log('INFO', f'  • {d}', job_id, ch)
         if len(datas) > 10:
             log('INFO', f'  … e mais {len(datas) - 10} data(s)', job_id, ch)
 
-        # ── 3. Processar todas as datas ───────────────────────────────────────
+        # ── Retoma: saltar datas concluídas, limpar escritas parciais ────────
+        if resume:
+            concluidas = datas_concluidas(ch, job_id)
+            limpa_datas_incompletas(ch, job_id, TABELAS_RESULTADO, concluidas)
+            n_total = len(datas)
+            datas   = [d for d in datas if d not in concluidas]
+            log('INFO',
+                f'Retoma: {n_total - len(datas)} data(s) já concluída(s) — '
+                f'a processar {len(datas)}',
+                job_id, ch)
+            if not datas:
+                log('STATUS', 'DONE', job_id, ch)
+                return True
+
+        # ── 3. Processar todas as datas (inserção em streaming) ───────────────
         workers_data      = n_workers
         workers_hora_pais = max(2, n_workers)
 
         log('INFO',
-            f'Paralelismo: datas={workers_data} | hora/país={workers_hora_pais}',
+            f'Paralelismo: datas={workers_data} | hora/país={workers_hora_pais} | '
+            f'prefetch={prefetch_datas} | fila escrita={fila_escrita}',
             job_id, ch)
 
-        all_rows: list = []
-        all_logs: list = []
-        erros: list    = []
+        if executor == 'process':
+            # spawn: processos filho limpos, sem herdar ligações nem threads
+            pool_processos = ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_inicia_processo,
+                initargs=(escaloes, opcoes),
+            )
+            dir_mmap = cria_dir_mmap(job_id[:8])
+            log('INFO', f'Executor de processos: {n_workers} processos | mmap em {dir_mmap}',
+                job_id, ch)
+
+        # Cada data concluída segue para o escritor em background (fila
+        # limitada); a memória não cresce com o intervalo de datas.
+        resumo     = _novo_resumo()
+        erros: list = []
+        escritor   = StreamingInserter(max_pending=fila_escrita)
 
         with ThreadPoolExecutor(max_workers=workers_data) as ex:
-            futures = {
-                ex.submit(
-                    _processa_data_ch,
-                    d, mapa_unidades_ch, escaloes,
-                    workers_hora_pais,
-                    job_id, None,
-                ): d
-                for d in datas
-            }
             concluidos = 0
-            for fut in as_completed(futures):
-                d = futures[fut]
+            carregadas = prefetch(
+                datas, partial(_carrega_data, job_id=job_id, versoes=versoes), prefetch_datas,
+            )
+            for (d, _), fut in executa_em_janela(
+                ex, _processa_data_ch, carregadas, workers_data,
+                mapa_unidades_ch, escaloes,
+                workers_hora_pais,
+                job_id, None,
+                pool_processos, dir_mmap, opcoes,
+            ):
                 concluidos += 1
                 try:
-                    rows, logs = fut.result()
-                    all_rows.extend(rows)
-                    all_logs.extend(logs)
-                    log('INFO',
-                        f'[{concluidos}/{len(datas)}] {d} — '
-                        f'{len(rows)} períodos | acumulados: {len(all_rows)}',
-                        job_id, ch)
+                    rows, logs, clearing_novo = fut.result()
                 except Exception as e:
                     erros.append(d)
                     log('ERRO', f'{d}: {e}', job_id, ch)
+                    continue
 
-        # ── 4. Inserir resultados no ClickHouse ──────────────────────────────
+                # O marcador de progresso vai por último: só existe se a data
+                # foi integralmente escrita (ver --resume)
+                escritor.put([
+                    ('mibel.clearing_otimizacao', _linhas_ch(rows, job_id), False),
+                    ('mibel.clearing_otimizacao_cenarios', _linhas_cenarios_ch(logs, job_id), False)
+                    if formato_logs == 'arrays' else
+                    ('mibel.clearing_otimizacao_logs', _linhas_logs_ch(logs, job_id), False),
+                    *([registo_clearing_original(d, versoes[d], clearing_novo)]
+                      if clearing_novo and d in versoes else []),
+                    registo_progresso(job_id, 'otimizacao', d, len(rows), len(logs)),
+                ])
+                _acumula_resumo(resumo, rows, logs)
+                log('INFO',
+                    f'[{concluidos}/{len(datas)}] {d} — '
+                    f'{len(rows)} períodos | acumulados: {resumo["periodos"]}',
+                    job_id, ch)
+
+        # ── 4. Concluir inserção no ClickHouse ───────────────────────────────
+        inseridos = escritor.close()
         log('INFO', '─' * 60, job_id, ch)
         log('INFO',
-            f'Total: {len(all_rows)} períodos | {len(all_logs)} cenários testados',
+            f'Total: {resumo["periodos"]} períodos | {resumo["n_cenarios"]} cenários testados | '
+            f'{resumo["n_logs"]} registados',
             job_id, ch)
 
-        if all_rows:
-            log('INFO', f'A inserir {len(all_rows)} linhas em clearing_otimizacao…', job_id, ch)
-
-            rows_ch = []
-            for r in all_rows:
-                hora_raw, hora_num, _ = normaliza_hora(r['Hora'])
-                data_str = extrai_data(r['internal_file'])
-                try:
-                    data_date = date.fromisoformat(data_str)
-                except ValueError:
-                    data_date = date(1970, 1, 1)
-
-                rows_ch.append({
-                    'job_id':                   job_id,
-                    'data_ficheiro':             data_str,
-                    'data_date':                 data_date,
-                    'hora_raw':                  hora_raw,
-                    'hora_num':                  hora_num,
-                    'pais':                      r['pais'],
-                    'preco_clearing_orig':        r['preco_clearing_orig'],
-                    'volume_clearing_orig':       r['volume_clearing_orig'],
-                    'preco_clearing_base':        r['preco_clearing_base'],
-                    'volume_clearing_base':       r['volume_clearing_base'],
-                    'preco_clearing_opt':         r['preco_clearing_opt'],
-                    'volume_clearing_opt':        r['volume_clearing_opt'],
-                    'vol_pre_despachado_base':    r['vol_pre_despachado_base'],
-                    'lucro_pre_base':             r['lucro_pre_base'],
-                    'vol_pre_despachado_opt':     r['vol_pre_despachado_opt'],
-                    'lucro_pre_opt':              r['lucro_pre_opt'],
-                    'delta_preco':               r['delta_preco'],
-                    'delta_vol_pre_despachado':  r['delta_vol_pre_despachado'],
-                    'delta_lucro_pre':           r['delta_lucro_pre'],
-                    'delta_lucro_pre_pct':       r['delta_lucro_pre_pct'],
-                    'vol_pre_removido_opt':      r['vol_pre_removido_opt'],
-                    'n_bids_pre_removidos':      r['n_bids_pre_removidos'],
-                    'unidades_pre_despachadas':  r['unidades_pre_despachadas'],
-                    'n_cenarios_testados':       r['n_cenarios_testados'],
-                })
-
-            inserted = ch_insert_batch(ch, 'mibel.clearing_otimizacao', rows_ch)
-            log('INFO', f'Inseridos {inserted} registos em clearing_otimizacao', job_id, ch)
+        if resumo['periodos']:
+            log('INFO',
+                f'Inseridos {inseridos.get("mibel.clearing_otimizacao", 0)} registos '
+                f'em clearing_otimizacao', job_id, ch)
         else:
             log('AVISO', 'Sem resultados para inserir', job_id, ch)
 
-        if all_logs:
-            log('INFO', f'A inserir {len(all_logs)} cenários em clearing_otimizacao_logs…',
-                job_id, ch)
-
-            logs_ch = []
-            for l in all_logs:
-                hora_raw, hora_num, _ = normaliza_hora(l.get('Hora', '0'))
-                data_str = extrai_data(l.get('data_ficheiro', ''))
-                try:
-                    data_date = date.fromisoformat(data_str)
-                except ValueError:
-                    data_date = date(1970, 1, 1)
-
-                logs_ch.append({
-                    'job_id':           job_id,
-                    'data_ficheiro':    data_str,
-                    'data_date':        data_date,
-                    'hora_raw':         hora_raw,
-                    'hora_num':         hora_num,
-                    'pais':             l.get('pais', ''),
-                    'cenario':          l.get('cenario', ''),
-                    'preco_clearing':   l.get('preco_clearing'),
-                    'volume_clearing':  l.get('volume_clearing'),
-                    'lucro_pre':        float(l.get('lucro_pre', 0) or 0),
-                    'n_bids_removidos': int(l.get('n_bids_removidos', 0) or 0),
-                    'vol_removido':     float(l.get('vol_removido', 0) or 0),
-                })
-
-            inserted = ch_insert_batch(ch, 'mibel.clearing_otimizacao_logs', logs_ch)
-            log('INFO', f'Inseridos {inserted} cenários em clearing_otimizacao_logs', job_id, ch)
+        if resumo['n_logs']:
+            tabela_logs = ('clearing_otimizacao_cenarios' if formato_logs == 'arrays'
+                           else 'clearing_otimizacao_logs')
+            log('INFO',
+                f'Inseridos {inseridos.get(f"mibel.{tabela_logs}", 0)} '
+                f'{"períodos" if formato_logs == "arrays" else "cenários"} '
+                f'em {tabela_logs}', job_id, ch)
 
         # ── 5. Resumo final ──────────────────────────────────────────────────
         log('INFO', '═' * 60, job_id, ch)
-        lucros_b = [r['lucro_pre_base'] for r in all_rows if r.get('lucro_pre_base') is not None]
-        lucros_o = [r['lucro_pre_opt']  for r in all_rows if r.get('lucro_pre_opt')  is not None]
-        deltas_l = [r['delta_lucro_pre'] for r in all_rows if r.get('delta_lucro_pre') is not None]
-
-        if lucros_b:
-            log('INFO', f'Lucro PRE base    : {sum(lucros_b):.0f} € total  '
-                        f'(avg {sum(lucros_b)/len(lucros_b):.2f} €/período)',
+        if resumo['n_base']:
+            log('INFO', f'Lucro PRE base    : {resumo["soma_base"]:.0f} € total  '
+                        f'(avg {resumo["soma_base"]/resumo["n_base"]:.2f} €/período)',
                 job_id, ch)
-        if lucros_o:
-            log('INFO', f'Lucro PRE óptimo  : {sum(lucros_o):.0f} € total  '
-                        f'(avg {sum(lucros_o)/len(lucros_o):.2f} €/período)',
+        if resumo['n_opt']:
+            log('INFO', f'Lucro PRE óptimo  : {resumo["soma_opt"]:.0f} € total  '
+                        f'(avg {resumo["soma_opt"]/resumo["n_opt"]:.2f} €/período)',
                 job_id, ch)
-        if deltas_l:
-            log('INFO', f'Delta lucro PRE   : {sum(deltas_l):+.0f} € total  '
-                        f'(avg {sum(deltas_l)/len(deltas_l):+.2f} €/período)',
+        if resumo['n_delta']:
+            log('INFO', f'Delta lucro PRE   : {resumo["soma_delta"]:+.0f} € total  '
+                        f'(avg {resumo["soma_delta"]/resumo["n_delta"]:+.2f} €/período)',
                 job_id, ch)
 
-        log('INFO', f'Períodos processados : {len(all_rows)}', job_id, ch)
+        log('INFO', f'Períodos processados : {resumo["periodos"]}', job_id, ch)
         log('INFO', f'Datas com erro       : {len(erros)}', job_id, ch)
 
         if erros:
@@ -908,6 +1654,13 @@ def run_worker(
         return False
 
     finally:
+        if escritor is not None:
+            escritor.close(raise_error=False)
+        if pool_processos is not None:
+            pool_processos.shutdown(cancel_futures=True)
+        if dir_mmap:
+            shutil.rmtree(dir_mmap, ignore_errors=True)
+        flush_worker_logs()
         if ch:
             try:
                 ch.disconnect()
@@ -928,6 +1681,31 @@ def main() -> None:
     parser.add_argument('--data_fim',    required=True, help='Data fim YYYY-MM-DD')
     parser.add_argument('--workers',     type=int, default=4,
                         help='Threads paralelas (default: 4)')
+    parser.add_argument('--resume',      action='store_true',
+                        help='Retoma o job: salta as datas já concluídas')
+    parser.add_argument('--prefetch',    type=int, default=2,
+                        help='Datas lidas do ClickHouse à frente do cálculo (default: 2)')
+    parser.add_argument('--fila_escrita', type=int, default=2,
+                        help='Datas calculadas em fila para inserção (default: 2)')
+    parser.add_argument('--executor',    choices=('thread', 'process'), default='thread',
+                        help='Pares hora/país em threads ou em processos (default: thread)')
+    parser.add_argument('--estrategia',  choices=tuple(ESTRATEGIAS_REMOCAO), default='menor',
+                        help='Ordem de remoção dos bids PRE: menor, maior, tecnologia, '
+                             'agente ou mochila (óptimo exacto do lucro PRE por '
+                             'knapsack, resolução de 0.1 MW) (default: menor)')
+    parser.add_argument('--busca',       choices=('exaustiva', 'poda'), default='exaustiva',
+                        help='Níveis de preço: varredura exaustiva ou com poda por '
+                             'majorante do lucro, mesmo óptimo (default: exaustiva)')
+    parser.add_argument('--logs_cenarios', choices=('todos', 'top', 'optimo', 'nenhum'),
+                        default='todos',
+                        help='Cenários guardados por hora/país: todos, os --logs_n de maior '
+                             'lucro, --logs_n níveis à volta do óptimo, ou nenhum (default: todos)')
+    parser.add_argument('--logs_n',      type=int, default=5,
+                        help='N de --logs_cenarios top/optimo (default: 5)')
+    parser.add_argument('--formato_logs', choices=('linhas', 'arrays'), default='linhas',
+                        help='Cenários em clearing_otimizacao_logs (uma linha por cenário) ou '
+                             'em clearing_otimizacao_cenarios (arrays por hora/país) '
+                             '(default: linhas)')
     args = parser.parse_args()
 
     try:
@@ -942,6 +1720,15 @@ def main() -> None:
         data_inicio = args.data_inicio,
         data_fim    = args.data_fim,
         n_workers   = args.workers,
+        executor    = args.executor,
+        resume      = args.resume,
+        prefetch_datas = args.prefetch,
+        fila_escrita   = args.fila_escrita,
+        estrategia     = args.estrategia,
+        busca          = args.busca,
+        logs_cenarios  = args.logs_cenarios,
+        logs_n         = args.logs_n,
+        formato_logs   = args.formato_logs,
     )
     sys.exit(0 if ok else 1)
 
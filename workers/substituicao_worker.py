@@ -14,16 +14,19 @@ Fluxo de processamento
 ──────────────────────
   1. Carrega escalões (parametros.json) e mapa de unidades
      (tabela mibel.unidades: CODIGO → regime + categoria_zona)
-  2. Descobre ZIPs em /data/bids/ no intervalo de datas solicitado
-  3. Para cada ZIP (paralelo nível-1):
-       Para cada CSV interno (paralelo nível-2):
-         Lê DataFrame, constrói mapa de unidades para o ficheiro
-         Para cada (Hora, Pais) (paralelo nível-3):
-           a. Clearing ORIGINAL com clearing() de clearing.py
-           b. aplica_escalao(): escala de volume + escalões de preço por bid
-           c. Clearing COM SUBSTITUIÇÃO
-           d. Grava resultado + log de substituições
-  4. Insere em lote no ClickHouse
+  2. Descobre as datas disponíveis em mibel.bids_raw no intervalo solicitado
+     e a versão dos dados de cada data (mibel.bids_versao)
+  3. Pipeline por data: leitura antecipada (prefetch) → cálculo → escrita
+     Para cada data (paralelo nível-1):
+       Recebe o DataFrame do prefetch, constrói mapa de unidades para a data
+       a. Clearing ORIGINAL de todos os (Hora, Pais): da cache
+          mibel.clearing_original para a versão da data, ou calculado com
+          clearing_segmentado() e acrescentado à cache
+       b. Para cada variante (--variantes) e cada (Hora, Pais) (paralelo nível-2):
+            aplica_escalao(): escala de volume + escalões de preço por bid
+       c. Clearing COM SUBSTITUIÇÃO, em lote, sobre o dia modificado da variante
+       d. Entrega resultado + log de substituições ao escritor em streaming
+  4. O escritor insere cada data no ClickHouse em background (fila limitada)
   5. Emite [STATUS] DONE ou [STATUS] FAILED
 
 Uso:
@@ -31,141 +34,99 @@ Uso:
         --job_id  <UUID> \\
         --data_inicio YYYY-MM-DD \\
         --data_fim    YYYY-MM-DD \\
-        [--workers N]
+        [--workers N] [--executor thread|process] [--resume]
+        [--prefetch N] [--fila_escrita N]
+        [--variantes FICHEIRO.json]
+
+Variantes (--variantes)
+───────────────────────
+  Lista JSON de conjuntos de parâmetros com nome, cada um aplicado sobre o
+  parametros.json do job:
+    [{"nome": "solar_x2", "parametros": {"PRE": {"SOLAR_FOT_ES": {"escala": 2.0}}}}, …]
+  Cada data é lida e o clearing original calculado uma única vez; a
+  substituição e o clearing modificado são repetidos por variante e os
+  resultados gravados com a coluna 'variante'.
 """
 
 import argparse
+import json
+import multiprocessing
 import os
+import shutil
 import sys
-import threading
 import traceback
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import date, datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import date
+from functools import partial
 from typing import Optional
 
+import numpy as np
 import pandas as pd
 
 # ── Paths ─────────────────────────────────────────────────────────────────────
 sys.path.insert(0, '/app')                              # clearing.py
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # utils.py
 
-from clearing import clearing  # algoritmo real (pointer + degrau handling)
+from clearing import clearing_bids_df  # clearing em lote (pointer + degrau handling)
 from utils import (
-    get_ch, ch_insert_batch,
+    get_ch,
+    log, flush_worker_logs,
+    carrega_bids_dia_ch,
+    StreamingInserter,
+    executa_em_janela,
+    prefetch,
+    registo_progresso,
+    datas_concluidas,
+    versoes_bids_ch,
+    carrega_clearing_original_ch,
+    cache_clearing_completa,
+    registo_clearing_original,
+    limpa_datas_incompletas,
     carrega_escaloes,
+    distribui_escaloes,
+    concatena_colunas,
+    indexa_categorias,
+    lista_categorias,
+    posicoes_por_categoria,
+    particiona_bids,
+    cria_dir_mmap,
+    exporta_bids_mmap,
+    le_fatia_mmap,
+    limites_fatia,
     carrega_mapa_unidades_ch,
     normaliza_hora,
     extrai_data,
     ensure_output_dir,
 )
 
-# ══════════════════════════════════════════════════════════════════════════════
-#  LOGGING THREAD-SAFE
-# ══════════════════════════════════════════════════════════════════════════════
-
-_print_lock = threading.Lock()
-
-
-def log(nivel: str, mensagem: str, job_id: str = '', ch=None) -> None:
-    """
-    Escreve linha de log no stdout (thread-safe) e, opcionalmente,
-    insere na tabela worker_logs do ClickHouse.
-
-    Níveis usados: INFO, OK, AVISO, ERRO, CSV, ZIP, STATUS
-    A última linha com [STATUS] DONE ou [STATUS] FAILED é detectada pelo PHP
-    para actualizar o estado do job.
-    """
-    ts   = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    line = f'[{ts}] [{nivel}] {mensagem}'
-    with _print_lock:
-        print(line, flush=True)
-
-    if ch and job_id:
-        try:
-            ch.execute(
-                'INSERT INTO mibel.worker_logs (job_id, nivel, mensagem) VALUES',
-                [{'job_id': job_id, 'nivel': nivel, 'mensagem': mensagem}]
-            )
-        except Exception:
-            pass  # falha silenciosa — o log em stdout é suficiente
-
-
-
-# ══════════════════════════════════════════════════════════════════════════════
-#  CONSTRUÇÃO DO MAPA DE UNIDADES (CODIGO → (regime, categoria_zona))
-# ══════════════════════════════════════════════════════════════════════════════
-
-def build_mapa_unidades(
-    df: pd.DataFrame,
-    mapa_unidades_ch: dict,  # {CODIGO_UPPER: (regime, categoria_zona)} — da tabela mibel.unidades
-    escaloes: dict,          # ESCALOES completo (para validação)
-) -> dict:
-    """
-    Constrói {CODIGO_upper → (regime, categoria_zona)} filtrando do mapa
-    pré-classificado da tabela mibel.unidades pelas unidades presentes neste ficheiro.
-
-    A classificação (regime + categoria com sufixo _ES/_PT/_EXT) já foi calculada
-    por classificacao_pre.py a partir de LISTA_UNIDADES.csv, que contém a zona
-    de cada unidade. Não é necessário inferir o sufixo a partir do campo Pais
-    do ficheiro de bids.
-
-    Unidades não presentes na tabela ou cujo regime/categoria não existe nos
-    escalões configurados são excluídas do mapa e ignoradas.
-    """
-    unidades_no_ficheiro = set(
-        df['Unidad'].astype(str).str.strip().str.upper().unique()
-    )
-
-    mapa: dict = {}
-    for unidade in unidades_no_ficheiro:
-        if unidade not in mapa_unidades_ch:
-            continue
-        regime, cat_zona = mapa_unidades_ch[unidade]
-        if regime in escaloes and isinstance(escaloes[regime], dict):
-            if cat_zona in escaloes[regime]:
-                mapa[unidade] = (regime, cat_zona)
-
-    return mapa
-
-
 # ══════════════════════════════════════════════════════════════════════════════
 #  VOLUMES DIÁRIOS (suporte a perfil_hora)
 # ══════════════════════════════════════════════════════════════════════════════
 
 def calcula_volumes_diarios(
     df: pd.DataFrame,
-    mapa_unidades: dict,
+    indice: dict,
     escaloes: dict,
 ) -> dict:
     """
     Pré-calcula {(classe, categoria): {hora_int: volume_orig}} para
     categorias que tenham "perfil_hora" definido.
     Necessário para normalizar o factor horário sem alterar o volume total diário.
+
+    indice é o índice de categorias do dia devolvido por indexa_categorias().
     """
     volumes: dict = {}
-    unidades_upper = df['Unidad'].astype(str).str.strip().str.upper()
-
-    for classe, cats_dict in escaloes.items():
-        for categoria, cfg in cats_dict.items():
-            if 'perfil_hora' not in cfg:
-                continue
 
-            codigos = {
-                cod for cod, (reg, cat) in mapa_unidades.items()
-                if reg == classe and cat == categoria
-            }
-            if not codigos:
-                continue
-
-            mask = unidades_upper.isin(codigos)
-            if not mask.any():
-                continue
+    for k, pos in indice['posicoes'].items():
+        classe, categoria = indice['categorias'][k]
+        if 'perfil_hora' not in escaloes[classe][categoria]:
+            continue
 
-            df_cat = df[mask].copy()
-            df_cat['_h'] = pd.to_numeric(df_cat['Hora'], errors='coerce')
-            volumes[(classe, categoria)] = (
-                df_cat.groupby('_h')['Energia'].sum().to_dict()
-            )
+        df_cat = df.iloc[pos].copy()
+        df_cat['_h'] = pd.to_numeric(df_cat['Hora'], errors='coerce')
+        volumes[(classe, categoria)] = (
+            df_cat.groupby('_h')['Energia'].sum().to_dict()
+        )
 
     return volumes
 
@@ -202,15 +163,17 @@ def calcula_factor_horario(
 #  APLICAÇÃO DE ESCALA + ESCALÕES  (idêntico ao script C1 original)
 # ══════════════════════════════════════════════════════════════════════════════
 
+# Colunas do log de substituições (formato colunar: {coluna: np.ndarray})
+COLUNAS_LOG = ('Unidad', 'classe', 'categoria', 'escalao_preco', 'preco_original', 'Energia_MW')
+
+
 def aplica_escalao(
     df: pd.DataFrame,
-    mapa_unidades: dict,
+    categorias: list,
     escaloes: dict,
     Hora: str = '',
-    pais: str = '',
-    internal_file: str = '',
     volumes_diarios: Optional[dict] = None,
-) -> tuple[pd.DataFrame, list]:
+) -> tuple[pd.DataFrame, dict]:
     """
     Aplica para TODAS as classes (PRE, PRO, CONSUMO, COMERCIALIZADOR, …):
 
@@ -220,231 +183,290 @@ def aplica_escalao(
                         distribuindo volume acumulado pelos limiares definidos.
       • "delta_preco" — adiciona offset a todos os Precios da categoria.
 
-    Devolve (df_modificado, lista_de_logs_de_substituição).
-    """
-    df   = df.copy()
-    logs = []
+    As categorias dos bids vêm da coluna inteira 'cat_cod' (indexa_categorias);
+    categorias[k] é o par (classe, categoria) do código k.
 
-    unidades_upper = df['Unidad'].astype(str).str.strip().str.upper()
-
-    for classe, cats_dict in escaloes.items():
-        for categoria, cfg in cats_dict.items():
-
-            codigos = {
-                cod for cod, (reg, cat) in mapa_unidades.items()
-                if reg == classe and cat == categoria
-            }
-            if not codigos:
+    Devolve (df_modificado, log_de_substituição) com o log em formato colunar
+    {coluna: np.ndarray} (ver COLUNAS_LOG), uma posição por bid substituído.
+    """
+    energia = df['Energia'].to_numpy(dtype=float, copy=True)
+    precio  = df['Precio'].to_numpy(dtype=float, copy=True)
+    blocos  = []
+
+    for k, pos_cat in posicoes_por_categoria(df['cat_cod'].to_numpy()).items():
+        classe, categoria = categorias[k]
+        cfg = escaloes[classe][categoria]
+
+        # ── 1. Escala de volume ──────────────────────────────────────────────
+        if 'escala' in cfg:
+            if 'perfil_hora' in cfg and volumes_diarios is not None:
+                factor = calcula_factor_horario(Hora, cfg, volumes_diarios, classe, categoria)
+            else:
+                factor = cfg['escala']
+
+            if factor != 1.0:
+                energia[pos_cat] = energia[pos_cat] * factor
+
+        # ── 2. Escalões de preço (bids com Precio ≈ 0) ──────────────────────
+        if 'escaloes' in cfg:
+            escalonamento = cfg['escaloes']
+
+            p_cat    = precio[pos_cat]
+            pos_zero = pos_cat[(p_cat >= -0.001) & (p_cat <= 0.001)]
+            if len(pos_zero) == 0:
                 continue
 
-            mask_cat = unidades_upper.isin(codigos)
-            if not mask_cat.any():
-                continue
+            esc_idx = distribui_escaloes(energia[pos_zero], escalonamento)
+
+            precos_esc   = np.array([esc['preco'] for esc in escalonamento])
+            precos_novos = precos_esc[esc_idx]
+            alterar      = precos_novos != 0   # escalão a 0 → não modifica
+
+            if alterar.any():
+                pos = pos_zero[alterar]
+                precos_orig = precio[pos]
+                precio[pos] = precos_novos[alterar]
+
+                n = len(pos)
+                blocos.append({
+                    'Unidad':         df['Unidad'].to_numpy(dtype=object)[pos],
+                    'classe':         np.full(n, classe, dtype=object),
+                    'categoria':      np.full(n, categoria, dtype=object),
+                    'escalao_preco':  precos_novos[alterar].astype(float),
+                    'preco_original': precos_orig,
+                    'Energia_MW':     energia[pos],
+                })
 
-            # ── 1. Escala de volume ──────────────────────────────────────────
-            if 'escala' in cfg:
-                if 'perfil_hora' in cfg and volumes_diarios is not None:
-                    factor = calcula_factor_horario(Hora, cfg, volumes_diarios, classe, categoria)
-                else:
-                    factor = cfg['escala']
+        # ── 3. Delta de preço ────────────────────────────────────────────────
+        if 'delta_preco' in cfg:
+            delta = cfg['delta_preco']
+            if delta != 0.0:
+                precio[pos_cat] = precio[pos_cat] + delta
 
-                if factor != 1.0:
-                    df.loc[mask_cat, 'Energia'] = (
-                        df.loc[mask_cat, 'Energia'] * factor
-                    )
-                    # Recalcular máscara pois Energia mudou (mas Unidad não)
-                    unidades_upper = df['Unidad'].astype(str).str.strip().str.upper()
+    df = df.copy()
+    df['Energia'] = energia
+    df['Precio']  = precio
+    return df, concatena_colunas(blocos, COLUNAS_LOG)
 
-            # ── 2. Escalões de preço (bids com Precio ≈ 0) ──────────────────
-            if 'escaloes' in cfg:
-                escalonamento = cfg['escaloes']
 
-                mask_zero = mask_cat & df['Precio'].between(-0.001, 0.001)
-                df_zero   = df[mask_zero]
-                if df_zero.empty:
-                    continue
+# ══════════════════════════════════════════════════════════════════════════════
+#  VARIANTES DE PARÂMETROS  (--variantes)
+# ══════════════════════════════════════════════════════════════════════════════
 
-                vol_total = df_zero['Energia'].sum()
-                vol_acum  = 0.0
-                esc_idx   = 0
-
-                # Limiares de volume acumulado por escalão
-                limiares: list[float] = []
-                acum = 0.0
-                for esc in escalonamento[:-1]:
-                    acum += esc['pct_bids'] * vol_total
-                    limiares.append(acum)
-                limiares.append(float('inf'))
-
-                for idx in df_zero.index:
-                    energia_bid = df.at[idx, 'Energia']
-                    vol_acum   += energia_bid
-
-                    while (esc_idx < len(limiares) - 1
-                           and vol_acum > limiares[esc_idx] + 1e-9):
-                        esc_idx += 1
-
-                    preco_novo = escalonamento[esc_idx]['preco']
-                    if preco_novo == 0:
-                        continue  # escalão a 0 → não modifica
-
-                    preco_orig           = df.at[idx, 'Precio']
-                    df.at[idx, 'Precio'] = preco_novo
-
-                    logs.append({
-                        'internal_file': internal_file,
-                        'Hora':          Hora,
-                        'pais':          pais,
-                        'Unidad':        df.at[idx, 'Unidad'],
-                        'classe':        classe,
-                        'categoria':     categoria,
-                        'escalao_preco': preco_novo,
-                        'preco_original': preco_orig,
-                        'Energia_MW':    energia_bid,
-                    })
-
-            # ── 3. Delta de preço ────────────────────────────────────────────
-            if 'delta_preco' in cfg:
-                delta = cfg['delta_preco']
-                if delta != 0.0:
-                    df.loc[mask_cat, 'Precio'] = (
-                        df.loc[mask_cat, 'Precio'] + delta
-                    )
+def carrega_variantes(caminho: str, escaloes: dict) -> list:
+    """
+    Lê o ficheiro de variantes e devolve [(nome, escaloes_variante), …].
 
-    return df, logs
+    Cada variante altera apenas as chaves indicadas ("escala", "escaloes",
+    "delta_preco", "perfil_hora"; null remove a chave) das categorias já
+    definidas em parametros.json. As categorias são as mesmas em todas as
+    variantes, pelo que o índice de categorias do dia (indexa_categorias) é
+    partilhado; uma categoria desconhecida é um erro.
+    """
+    with open(caminho, 'r', encoding='utf-8') as f:
+        lista = json.load(f)
+    if not isinstance(lista, list) or not lista:
+        raise ValueError(f'{caminho}: esperada uma lista não vazia de variantes')
+
+    variantes: list = []
+    nomes: set = set()
+    for v in lista:
+        nome = str(v.get('nome', '')).strip()
+        if not nome or nome in nomes:
+            raise ValueError(f'{caminho}: variante sem nome ou repetida ({nome!r})')
+        nomes.add(nome)
+
+        esc_v = {classe: dict(cats) for classe, cats in escaloes.items()}
+        for classe, cats in (v.get('parametros') or {}).items():
+            for categoria, cfg in cats.items():
+                if categoria not in escaloes.get(classe, {}):
+                    raise ValueError(
+                        f'{caminho}: variante {nome!r} — categoria {classe}/{categoria} '
+                        f'não existe em parametros.json'
+                    )
+                novo = {**escaloes[classe][categoria], **cfg}
+                esc_v[classe][categoria] = {k: x for k, x in novo.items() if x is not None}
+        variantes.append((nome, esc_v))
+    return variantes
 
 
 # ══════════════════════════════════════════════════════════════════════════════
-#  NÍVEL 3 — PROCESSAMENTO POR (Hora, Pais)  [função pura, thread-safe]
+#  NÍVEL 3 — SUBSTITUIÇÃO POR (Hora, Pais)  [função pura, thread-safe]
 # ══════════════════════════════════════════════════════════════════════════════
 
 def _processa_hora_pais(
-    df: pd.DataFrame,
-    internal_file: str,
+    compras: Optional[pd.DataFrame],
+    vendas: Optional[pd.DataFrame],
     Hora: str,
-    pais: str,
-    mapa_unidades: dict,
+    categorias: list,
     escaloes: dict,
     volumes_diarios: dict,
 ) -> tuple:
     """
-    Calcula clearing original + clearing com substituição para um único
-    par (Hora, Pais). Função pura e thread-safe.
+    Aplica escala + escalões às compras e vendas de um único par (Hora, Pais),
+    recebidas como fatias da partição do dia (particiona_bids).
+    Função pura e thread-safe; o clearing é feito depois, em lote, sobre o dia.
 
-    Devolve (row_dict | None, lista_de_logs).
+    Devolve (compras_mod, vendas_mod, log_colunar) ou (None, None, None)
+    quando falta um dos lados do mercado.
     """
-    compras = df[
-        (df['Hora'] == Hora) & (df['Tipo Oferta'] == 'C') & (df['Pais'] == pais)
-    ].copy()
-    vendas = df[
-        (df['Hora'] == Hora) & (df['Tipo Oferta'] == 'V') & (df['Pais'] == pais)
-    ].copy()
+    if compras is None or vendas is None or compras.empty or vendas.empty:
+        return None, None, None
 
-    if compras.empty or vendas.empty:
-        return None, []
-
-    # ── Clearing ORIGINAL ────────────────────────────────────────────────────
-    compras_o = compras.sort_values('Precio', ascending=False).reset_index(drop=True)
-    vendas_o  = vendas.sort_values( 'Precio', ascending=True ).reset_index(drop=True)
-    compras_o['Volume_Acumulado'] = compras_o['Energia'].cumsum()
-    vendas_o ['Volume_Acumulado'] = vendas_o ['Energia'].cumsum()
-
-    preco_orig, volume_orig = clearing(compras_df=compras_o, vendas_df=vendas_o)
-
-    # ── Aplicar escala + escalões ────────────────────────────────────────────
     compras_mod, _ = aplica_escalao(
-        compras, mapa_unidades, escaloes,
+        compras, categorias, escaloes,
         Hora=Hora, volumes_diarios=volumes_diarios,
     )
     vendas_mod, logs_sub = aplica_escalao(
-        vendas, mapa_unidades, escaloes,
-        Hora=Hora, pais=pais, internal_file=internal_file,
-        volumes_diarios=volumes_diarios,
+        vendas, categorias, escaloes,
+        Hora=Hora, volumes_diarios=volumes_diarios,
     )
+    return compras_mod, vendas_mod, logs_sub
 
-    # ── Clearing COM SUBSTITUIÇÃO ────────────────────────────────────────────
-    compras_s = compras_mod.sort_values('Precio', ascending=False).reset_index(drop=True)
-    vendas_s  = vendas_mod.sort_values( 'Precio', ascending=True ).reset_index(drop=True)
-    compras_s['Volume_Acumulado'] = compras_s['Energia'].cumsum()
-    vendas_s ['Volume_Acumulado'] = vendas_s ['Energia'].cumsum()
 
-    preco_sub, volume_sub = clearing(compras_df=compras_s, vendas_df=vendas_s)
+# ══════════════════════════════════════════════════════════════════════════════
+#  EXECUÇÃO EM PROCESSOS  (--executor process)
+# ══════════════════════════════════════════════════════════════════════════════
 
-    delta = (
-        (preco_sub - preco_orig)
-        if preco_sub is not None and preco_orig is not None
-        else None
-    )
+# Contexto constante do job em cada processo filho (definido por _inicia_processo)
+_CONTEXTO_PROCESSO: dict = {}
 
-    row = {
-        'Hora':                  Hora,
-        'pais':                  pais,
-        'internal_file':         internal_file,
-        'preco_clearing_orig':   preco_orig,
-        'volume_clearing_orig':  volume_orig,
-        'preco_clearing_sub':    preco_sub,
-        'volume_clearing_sub':   volume_sub,
-        'delta_preco':           delta,
-        'n_bids_substituidos':   len(logs_sub),
-    }
-    return row, logs_sub
+
+def _inicia_processo(escaloes: dict, variantes: list) -> None:
+    """Initializer do ProcessPoolExecutor: guarda variantes e categorias do job."""
+    _CONTEXTO_PROCESSO['variantes']  = variantes
+    _CONTEXTO_PROCESSO['categorias'] = lista_categorias(escaloes)
+
+
+def _resultado_hora_pais(
+    compras: Optional[pd.DataFrame],
+    vendas: Optional[pd.DataFrame],
+    Hora: str,
+    pais: str,
+    categorias: list,
+    variantes: list,
+    volumes_diarios: dict,
+    orig: Optional[tuple] = None,
+) -> Optional[tuple]:
+    """
+    Substituição + clearing (original e modificado) de um único par
+    (Hora, Pais). O clearing de um só segmento em clearing_segmentado() dá o
+    mesmo resultado que o clearing em lote do dia.
+
+    O clearing original é calculado uma vez (ou recebido em orig, vindo da
+    cache mibel.clearing_original); a substituição e o clearing modificado
+    repetem-se para cada (nome, escaloes) de variantes, com os volumes
+    diários volumes_diarios[nome].
+
+    Devolve ((preco_orig, volume_orig), {nome: ((preco_sub, volume_sub), log_colunar)})
+    ou None quando falta um dos lados do mercado.
+    """
+    if compras is None or vendas is None or compras.empty or vendas.empty:
+        return None
+
+    if orig is None:
+        orig = clearing_bids_df(pd.concat([compras, vendas])).get((Hora, pais), (None, None))
+    por_variante: dict = {}
+    for nome, escaloes in variantes:
+        compras_mod, vendas_mod, log_este = _processa_hora_pais(
+            compras, vendas, Hora,
+            categorias, escaloes, volumes_diarios[nome],
+        )
+        sub = clearing_bids_df(pd.concat([compras_mod, vendas_mod]))
+        por_variante[nome] = (sub.get((Hora, pais), (None, None)), log_este)
+    return orig, por_variante
+
+
+def _tarefa_hora_pais(
+    caminhos: dict,
+    limites_c: tuple,
+    limites_v: tuple,
+    Hora: str,
+    pais: str,
+    volumes_diarios: dict,
+    orig: Optional[tuple] = None,
+) -> Optional[tuple]:
+    """
+    Tarefa executada num processo filho: lê as fatias de compras e vendas do
+    par a partir das colunas mapeadas em memória (exporta_bids_mmap) e
+    devolve o resultado compacto de _resultado_hora_pais().
+    """
+    compras = le_fatia_mmap(caminhos, *limites_c, Hora, pais, 'C')
+    vendas  = le_fatia_mmap(caminhos, *limites_v, Hora, pais, 'V')
+    return _resultado_hora_pais(
+        compras, vendas, Hora, pais,
+        _CONTEXTO_PROCESSO['categorias'], _CONTEXTO_PROCESSO['variantes'],
+        volumes_diarios, orig,
+    )
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  NÍVEL 2 — PROCESSAMENTO DE UMA DATA A PARTIR DO CLICKHOUSE
 # ══════════════════════════════════════════════════════════════════════════════
 
+def _carrega_data(data_str: str, job_id: str, versoes: dict) -> tuple:
+    """
+    Estágio de leitura do pipeline (prefetch): bids de uma data, em leitura
+    colunar (numpy + categoricals) numa ligação própria da thread leitora,
+    e o clearing original da cache para a versão dos dados da data.
+
+    Devolve (df, clearing_orig) com clearing_orig = None se a data não tem
+    versão (mibel.bids_versao) ou não está na cache.
+    """
+    log('INFO', f'A carregar data {data_str} de mibel.bids_raw…', job_id)
+    versao = versoes.get(data_str)
+    return (
+        carrega_bids_dia_ch(data_str),
+        carrega_clearing_original_ch(data_str, versao) if versao else None,
+    )
+
+
 def _processa_data_ch(
-    data_str: str,
+    carregada: tuple,
     mapa_unidades_ch: dict,
     escaloes: dict,
+    variantes: list,
     workers_hora_pais: int,
     job_id: str,
     ch,       # None quando chamado a partir de thread filho
-) -> tuple[list, list]:
+    pool_processos: Optional[ProcessPoolExecutor] = None,
+    dir_mmap: str = '',
+) -> tuple[list, list, Optional[dict]]:
     """
-    Nível 2 — carrega todos os bids de uma data a partir de mibel.bids_raw e
-    paraleliza o clearing por (Hora, Pais).
-
-    Cada thread cria a sua própria ligação ao ClickHouse para a leitura,
-    evitando contenção sobre a ligação da thread pai.
-
-    Devolve (rows, logs) prontos para inserção em clearing_substituicao.
+    Nível 2 — recebe os bids de uma data, lidos de mibel.bids_raw pelo
+    estágio de prefetch, e paraleliza o clearing por (Hora, Pais).
+
+    carregada = (data_str, futuro) como produzido por prefetch(); o futuro
+    devolve (df, clearing_orig) de _carrega_data() (ou a excepção da
+    leitura). Com clearing_orig da cache, o clearing original não é
+    recalculado.
+
+    variantes = [(nome, escaloes_variante), …] (carrega_variantes); sem
+    --variantes é [('', escaloes)]. O clearing original é comum a todas.
+
+    Com pool_processos (--executor process), as colunas do dia são escritas
+    em dir_mmap como ficheiros mapeados em memória e cada (Hora, Pais) é
+    enviado ao pool como tarefa, sem serializar DataFrames.
+
+    Devolve (rows, logs, clearing_novo) com rows e logs prontos para inserção
+    em clearing_substituicao; logs é uma lista de blocos colunares, um por
+    (Hora, Pais), com as chaves 'internal_file', 'Hora' e 'pais' e as colunas
+    de COLUNAS_LOG. Com variantes nomeadas, linhas e blocos levam também a
+    chave 'variante'. clearing_novo é o clearing original calculado para
+    preencher a cache, ou None (lido da cache, ou incompleto por erros).
     """
+    data_str, futuro_bids = carregada
     # Nome sintético compatível com extrai_data() — 8 dígitos contíguos
     internal_file = f'bids_{data_str.replace("-", "")}'
-    log('INFO', f'A carregar data {data_str} de mibel.bids_raw…', job_id, ch)
 
-    # ── Carregar bids do ClickHouse ──────────────────────────────────────────
-    ch_local = get_ch()
-    try:
-        rows_ch, cols_meta = ch_local.execute(
-            """
-            SELECT
-                hora_raw        AS Hora,
-                pais            AS Pais,
-                tipo_oferta     AS `Tipo Oferta`,
-                unidade         AS Unidad,
-                energia         AS Energia,
-                precio          AS Precio
-            FROM mibel.bids_raw
-            WHERE data_ficheiro = toDate(%(data)s)
-            """,
-            {'data': data_str},
-            with_column_types=True,
-        )
-    finally:
-        try:
-            ch_local.disconnect()
-        except Exception:
-            pass
-
-    if not rows_ch:
+    # ── Bids do ClickHouse (já lidos, ou em leitura, pelo prefetch) ──────────
+    df, clearing_cache = futuro_bids.result()
+    if df.empty:
         log('AVISO', f'{data_str}: sem dados em mibel.bids_raw', job_id, ch)
-        return [], []
-
-    col_names = [c[0] for c in cols_meta]
-    df = pd.DataFrame(rows_ch, columns=col_names)
+        return [], [], None
+    if clearing_cache is not None:
+        log('INFO', f'{data_str}: clearing original lido da cache ({len(clearing_cache)} pares)',
+            job_id, ch)
 
     n_rows  = len(df)
     n_units = df['Unidad'].nunique()
@@ -455,8 +477,9 @@ def _processa_data_ch(
         f'países={paises} | horas {horas[0]}–{horas[-1]}',
         job_id, ch)
 
-    # ── Construção do mapa de unidades para esta data ────────────────────────
-    mapa_unidades = build_mapa_unidades(df, mapa_unidades_ch, escaloes)
+    # ── Índice de categorias (mapa de unidades) para esta data ───────────────
+    indice        = indexa_categorias(df, mapa_unidades_ch, escaloes)
+    mapa_unidades = indice['mapa_unidades']
 
     contagem_regime: dict[str, int] = {}
     for reg, _ in mapa_unidades.values():
@@ -471,52 +494,148 @@ def _processa_data_ch(
     if n_sem:
         log('AVISO', f'{data_str}: {n_sem} unidades sem classificação (serão ignoradas)', job_id, ch)
 
-    # ── Volumes diários (para perfil_hora) ──────────────────────────────────
-    volumes_diarios = calcula_volumes_diarios(df, mapa_unidades, escaloes)
+    # ── Volumes diários (para perfil_hora), por variante ────────────────────
+    volumes_diarios = {
+        nome: calcula_volumes_diarios(df, indice, esc_v) for nome, esc_v in variantes
+    }
 
-    # ── Combinações (Hora, Pais) ─────────────────────────────────────────────
-    combinacoes = [
-        (h, p)
-        for h in sorted(df['Hora'].unique())
-        for p in sorted(df[df['Hora'] == h]['Pais'].unique())
-    ]
+    # ── Partição única do dia em fatias (Hora, Pais, Tipo) ──────────────────
+    df, particoes = particiona_bids(df)
+    combinacoes   = list(particoes)
     log('INFO', f'{data_str}: {len(combinacoes)} combinações (Hora × País)', job_id, ch)
 
+    if clearing_cache is not None and not cache_clearing_completa(clearing_cache, particoes):
+        log('AVISO', f'{data_str}: cache do clearing original incompleta — recalculado',
+            job_id, ch)
+        clearing_cache = None
+
+    # {(Hora, Pais): ((preco_orig, vol_orig), {variante: ((preco_sub, vol_sub), log_colunar)})}
+    resultados: dict = {}
+    clearing_novo: Optional[dict] = None
+
+    if pool_processos is not None:
+        # ── Pares (Hora, Pais) em processos, sobre colunas mapeadas ─────────
+        dir_dia  = os.path.join(dir_mmap, data_str)
+        caminhos = exporta_bids_mmap(df, dir_dia)
+        try:
+            futures = {
+                pool_processos.submit(
+                    _tarefa_hora_pais,
+                    caminhos,
+                    limites_fatia(particoes[(h, p)].get('C')),
+                    limites_fatia(particoes[(h, p)].get('V')),
+                    h, p, volumes_diarios,
+                    clearing_cache.get((h, p)) if clearing_cache is not None else None,
+                ): (h, p)
+                for h, p in combinacoes
+            }
+            falhas = 0
+            for fut in as_completed(futures):
+                h, p = futures[fut]
+                try:
+                    res = fut.result()
+                    if res is not None:
+                        resultados[(h, p)] = res
+                except Exception as e:
+                    falhas += 1
+                    log('ERRO', f'{data_str}|H{h}|{p}: {e}', job_id, ch)
+        finally:
+            shutil.rmtree(dir_dia, ignore_errors=True)
+
+        if clearing_cache is None and not falhas:
+            clearing_novo = {par: res[0] for par, res in resultados.items()}
+
+    else:
+        # ── Clearing ORIGINAL — da cache, ou todos os pares numa só chamada ──
+        if clearing_cache is not None:
+            clearing_orig = clearing_cache
+        else:
+            clearing_orig = clearing_novo = clearing_bids_df(df)
+
+        # Uma variante de cada vez: só os bids modificados de uma variante
+        # estão em memória em cada momento
+        with ThreadPoolExecutor(max_workers=workers_hora_pais) as ex:
+            for nome, esc_v in variantes:
+                # ── Escala + escalões por (Hora, Pais) ───────────────────────
+                mods:      list = []
+                logs_par:  dict = {}
+                futures = {
+                    ex.submit(
+                        _processa_hora_pais,
+                        particoes[(h, p)].get('C'), particoes[(h, p)].get('V'), h,
+                        indice['categorias'], esc_v, volumes_diarios[nome],
+                    ): (h, p)
+                    for h, p in combinacoes
+                }
+                for fut in as_completed(futures):
+                    h, p = futures[fut]
+                    try:
+                        compras_mod, vendas_mod, log_este = fut.result()
+                        if compras_mod is not None:
+                            mods.extend((compras_mod, vendas_mod))
+                            logs_par[(h, p)] = log_este
+                    except Exception as e:
+                        log('ERRO', f'{data_str}|H{h}|{p}: {e}', job_id, ch)
+
+                # ── Clearing COM SUBSTITUIÇÃO — em lote sobre o dia modificado
+                clearing_sub = clearing_bids_df(pd.concat(mods)) if mods else {}
+
+                for par, log_este in logs_par.items():
+                    if par in clearing_orig:
+                        resultados.setdefault(par, (clearing_orig[par], {}))[1][nome] = (
+                            clearing_sub.get(par, (None, None)),
+                            log_este,
+                        )
+
     rows: list = []
     logs: list = []
 
-    # ── Paralelismo por (Hora, Pais) ─────────────────────────────────────────
-    with ThreadPoolExecutor(max_workers=workers_hora_pais) as ex:
-        futures = {
-            ex.submit(
-                _processa_hora_pais,
-                df, internal_file, h, p,
-                mapa_unidades, escaloes, volumes_diarios,
-            ): (h, p)
-            for h, p in combinacoes
-        }
-        for fut in as_completed(futures):
-            h, p = futures[fut]
-            try:
-                row, log_este = fut.result()
-                if row is not None:
-                    rows.append(row)
-                    po    = row['preco_clearing_orig']
-                    ps    = row['preco_clearing_sub']
-                    delta = row['delta_preco']
-                    if po and ps:
-                        pct = ((ps / po) - 1) * 100 if po else 0
-                        log('OK',
-                            f'{data_str}|H{h}|{p} '
-                            f'orig={po:.4f} sub={ps:.4f} '
-                            f'Δ={delta:+.4f} ({pct:+.2f}%) '
-                            f'bids_sub={row["n_bids_substituidos"]}',
-                            job_id)
-                    else:
-                        log('OK', f'{data_str}|H{h}|{p} orig={po} sub={ps}', job_id)
-                logs.extend(log_este)
-            except Exception as e:
-                log('ERRO', f'{data_str}|H{h}|{p}: {e}', job_id, ch)
+    for h, p in combinacoes:
+        if (h, p) not in resultados:
+            continue
+        (preco_orig, volume_orig), por_variante = resultados[(h, p)]
+
+        for nome, _ in variantes:
+            if nome not in por_variante:
+                continue
+            (preco_sub, volume_sub), log_este = por_variante[nome]
+            chave = {'variante': nome} if nome else {}
+
+            delta = (
+                (preco_sub - preco_orig)
+                if preco_sub is not None and preco_orig is not None
+                else None
+            )
+
+            row = {
+                'Hora':                  h,
+                'pais':                  p,
+                **chave,
+                'internal_file':         internal_file,
+                'preco_clearing_orig':   preco_orig,
+                'volume_clearing_orig':  volume_orig,
+                'preco_clearing_sub':    preco_sub,
+                'volume_clearing_sub':   volume_sub,
+                'delta_preco':           delta,
+                'n_bids_substituidos':   len(log_este['Unidad']),
+            }
+            rows.append(row)
+            if row['n_bids_substituidos']:
+                logs.append({'internal_file': internal_file, 'Hora': h, 'pais': p,
+                             **chave, **log_este})
+
+            prefixo = f'{data_str}|H{h}|{p}' + (f'|{nome}' if nome else '')
+            po, ps = preco_orig, preco_sub
+            if po and ps:
+                pct = ((ps / po) - 1) * 100 if po else 0
+                log('OK',
+                    f'{prefixo} '
+                    f'orig={po:.4f} sub={ps:.4f} '
+                    f'Δ={delta:+.4f} ({pct:+.2f}%) '
+                    f'bids_sub={row["n_bids_substituidos"]}',
+                    job_id)
+            else:
+                log('OK', f'{prefixo} orig={po} sub={ps}', job_id)
 
     # Resumo da data
     if rows:
@@ -534,7 +653,112 @@ def _processa_data_ch(
     else:
         log('AVISO', f'{data_str}: sem resultados de clearing', job_id, ch)
 
-    return rows, logs
+    return rows, logs, clearing_novo
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  CONVERSÃO PARA O CLICKHOUSE  (por data, para o escritor em streaming)
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Tabelas de resultados do job (limpas por data incompleta em --resume)
+TABELAS_RESULTADO = ('mibel.clearing_substituicao', 'mibel.clearing_substituicao_logs')
+
+
+def _linhas_ch(rows: list, job_id: str) -> list:
+    """Linhas de clearing_substituicao a partir dos resultados de uma data."""
+    rows_ch = []
+    for r in rows:
+        hora_raw, hora_num, _ = normaliza_hora(r['Hora'])
+        data_str = extrai_data(r['internal_file'])
+        try:
+            data_date = date.fromisoformat(data_str)
+        except ValueError:
+            data_date = date(1970, 1, 1)
+
+        rows_ch.append({
+            'job_id':                job_id,
+            'data_ficheiro':         data_str,
+            'data_date':             data_date,
+            'hora_raw':              hora_raw,
+            'hora_num':              hora_num,
+            'pais':                  r['pais'],
+            **({'variante': r['variante']} if 'variante' in r else {}),
+            'preco_clearing_orig':   r['preco_clearing_orig'],
+            'volume_clearing_orig':  r['volume_clearing_orig'],
+            'preco_clearing_sub':    r['preco_clearing_sub'],
+            'volume_clearing_sub':   r['volume_clearing_sub'],
+            'delta_preco':           r['delta_preco'],
+            'n_bids_substituidos':   r['n_bids_substituidos'] or 0,
+        })
+    return rows_ch
+
+
+def _colunas_logs_ch(logs: list, job_id: str) -> dict:
+    """Colunas de clearing_substituicao_logs a partir dos blocos de uma data."""
+    logs_ch: dict = {col: [] for col in (
+        'job_id', 'data_ficheiro', 'data_date', 'hora_raw', 'hora_num', 'pais',
+        'unidade', 'categoria', 'escalao_preco', 'preco_original', 'energia_mw',
+    )}
+    if any('variante' in b for b in logs):
+        logs_ch['variante'] = []
+    for b in logs:
+        n = len(b['Unidad'])
+        hora_raw, hora_num, _ = normaliza_hora(b['Hora'])
+        data_str = extrai_data(b['internal_file'])
+        try:
+            data_date = date.fromisoformat(data_str)
+        except ValueError:
+            data_date = date(1970, 1, 1)
+
+        logs_ch['job_id'].extend([job_id] * n)
+        logs_ch['data_ficheiro'].extend([data_str] * n)
+        logs_ch['data_date'].extend([data_date] * n)
+        logs_ch['hora_raw'].extend([hora_raw] * n)
+        logs_ch['hora_num'].extend([hora_num] * n)
+        logs_ch['pais'].extend([b['pais']] * n)
+        if 'variante' in logs_ch:
+            logs_ch['variante'].extend([b.get('variante', '')] * n)
+        logs_ch['unidade'].extend(str(u) for u in b['Unidad'])
+        logs_ch['categoria'].extend(b['categoria'].tolist())
+        logs_ch['escalao_preco'].extend(b['escalao_preco'].astype(float).tolist())
+        logs_ch['preco_original'].extend(b['preco_original'].astype(float).tolist())
+        logs_ch['energia_mw'].extend(b['Energia_MW'].astype(float).tolist())
+    return logs_ch
+
+
+def _novo_resumo() -> dict:
+    """Acumuladores do resumo final (tamanho constante, sem guardar linhas)."""
+    return {
+        'periodos': 0, 'n_logs': 0, 'bids_sub': 0,
+        'soma_orig': 0.0, 'n_orig': 0,
+        'soma_sub': 0.0,  'n_sub': 0,
+        'soma_delta': 0.0, 'n_delta': 0,
+        'min_delta': float('inf'), 'max_delta': float('-inf'),
+        'variantes': {},   # {variante: [soma_delta, n_delta]}
+    }
+
+
+def _acumula_resumo(resumo: dict, rows: list, logs: list) -> None:
+    resumo['periodos'] += len(rows)
+    resumo['n_logs']   += sum(len(b['Unidad']) for b in logs)
+    for r in rows:
+        resumo['bids_sub'] += r.get('n_bids_substituidos', 0)
+        if r['preco_clearing_orig'] is not None:
+            resumo['soma_orig'] += r['preco_clearing_orig']
+            resumo['n_orig']    += 1
+        if r['preco_clearing_sub'] is not None:
+            resumo['soma_sub'] += r['preco_clearing_sub']
+            resumo['n_sub']    += 1
+        d = r['delta_preco']
+        if d is not None:
+            resumo['soma_delta'] += d
+            resumo['n_delta']    += 1
+            resumo['min_delta']   = min(resumo['min_delta'], d)
+            resumo['max_delta']   = max(resumo['max_delta'], d)
+            if 'variante' in r:
+                acc = resumo['variantes'].setdefault(r['variante'], [0.0, 0])
+                acc[0] += d
+                acc[1] += 1
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -546,16 +770,34 @@ def run_worker(
     data_inicio: str,
     data_fim: str,
     n_workers: int = 4,
+    executor: str = 'thread',
+    resume: bool = False,
+    prefetch_datas: int = 2,
+    fila_escrita: int = 2,
+    variantes: str = '',
 ) -> bool:
     """
     Ponto de entrada principal do worker.
 
     Arquitectura de threads:
-      workers_zip       = n_workers        (ZIPs em paralelo)
-      workers_interno   = max(1, n_workers // 2)  (ficheiros por ZIP)
-      workers_hora_pais = max(2, n_workers)        (pares hora/país)
+      workers_data      = n_workers         (datas em paralelo)
+      workers_hora_pais = max(2, n_workers) (pares hora/país)
+
+    Pipeline de datas: uma thread leitora lê até prefetch_datas datas à
+    frente do cálculo; as datas calculadas esperam numa fila de
+    fila_escrita unidades pelo escritor em background.
+
+    Com executor='process', os pares (Hora, Pais) de todas as datas são
+    distribuídos por um único ProcessPoolExecutor de n_workers processos,
+    que lêem os bids de ficheiros mapeados em memória (/dev/shm).
+
+    variantes é o caminho de um ficheiro JSON de variantes de parâmetros
+    (carrega_variantes); vazio para uma única simulação com parametros.json.
     """
     ch = None
+    escritor: Optional[StreamingInserter] = None
+    pool_processos: Optional[ProcessPoolExecutor] = None
+    dir_mmap = ''
 
     try:
         ensure_output_dir()
@@ -564,7 +806,7 @@ def run_worker(
         log('INFO', '═' * 60, job_id, ch)
         log('INFO', f'Job ID       : {job_id}', job_id, ch)
         log('INFO', f'Intervalo    : {data_inicio} → {data_fim}', job_id, ch)
-        log('INFO', f'Workers      : {n_workers}', job_id, ch)
+        log('INFO', f'Workers      : {n_workers} ({executor})', job_id, ch)
         log('INFO', '═' * 60, job_id, ch)
 
         # ── 1. Carregar configuração ─────────────────────────────────────────
@@ -581,6 +823,13 @@ def run_worker(
             f'{n_outras} categorias outras classes',
             job_id, ch)
 
+        lista_variantes = carrega_variantes(variantes, escaloes) if variantes else [('', escaloes)]
+        if variantes:
+            log('INFO',
+                f'Variantes: {len(lista_variantes)} — '
+                f'{", ".join(nome for nome, _ in lista_variantes)}',
+                job_id, ch)
+
         # ── 2. Descobrir datas disponíveis em mibel.bids_raw ─────────────────
         rows_datas = ch.execute(
             "SELECT DISTINCT toString(data_ficheiro) "
@@ -601,136 +850,129 @@ def run_worker(
             log('STATUS', 'DONE', job_id, ch)
             return True
 
-        log('INFO', f'Encontradas {len(datas)} data(s) em mibel.bids_raw:', job_id, ch)
+        versoes = versoes_bids_ch(ch, data_inicio, data_fim)
+        log('INFO', f'Encontradas {len(datas)} data(s) em mibel.bids_raw '
+                    f'({sum(d in versoes for d in datas)} com versão para a cache de clearing):',
+            job_id, ch)
         for d in datas[:10]:
             log('INFO', f'  • {d}', job_id, ch)
         if len(datas) > 10:
             log('INFO', f'  … e mais {len(datas) - 10} data(s)', job_id, ch)
 
-        # ── 3. Processar todas as datas ───────────────────────────────────────
+        # ── Retoma: saltar datas concluídas, limpar escritas parciais ────────
+        if resume:
+            concluidas = datas_concluidas(ch, job_id)
+            limpa_datas_incompletas(ch, job_id, TABELAS_RESULTADO, concluidas)
+            n_total = len(datas)
+            datas   = [d for d in datas if d not in concluidas]
+            log('INFO',
+                f'Retoma: {n_total - len(datas)} data(s) já concluída(s) — '
+                f'a processar {len(datas)}',
+                job_id, ch)
+            if not datas:
+                log('STATUS', 'DONE', job_id, ch)
+                return True
+
+        # ── 3. Processar todas as datas (inserção em streaming) ───────────────
         workers_data      = n_workers
         workers_hora_pais = max(2, n_workers)
 
         log('INFO',
-            f'Paralelismo: datas={workers_data} | hora/país={workers_hora_pais}',
+            f'Paralelismo: datas={workers_data} | hora/país={workers_hora_pais} | '
+            f'prefetch={prefetch_datas} | fila escrita={fila_escrita}',
             job_id, ch)
 
-        all_rows: list = []
-        all_logs: list = []
-        erros: list    = []
+        if executor == 'process':
+            # spawn: processos filho limpos, sem herdar ligações nem threads
+            pool_processos = ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_inicia_processo,
+                initargs=(escaloes, lista_variantes),
+            )
+            dir_mmap = cria_dir_mmap(job_id[:8])
+            log('INFO', f'Executor de processos: {n_workers} processos | mmap em {dir_mmap}',
+                job_id, ch)
+
+        # Cada data concluída é convertida e entregue ao escritor em background;
+        # a janela de datas em curso e a fila limitada do escritor mantêm a
+        # memória constante, qualquer que seja o intervalo de datas.
+        resumo     = _novo_resumo()
+        erros: list = []
+        escritor   = StreamingInserter(max_pending=fila_escrita)
 
         with ThreadPoolExecutor(max_workers=workers_data) as ex:
-            futures = {
-                ex.submit(
-                    _processa_data_ch,
-                    d, mapa_unidades_ch, escaloes,
-                    workers_hora_pais,
-                    job_id, None,  # ch=None nas threads filho
-                ): d
-                for d in datas
-            }
             concluidos = 0
-            for fut in as_completed(futures):
-                d = futures[fut]
+            carregadas = prefetch(
+                datas, partial(_carrega_data, job_id=job_id, versoes=versoes), prefetch_datas,
+            )
+            for (d, _), fut in executa_em_janela(
+                ex, _processa_data_ch, carregadas, workers_data,
+                mapa_unidades_ch, escaloes, lista_variantes,
+                workers_hora_pais,
+                job_id, None,  # ch=None nas threads filho
+                pool_processos, dir_mmap,
+            ):
                 concluidos += 1
                 try:
-                    rows, logs = fut.result()
-                    all_rows.extend(rows)
-                    all_logs.extend(logs)
-                    log('INFO',
-                        f'[{concluidos}/{len(datas)}] {d} processado — '
-                        f'{len(rows)} períodos | acumulados: {len(all_rows)}',
-                        job_id, ch)
+                    rows, logs, clearing_novo = fut.result()
                 except Exception as e:
                     erros.append(d)
                     log('ERRO', f'{d}: {e}', job_id, ch)
+                    continue
 
-        # ── 4. Inserir resultados no ClickHouse ──────────────────────────────
+                # O marcador de progresso vai por último: só existe se a data
+                # foi integralmente escrita (ver --resume)
+                escritor.put([
+                    ('mibel.clearing_substituicao',      _linhas_ch(rows, job_id),       False),
+                    ('mibel.clearing_substituicao_logs', _colunas_logs_ch(logs, job_id), True),
+                    *([registo_clearing_original(d, versoes[d], clearing_novo)]
+                      if clearing_novo and d in versoes else []),
+                    registo_progresso(job_id, 'substituicao', d, len(rows),
+                                      sum(len(b['Unidad']) for b in logs)),
+                ])
+                _acumula_resumo(resumo, rows, logs)
+                log('INFO',
+                    f'[{concluidos}/{len(datas)}] {d} processado — '
+                    f'{len(rows)} períodos | acumulados: {resumo["periodos"]}',
+                    job_id, ch)
+
+        # ── 4. Concluir inserção no ClickHouse ───────────────────────────────
+        inseridos = escritor.close()
         log('INFO', '─' * 60, job_id, ch)
-        log('INFO', f'Total: {len(all_rows)} períodos | {len(all_logs)} substituições de preço',
+        log('INFO',
+            f'Total: {resumo["periodos"]} períodos | {resumo["n_logs"]} substituições de preço',
             job_id, ch)
 
-        if all_rows:
-            log('INFO', f'A inserir {len(all_rows)} linhas em clearing_substituicao…', job_id, ch)
-
-            rows_ch = []
-            for r in all_rows:
-                hora_raw, hora_num, _ = normaliza_hora(r['Hora'])
-                data_str = extrai_data(r['internal_file'])
-                try:
-                    data_date = date.fromisoformat(data_str)
-                except ValueError:
-                    data_date = date(1970, 1, 1)
-
-                rows_ch.append({
-                    'job_id':                job_id,
-                    'data_ficheiro':         data_str,
-                    'data_date':             data_date,
-                    'hora_raw':              hora_raw,
-                    'hora_num':              hora_num,
-                    'pais':                  r['pais'],
-                    'preco_clearing_orig':   r['preco_clearing_orig'],
-                    'volume_clearing_orig':  r['volume_clearing_orig'],
-                    'preco_clearing_sub':    r['preco_clearing_sub'],
-                    'volume_clearing_sub':   r['volume_clearing_sub'],
-                    'delta_preco':           r['delta_preco'],
-                    'n_bids_substituidos':   r['n_bids_substituidos'] or 0,
-                })
-
-            inserted = ch_insert_batch(ch, 'mibel.clearing_substituicao', rows_ch)
-            log('INFO', f'Inseridos {inserted} registos em clearing_substituicao', job_id, ch)
+        if resumo['periodos']:
+            log('INFO',
+                f'Inseridos {inseridos.get("mibel.clearing_substituicao", 0)} registos '
+                f'em clearing_substituicao', job_id, ch)
         else:
             log('AVISO', 'Sem resultados de clearing para inserir', job_id, ch)
 
-        if all_logs:
-            log('INFO', f'A inserir {len(all_logs)} linhas em clearing_substituicao_logs…', job_id, ch)
-
-            logs_ch = []
-            for l in all_logs:
-                hora_raw, hora_num, _ = normaliza_hora(l.get('Hora', '0'))
-                data_str = extrai_data(l.get('internal_file', ''))
-                try:
-                    data_date = date.fromisoformat(data_str)
-                except ValueError:
-                    data_date = date(1970, 1, 1)
-
-                logs_ch.append({
-                    'job_id':        job_id,
-                    'data_ficheiro': data_str,
-                    'data_date':     data_date,
-                    'hora_raw':      hora_raw,
-                    'hora_num':      hora_num,
-                    'pais':          l.get('pais', ''),
-                    'unidade':       str(l.get('Unidad', '')),
-                    'categoria':     l.get('categoria', ''),
-                    'escalao_preco': float(l.get('escalao_preco', 0) or 0),
-                    'preco_original': float(l.get('preco_original', 0) or 0),
-                    'energia_mw':    float(l.get('Energia_MW', 0) or 0),
-                })
-
-            inserted = ch_insert_batch(ch, 'mibel.clearing_substituicao_logs', logs_ch)
-            log('INFO', f'Inseridos {inserted} registos em clearing_substituicao_logs', job_id, ch)
+        if resumo['n_logs']:
+            log('INFO',
+                f'Inseridos {inseridos.get("mibel.clearing_substituicao_logs", 0)} registos '
+                f'em clearing_substituicao_logs', job_id, ch)
 
         # ── 5. Resumo final ──────────────────────────────────────────────────
         log('INFO', '═' * 60, job_id, ch)
-        total_bids_sub = sum(r.get('n_bids_substituidos', 0) for r in all_rows)
-        precos_o = [r['preco_clearing_orig'] for r in all_rows if r['preco_clearing_orig'] is not None]
-        precos_s = [r['preco_clearing_sub']  for r in all_rows if r['preco_clearing_sub']  is not None]
-        deltas   = [r['delta_preco']         for r in all_rows if r['delta_preco']          is not None]
-
-        if precos_o:
+        if resumo['n_orig']:
             log('INFO',
-                f'Preço médio original : {sum(precos_o)/len(precos_o):.4f} €/MWh', job_id, ch)
-        if precos_s:
+                f'Preço médio original : {resumo["soma_orig"]/resumo["n_orig"]:.4f} €/MWh', job_id, ch)
+        if resumo['n_sub']:
             log('INFO',
-                f'Preço médio simulado : {sum(precos_s)/len(precos_s):.4f} €/MWh', job_id, ch)
-        if deltas:
+                f'Preço médio simulado : {resumo["soma_sub"]/resumo["n_sub"]:.4f} €/MWh', job_id, ch)
+        if resumo['n_delta']:
             log('INFO',
-                f'Delta médio          : {sum(deltas)/len(deltas):+.4f} €/MWh  '
-                f'(min={min(deltas):+.4f}  max={max(deltas):+.4f})', job_id, ch)
+                f'Delta médio          : {resumo["soma_delta"]/resumo["n_delta"]:+.4f} €/MWh  '
+                f'(min={resumo["min_delta"]:+.4f}  max={resumo["max_delta"]:+.4f})', job_id, ch)
+        for nome, (soma, n) in resumo['variantes'].items():
+            log('INFO', f'  Δ médio [{nome}] : {soma/n:+.4f} €/MWh  ({n} períodos)', job_id, ch)
 
-        log('INFO', f'Períodos processados : {len(all_rows)}', job_id, ch)
-        log('INFO', f'Bids substituídos    : {total_bids_sub}', job_id, ch)
+        log('INFO', f'Períodos processados : {resumo["periodos"]}', job_id, ch)
+        log('INFO', f'Bids substituídos    : {resumo["bids_sub"]}', job_id, ch)
         log('INFO', f'Datas com erro       : {len(erros)}', job_id, ch)
 
         if erros:
@@ -748,6 +990,13 @@ def run_worker(
         return False
 
     finally:
+        if escritor is not None:
+            escritor.close(raise_error=False)
+        if pool_processos is not None:
+            pool_processos.shutdown(cancel_futures=True)
+        if dir_mmap:
+            shutil.rmtree(dir_mmap, ignore_errors=True)
+        flush_worker_logs()
         if ch:
             try:
                 ch.disconnect()
@@ -768,6 +1017,16 @@ def main() -> None:
     parser.add_argument('--data_fim',    required=True, help='Data fim YYYY-MM-DD')
     parser.add_argument('--workers',     type=int, default=4,
                         help='Threads paralelas (default: 4)')
+    parser.add_argument('--resume',      action='store_true',
+                        help='Retoma o job: salta as datas já concluídas')
+    parser.add_argument('--prefetch',    type=int, default=2,
+                        help='Datas lidas do ClickHouse à frente do cálculo (default: 2)')
+    parser.add_argument('--fila_escrita', type=int, default=2,
+                        help='Datas calculadas em fila para inserção (default: 2)')
+    parser.add_argument('--executor',    choices=('thread', 'process'), default='thread',
+                        help='Pares hora/país em threads ou em processos (default: thread)')
+    parser.add_argument('--variantes',   default='',
+                        help='Ficheiro JSON com variantes de parâmetros a simular no mesmo passo')
     args = parser.parse_args()
 
     try:
@@ -782,6 +1041,11 @@ def main() -> None:
         data_inicio = args.data_inicio,
         data_fim    = args.data_fim,
         n_workers   = args.workers,
+        executor    = args.executor,
+        resume      = args.resume,
+        prefetch_datas = args.prefetch,
+        fila_escrita   = args.fila_escrita,
+        variantes      = args.variantes,
     )
     sys.exit(0 if ok else 1)
 
@@ -5,10 +5,14 @@ Shared utilities for Python workers: ClickHouse access, config loading,
 logging, and data transformation helpers.
 """
 
+import atexit
+import hashlib
 import json
 import os
+import queue
 import re
 import glob
+import threading
 from datetime import date, datetime
 from typing import Optional, Union
 from clickhouse_driver import Client
@@ -27,13 +31,19 @@ OUTPUTS_DIR = '/data/outputs'
 # ClickHouse Connection
 # ============================================================================
 
-def get_ch() -> Client:
-    """Get ClickHouse client connection."""
+def get_ch(use_numpy: bool = False) -> Client:
+    """
+    Get ClickHouse client connection.
+
+    With use_numpy=True, columnar SELECTs return numpy arrays (and pandas
+    Categoricals for LowCardinality columns) instead of Python tuples;
+    used for bulk reads of mibel.bids_raw (see carrega_bids_dia_ch).
+    """
     return Client(
         host=CLICKHOUSE_HOST,
         port=CLICKHOUSE_PORT,
         database='mibel',
-        settings={'use_numpy': False}
+        settings={'use_numpy': use_numpy}
     )
 
 
@@ -59,6 +69,360 @@ def ch_insert_batch(ch: Client, table: str, rows: list, batch_size: int = 5000)
 
     return total
 
+def ch_insert_columnar(ch: Client, table: str, columns: dict, batch_size: int = 100000) -> int:
+    """
+    Insert column-oriented data {column: sequence} in batches. Returns total
+    inserted count.
+
+    All sequences must have the same length. Data is sent with
+    columnar=True, so no per-row dict is ever built; as in ch_insert_batch,
+    columns with DEFAULT values that are not given are filled by ClickHouse.
+    """
+    if not columns:
+        return 0
+
+    names = list(columns.keys())
+    data  = [
+        c.tolist() if hasattr(c, 'tolist') else list(c)
+        for c in columns.values()
+    ]
+    n = len(data[0])
+    if n == 0:
+        return 0
+
+    sql = f'INSERT INTO {table} ({", ".join(names)}) VALUES'
+
+    total = 0
+    for i in range(0, n, batch_size):
+        ch.execute(sql, [c[i:i + batch_size] for c in data], columnar=True)
+        total += min(batch_size, n - i)
+
+    return total
+
+# ============================================================================
+# Streaming result insertion
+# ============================================================================
+
+class StreamingInserter:
+    """
+    Background ClickHouse writer fed through a bounded queue.
+
+    Producers call put() with one unit of work (typically one finished
+    date) as a list of (table, data, columnar) inserts: data is a list of
+    row dicts for ch_insert_batch, or a {column: sequence} dict for
+    ch_insert_columnar when columnar is True. put() blocks while
+    max_pending units are waiting, so memory held by finished-but-unwritten
+    results is bounded by the queue depth (backpressure).
+
+    The writer thread opens its own connection, since clickhouse_driver
+    clients are not thread-safe. The first insert error stops further
+    inserts and is re-raised by the next put() or by close().
+
+    batch_size is the ch_insert_columnar batch: each batch is one INSERT
+    and so at least one new part in ClickHouse.
+    """
+
+    _FIM = object()
+
+    def __init__(self, max_pending: int = 2, batch_size: int = 100000):
+        self.inserted: dict = {}
+        self._batch_size = batch_size
+        self._queue  = queue.Queue(maxsize=max(1, max_pending))
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='ch-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        ch = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._FIM:
+                    return
+                if self._error is not None:
+                    continue   # drain without writing so producers never block
+                try:
+                    if ch is None:
+                        ch = get_ch()
+                    for table, data, columnar in item:
+                        n = (ch_insert_columnar(ch, table, data, self._batch_size) if columnar
+                             else ch_insert_batch(ch, table, data))
+                        self.inserted[table] = self.inserted.get(table, 0) + n
+                except BaseException as e:
+                    self._error = e
+        finally:
+            if ch is not None:
+                try:
+                    ch.disconnect()
+                except Exception:
+                    pass
+
+    def put(self, inserts: list) -> None:
+        """Queue one unit of inserts; blocks while the queue is full."""
+        if self._error is not None:
+            raise self._error
+        if inserts:
+            self._queue.put(inserts)
+
+    def close(self, raise_error: bool = True) -> dict:
+        """
+        Flush pending inserts and stop the writer thread. Idempotent.
+        Returns {table: inserted rows}.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(self._FIM)
+            self._thread.join()
+        if raise_error and self._error is not None:
+            raise self._error
+        return self.inserted
+
+
+# Sentinel for next() on the item iterators of executa_em_janela / prefetch
+_SEM_ITEM = object()
+
+
+def executa_em_janela(executor, fn, itens, max_em_curso: int, *args):
+    """
+    Submit fn(item, *args) to executor for each item, keeping at most
+    max_em_curso futures in flight, and yield (item, future) as they
+    complete. Unlike submitting everything up front, results that the
+    consumer has not yet handled never pile up beyond the window.
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    itens = iter(itens)
+    em_curso: dict = {}
+
+    def _enche() -> None:
+        while len(em_curso) < max(1, max_em_curso):
+            item = next(itens, _SEM_ITEM)
+            if item is _SEM_ITEM:
+                return
+            em_curso[executor.submit(fn, item, *args)] = item
+
+    _enche()
+    while em_curso:
+        feitos, _ = wait(em_curso, return_when=FIRST_COMPLETED)
+        for fut in feitos:
+            yield em_curso.pop(fut), fut
+        _enche()
+
+
+def prefetch(itens, carrega, profundidade: int = 2, n_leitores: int = 1):
+    """
+    Read-ahead stage of a producer/consumer pipeline. Yields (item, future)
+    in input order, where future holds carrega(item) run by n_leitores
+    background threads.
+
+    At most n_leitores + profundidade loads are started ahead of the
+    consumer, so loaded data waiting to be processed stays bounded. Errors
+    raised by carrega surface when the consumer calls future.result().
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    itens  = iter(itens)
+    janela = max(1, n_leitores + profundidade)
+
+    with ThreadPoolExecutor(max_workers=max(1, n_leitores),
+                            thread_name_prefix='prefetch') as ex:
+        pendentes: deque = deque()
+
+        def _submete() -> None:
+            item = next(itens, _SEM_ITEM)
+            if item is not _SEM_ITEM:
+                pendentes.append((item, ex.submit(carrega, item)))
+
+        for _ in range(janela):
+            _submete()
+        while pendentes:
+            yield pendentes.popleft()
+            _submete()
+
+# ============================================================================
+# Job progress (checkpoint / resume)
+# ============================================================================
+
+def registo_progresso(job_id: str, tipo: str, data_str: str,
+                      n_periodos: int, n_logs: int) -> tuple:
+    """
+    StreamingInserter insert marking data_str as completed for job_id.
+    Queue it as the last insert of the date's unit, so the marker is only
+    written after every result row of that date.
+    """
+    return ('mibel.job_progresso', [{
+        'job_id':        job_id,
+        'tipo':          tipo,
+        'data_ficheiro': data_str,
+        'n_periodos':    n_periodos,
+        'n_logs':        n_logs,
+    }], False)
+
+
+def datas_concluidas(ch: Client, job_id: str) -> set:
+    """Dates (YYYY-MM-DD) already completed by job_id, from mibel.job_progresso."""
+    rows = ch.execute(
+        'SELECT DISTINCT data_ficheiro FROM mibel.job_progresso WHERE job_id = %(job)s',
+        {'job': job_id},
+    )
+    return {r[0] for r in rows}
+
+
+def limpa_datas_incompletas(ch: Client, job_id: str, tabelas: tuple, concluidas: set) -> None:
+    """
+    Delete the rows of job_id in tabelas whose date is not in concluidas,
+    i.e. partial writes of a date interrupted before its progress marker.
+    Lightweight DELETE: rows disappear from queries immediately.
+    """
+    for tabela in tabelas:
+        if concluidas:
+            ch.execute(
+                f'DELETE FROM {tabela} '
+                f'WHERE job_id = %(job)s AND data_ficheiro NOT IN %(datas)s',
+                {'job': job_id, 'datas': tuple(sorted(concluidas))},
+            )
+        else:
+            ch.execute(
+                f'DELETE FROM {tabela} WHERE job_id = %(job)s',
+                {'job': job_id},
+            )
+
+# ============================================================================
+# Original clearing cache (mibel.clearing_original)
+# ============================================================================
+#
+# The unmodified clearing of a (date, hora, pais) depends only on the bids of
+# that date, so it is cached across studies. Entries are keyed by the date's
+# data version: the SHA-1 fingerprints written by the ingestion worker to
+# mibel.bids_versao, one per ingested CSV. Re-ingesting a date changes its
+# version (and the ingestion worker deletes the stale entries); dropping a
+# month drops the matching partitions of both tables (DELETE /api/ingestao).
+
+def versoes_bids_ch(ch: Client, data_inicio: str, data_fim: str) -> dict:
+    """
+    {YYYY-MM-DD: version} of the ingested dates in [data_inicio, data_fim].
+    A date ingested from several CSVs gets the hash of their sorted
+    fingerprints, so any change to any of them yields a new version.
+    """
+    rows = ch.execute(
+        "SELECT toString(data_ficheiro), fingerprint "
+        "FROM mibel.bids_versao "
+        "WHERE data_ficheiro >= toDate(%(ini)s) "
+        "  AND data_ficheiro <= toDate(%(fim)s)",
+        {'ini': data_inicio, 'fim': data_fim},
+    )
+    por_data: dict = {}
+    for data_str, fingerprint in rows:
+        por_data.setdefault(data_str, []).append(fingerprint)
+    return {
+        d: fps[0] if len(fps) == 1 else hashlib.sha1('|'.join(sorted(fps)).encode()).hexdigest()
+        for d, fps in por_data.items()
+    }
+
+
+def carrega_clearing_original_ch(data_str: str, versao: str) -> Optional[dict]:
+    """
+    Cached original clearing of data_str at version versao, as
+    {(hora_raw, pais): (preco, volume)}; None on a cache miss.
+    Opens its own connection (called from the prefetch reader thread).
+    """
+    ch = get_ch()
+    try:
+        rows = ch.execute(
+            "SELECT hora_raw, pais, preco_clearing, volume_clearing "
+            "FROM mibel.clearing_original "
+            "WHERE data_ficheiro = toDate(%(data)s) AND versao = %(versao)s",
+            {'data': data_str, 'versao': versao},
+        )
+    finally:
+        try:
+            ch.disconnect()
+        except Exception:
+            pass
+    if not rows:
+        return None
+    return {(h, p): (preco, volume) for h, p, preco, volume in rows}
+
+
+def registo_clearing_original(data_str: str, versao: str, clearing: dict) -> tuple:
+    """
+    StreamingInserter insert filling the cache for data_str with
+    clearing = {(hora_raw, pais): (preco, volume)}.
+    """
+    data_date = date.fromisoformat(data_str)
+    pares = list(clearing.items())
+    return ('mibel.clearing_original', {
+        'data_ficheiro':   [data_date] * len(pares),
+        'versao':          [versao] * len(pares),
+        'hora_raw':        [h for (h, _), _ in pares],
+        'pais':            [p for (_, p), _ in pares],
+        'preco_clearing':  [None if pr is None else float(pr) for _, (pr, _) in pares],
+        'volume_clearing': [None if vol is None else float(vol) for _, (_, vol) in pares],
+    }, True)
+
+
+def cache_clearing_completa(clearing: dict, particoes: dict) -> bool:
+    """
+    True when a cached clearing (carrega_clearing_original_ch) covers every
+    (Hora, Pais) of particoes (particiona_bids) with both compras and vendas.
+    A partial entry is a miss: the caller recomputes and refills it.
+    """
+    return all(
+        par in clearing
+        for par, fatias in particoes.items()
+        if 'C' in fatias and 'V' in fatias
+    )
+
+# ============================================================================
+# Aggregated step curves (mibel.curvas)
+# ============================================================================
+#
+# Supply/demand curve of each (date, hora, pais, tipo) as one row per distinct
+# price: summed energy, number of bids and cumulative volume in curve order
+# (compras by price DESC, vendas ASC). Built by ClickHouse from mibel.bids_raw
+# after ingestion, so readers that only need the curve shape (the explorer's
+# curve view) skip the per-unit bids.
+
+CURVAS_SELECT = """
+    SELECT
+        data_ficheiro, hora_raw, hora_num, pais, tipo_oferta, precio,
+        energia_total,
+        sum(energia_total) OVER (
+            PARTITION BY data_ficheiro, hora_raw, pais, tipo_oferta
+            ORDER BY if(tipo_oferta = 'C', -precio, precio)
+            ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+        ),
+        n
+    FROM (
+        SELECT
+            data_ficheiro, hora_raw, hora_num, pais, tipo_oferta, precio,
+            sum(energia) AS energia_total,
+            count()      AS n
+        FROM mibel.bids_raw
+        WHERE data_ficheiro IN %(datas)s AND tipo_oferta IN ('C', 'V')
+        GROUP BY data_ficheiro, hora_raw, hora_num, pais, tipo_oferta, precio
+    )
+"""
+
+
+def materializa_curvas_ch(ch: Client, datas) -> None:
+    """
+    (Re)build the step curves of the given dates (YYYY-MM-DD) from
+    mibel.bids_raw. Existing curves of those dates are replaced.
+    """
+    datas = tuple(date.fromisoformat(d) for d in sorted(datas))
+    if not datas:
+        return
+    ch.execute('DELETE FROM mibel.curvas WHERE data_ficheiro IN %(datas)s', {'datas': datas})
+    ch.execute(
+        'INSERT INTO mibel.curvas '
+        '(data_ficheiro, hora_raw, hora_num, pais, tipo_oferta, precio, '
+        'energia, volume_acumulado, n_bids) ' + CURVAS_SELECT,
+        {'datas': datas},
+    )
+
 # ============================================================================
 # Configuration Loading
 # ============================================================================
@@ -149,28 +513,332 @@ def carrega_mapa_unidades_ch(ch: Client) -> dict:
         for codigo, regime, categoria in rows
     }
 
+
+def carrega_agentes_unidades_ch(ch: Client) -> dict:
+    """
+    Agente titular de cada unidade, a partir de mibel.unidades.
+
+    Devolve {CODIGO_UPPER: agente}; unidades sem agente ficam de fora.
+    """
+    rows = ch.execute(
+        "SELECT codigo, agente FROM mibel.unidades FINAL WHERE agente != ''"
+    )
+    return {
+        str(codigo).strip().upper(): str(agente).strip()
+        for codigo, agente in rows
+    }
+
+
+def lista_categorias(escaloes: dict) -> list:
+    """
+    Ordered list of (classe, categoria) pairs configured in parametros.json.
+
+    The position of each pair is its integer category code (see
+    indexa_categorias); iterating codes in ascending order follows the
+    same order as iterating escaloes.items().
+    """
+    return [
+        (classe, categoria)
+        for classe, cats in escaloes.items()
+        if isinstance(cats, dict)
+        for categoria in cats
+    ]
+
+
+def posicoes_por_categoria(cat_cod) -> dict:
+    """
+    Inverted index {codigo_categoria: np.ndarray of row positions} for an
+    integer category code array. Unclassified rows (code -1) are left out.
+    Positions are ascending within each category and keys are sorted.
+    """
+    import numpy as np
+
+    cat_cod = np.asarray(cat_cod)
+    if len(cat_cod) == 0:
+        return {}
+
+    ordem   = np.argsort(cat_cod, kind='stable')
+    ord_cod = cat_cod[ordem]
+    inicios = np.flatnonzero(np.r_[True, ord_cod[1:] != ord_cod[:-1]])
+    fins    = np.r_[inicios[1:], len(ord_cod)]
+
+    return {
+        int(ord_cod[i]): ordem[i:f]
+        for i, f in zip(inicios, fins)
+        if ord_cod[i] >= 0
+    }
+
+
+def indexa_categorias(df, mapa_unidades_ch: dict, escaloes: dict) -> dict:
+    """
+    Day-level unit classification, computed once per bid DataFrame.
+
+    The unit code is normalised (strip + upper) once per distinct unit and
+    looked up in mapa_unidades_ch ({CODIGO_UPPER: (regime, categoria_zona)}).
+    Adds an integer column 'cat_cod' to df (in place) holding the position of
+    (regime, categoria_zona) in lista_categorias(escaloes), or -1 when the
+    unit is not classified or its category is not configured.
+
+    Returns:
+        {
+            'categorias':    [(classe, categoria), ...],   # code → pair
+            'mapa_unidades': {CODIGO_UPPER: (regime, categoria_zona)},
+            'posicoes':      {codigo_categoria: np.ndarray of row positions},
+        }
+    """
+    import numpy as np
+    import pandas as pd
+
+    categorias = lista_categorias(escaloes)
+    cod_de     = {par: k for k, par in enumerate(categorias)}
+
+    if isinstance(df['Unidad'].dtype, pd.CategoricalDtype):
+        # Leitura colunar (bids_dataframe): os códigos já identificam a unidade
+        cod_unidade = df['Unidad'].cat.codes.to_numpy()
+        unidades    = df['Unidad'].cat.categories
+    else:
+        cod_unidade, unidades = pd.factorize(
+            df['Unidad'].to_numpy(dtype=object), use_na_sentinel=False
+        )
+
+    mapa_unidades: dict = {}
+    cat_por_unidade = np.full(len(unidades), -1, dtype=np.int32)
+    for u, unidade in enumerate(unidades):
+        codigo = str(unidade).strip().upper()
+        par    = mapa_unidades_ch.get(codigo)
+        if par in cod_de:
+            cat_por_unidade[u] = cod_de[par]
+            mapa_unidades[codigo] = par
+
+    cat_cod = cat_por_unidade[cod_unidade]
+    df['cat_cod'] = cat_cod
+
+    return {
+        'categorias':    categorias,
+        'mapa_unidades': mapa_unidades,
+        'posicoes':      posicoes_por_categoria(cat_cod),
+    }
+
+def particiona_bids(df) -> tuple:
+    """
+    Split a bid DataFrame once into contiguous (Hora, Pais, Tipo Oferta)
+    slices, instead of boolean-masking the whole frame per (Hora, Pais).
+
+    The frame is stable-sorted by (Hora, Pais, Tipo Oferta), so bids keep
+    their original relative order inside each slice, and each slice is a
+    positional iloc range over the sorted frame (no per-pair copy).
+
+    Returns:
+        (df_ordenado, {(Hora, Pais): {'C': DataFrame, 'V': DataFrame}})
+        Pairs are in (Hora, Pais) order; a side with no bids is absent.
+    """
+    import numpy as np
+
+    df_ord = df.sort_values(
+        ['Hora', 'Pais', 'Tipo Oferta'], kind='stable', ignore_index=True
+    )
+    if df_ord.empty:
+        return df_ord, {}
+
+    horas  = df_ord['Hora'].to_numpy(dtype=object)
+    paises = df_ord['Pais'].to_numpy(dtype=object)
+    tipos  = df_ord['Tipo Oferta'].to_numpy(dtype=object)
+
+    muda = np.r_[
+        True,
+        (horas[1:] != horas[:-1]) | (paises[1:] != paises[:-1]) | (tipos[1:] != tipos[:-1])
+    ]
+    inicios = np.flatnonzero(muda)
+    fins    = np.r_[inicios[1:], len(df_ord)]
+
+    particoes: dict = {}
+    for ini, fim in zip(inicios.tolist(), fins.tolist()):
+        par = (horas[ini], paises[ini])
+        particoes.setdefault(par, {})[tipos[ini]] = df_ord.iloc[ini:fim]
+
+    return df_ord, particoes
+
 # ============================================================================
-# Logging
+# Memory-mapped bid columns (process-pool execution)
 # ============================================================================
 
-def log(nivel: str, mensagem: str, job_id: str = '', ch: Optional[Client] = None):
+# Bid columns shared with worker processes; Hora, Pais and Tipo Oferta are
+# constant inside each (Hora, Pais, Tipo) slice and travel as scalars.
+COLUNAS_MMAP = ('Unidad', 'Energia', 'Precio', 'cat_cod')
+
+
+def cria_dir_mmap(prefixo: str) -> str:
     """
-    Print log line and optionally insert into worker_logs table.
+    Create a private temporary directory for memory-mapped bid columns,
+    on /dev/shm (tmpfs) when available so the data never touches disk.
+    """
+    import tempfile
+
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    return tempfile.mkdtemp(prefix=f'mibel_{prefixo}_', dir=base)
 
-    Levels: OK, ERRO, INFO, AVISO, STATUS
+
+def exporta_bids_mmap(df, directorio: str) -> dict:
     """
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    linha = f'[{timestamp}] [{nivel}] {mensagem}'
-    print(linha, flush=True)
+    Write the COLUNAS_MMAP columns of a (partitioned) bid DataFrame as .npy
+    files in directorio, so worker processes can memory-map them instead of
+    receiving pickled DataFrames.
 
-    if ch and job_id:
+    Unidad is stored as a fixed-width unicode array. Returns {col: path}.
+    """
+    import numpy as np
+
+    os.makedirs(directorio, exist_ok=True)
+    caminhos = {}
+    for col in COLUNAS_MMAP:
+        valores = df[col].to_numpy()
+        if valores.dtype == object:
+            valores = valores.astype(str)
+        caminho = os.path.join(directorio, f'{col}.npy')
+        np.save(caminho, valores, allow_pickle=False)
+        caminhos[col] = caminho
+    return caminhos
+
+
+def le_fatia_mmap(caminhos: dict, ini: int, fim: int, Hora: str, pais: str, tipo: str):
+    """
+    Rebuild the bid DataFrame of one (Hora, Pais, Tipo) slice, rows
+    [ini, fim), from the memory-mapped columns written by exporta_bids_mmap.
+    Only the slice is copied out of the mapping.
+    """
+    import numpy as np
+    import pandas as pd
+
+    cols = {
+        col: np.array(np.load(caminho, mmap_mode='r')[ini:fim])
+        for col, caminho in caminhos.items()
+    }
+    n = fim - ini
+    return pd.DataFrame({
+        'Hora':        np.full(n, Hora, dtype=object),
+        'Pais':        np.full(n, pais, dtype=object),
+        'Tipo Oferta': np.full(n, tipo, dtype=object),
+        'Unidad':      cols['Unidad'].astype(object),
+        'Energia':     cols['Energia'],
+        'Precio':      cols['Precio'],
+        'cat_cod':     cols['cat_cod'],
+    })
+
+
+def limites_fatia(fatia) -> tuple:
+    """(ini, fim) row range of a slice returned by particiona_bids."""
+    if fatia is None or fatia.empty:
+        return 0, 0
+    ini = int(fatia.index[0])
+    return ini, ini + len(fatia)
+
+# ============================================================================
+# Logging
+# ============================================================================
+
+_print_lock = threading.Lock()
+
+
+class _WorkerLogSink:
+    """
+    Buffered, asynchronous writer for mibel.worker_logs.
+
+    Rows are appended to an in-memory buffer and written by a background
+    thread, with its own ClickHouse connection, in one INSERT per flush:
+    every `intervalo` seconds, as soon as `max_linhas` rows are waiting,
+    and on close() (registered with atexit). The event timestamp is sent
+    explicitly, so buffering does not shift the `ts` column. Insert failures
+    are reported on stdout and never interrupt the worker.
+    """
+
+    def __init__(self, max_linhas: int = 500, intervalo: float = 1.0):
+        self.max_linhas = max_linhas
+        self.intervalo  = intervalo
+        self._lock      = threading.Lock()
+        self._buffer: list = []
+        self._acorda    = threading.Event()
+        self._parar     = False
+        self._thread: Optional[threading.Thread] = None
+        self._ch: Optional[Client] = None
+
+    def add(self, linha: dict) -> None:
+        with self._lock:
+            self._buffer.append(linha)
+            cheio = len(self._buffer) >= self.max_linhas
+            if self._thread is None:
+                self._parar  = False
+                self._thread = threading.Thread(
+                    target=self._run, name='worker-logs', daemon=True)
+                self._thread.start()
+        if cheio:
+            self._acorda.set()
+
+    def _run(self) -> None:
+        while not self._parar:
+            self._acorda.wait(self.intervalo)
+            self._acorda.clear()
+            self._flush()
+
+    def _flush(self) -> None:
+        with self._lock:
+            linhas, self._buffer = self._buffer, []
+        if not linhas:
+            return
         try:
-            ch.execute(
-                'INSERT INTO mibel.worker_logs (job_id, nivel, mensagem) VALUES',
-                [{'job_id': job_id, 'nivel': nivel, 'mensagem': mensagem}]
-            )
+            if self._ch is None:
+                self._ch = get_ch()
+            ch_insert_batch(self._ch, 'mibel.worker_logs', linhas)
         except Exception as e:
-            print(f'[AVISO] Failed to insert log: {e}', flush=True)
+            self._ch = None   # reconnect on the next flush
+            with _print_lock:
+                print(f'[AVISO] Failed to insert {len(linhas)} log(s): {e}', flush=True)
+
+    def close(self) -> None:
+        """Stop the background thread and write everything still buffered."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._parar = True
+        if thread is not None:
+            self._acorda.set()
+            thread.join()
+        self._flush()
+        if self._ch is not None:
+            try:
+                self._ch.disconnect()
+            except Exception:
+                pass
+            self._ch = None
+
+
+_log_sink = _WorkerLogSink()
+atexit.register(_log_sink.close)
+
+
+def log(nivel: str, mensagem: str, job_id: str = '', ch: Optional[Client] = None) -> None:
+    """
+    Print a log line to stdout (thread-safe) and, when ch and job_id are
+    given, queue it for mibel.worker_logs.
+
+    The stdout format `[YYYY-MM-DD HH:MM:SS.mmm] [NIVEL] mensagem` is what
+    the PHP side parses: the last [STATUS] DONE / [STATUS] FAILED line sets
+    the job state. ch only signals that the line should be persisted; the
+    rows are written in batches by a background sink with its own
+    connection (see flush_worker_logs).
+
+    Levels: INFO, OK, AVISO, ERRO, CSV, ZIP, STATUS
+    """
+    agora = datetime.now()
+    linha = f'[{agora.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]}] [{nivel}] {mensagem}'
+    with _print_lock:
+        print(linha, flush=True)
+
+    if ch and job_id:
+        _log_sink.add({'job_id': job_id, 'nivel': nivel, 'mensagem': mensagem, 'ts': agora})
+
+
+def flush_worker_logs() -> None:
+    """Write all buffered worker_logs rows now (call before a worker exits)."""
+    _log_sink.close()
 
 # ============================================================================
 # Data Transformation Helpers
@@ -203,6 +871,55 @@ def normaliza_hora(valor: str) -> tuple:
         return v, 0, 'UNK'
 
 
+def distribui_escaloes(energia, escalonamento: list):
+    """
+    Assign each bid (in the given order) the index of its price step (escalão).
+
+    Equivalent to the sequential walk of the original C1 script: the
+    cumulative volume of each bid is compared against the cumulative
+    thresholds (pct_bids × total volume) with searchsorted instead of
+    advancing a pointer bid by bid.
+
+    Args:
+        energia: np.ndarray of bid volumes, in walk order
+        escalonamento: list of {'preco': ..., 'pct_bids': ...}
+
+    Returns:
+        np.ndarray of indices into escalonamento
+    """
+    import numpy as np
+
+    vol_total = energia.sum()
+    vol_acum  = np.cumsum(energia)
+
+    # Cumulative volume thresholds per step (the last step is unbounded)
+    limiares: list = []
+    acum = 0.0
+    for esc in escalonamento[:-1]:
+        acum += esc['pct_bids'] * vol_total
+        limiares.append(acum)
+
+    # vol_acum > limiar + 1e-9  <=>  limiar + 1e-9 < vol_acum
+    esc_idx = np.searchsorted(np.array(limiares) + 1e-9, vol_acum, side='left')
+    # The original pointer never moves backwards
+    return np.maximum.accumulate(esc_idx)
+
+
+def concatena_colunas(blocos: list, colunas: tuple) -> dict:
+    """
+    Concatenate column-oriented blocks {column: np.ndarray} into one block.
+
+    Returns empty arrays for every column when there are no blocks.
+    """
+    import numpy as np
+
+    if not blocos:
+        return {col: np.array([], dtype=object) for col in colunas}
+    if len(blocos) == 1:
+        return blocos[0]
+    return {col: np.concatenate([b[col] for b in blocos]) for col in colunas}
+
+
 def extrai_data(nome_ficheiro: str) -> str:
     """
     Extract date from filename.
@@ -456,40 +1173,110 @@ def meses_ingeridos_ch(ch: Client) -> list:
     return result
 
 
+# Columns read from mibel.bids_raw by the study workers. LowCardinality
+# makes the driver decode each distinct string once per block.
+BIDS_SELECT = """
+    toLowCardinality(hora_raw)     AS Hora,
+    toLowCardinality(pais)         AS Pais,
+    toLowCardinality(tipo_oferta)  AS `Tipo Oferta`,
+    toLowCardinality(unidade)      AS Unidad,
+    energia                        AS Energia,
+    precio                         AS Precio
+"""
+
+# Bid columns kept as pandas categoricals (sorted categories, so sorting by
+# them is the same as sorting by the strings)
+COLUNAS_CATEGORICAS = ('Pais', 'Tipo Oferta', 'Unidad')
+
+
+def bids_dataframe(colunas, cols_meta):
+    """
+    Build a typed bid DataFrame from a columnar ClickHouse result
+    (execute(..., columnar=True, with_column_types=True)).
+
+    Works with numpy clients (arrays / Categoricals) and plain clients
+    (tuples). COLUNAS_CATEGORICAS become categoricals with sorted
+    categories, Energia/Precio float64 and the remaining string columns
+    (Hora, data_ficheiro) object arrays of str, which the (Hora, Pais) keys
+    of particiona_bids rely on.
+    """
+    import numpy as np
+    import pandas as pd
+
+    nomes = [c[0] for c in cols_meta]
+    if not colunas:
+        return pd.DataFrame(columns=nomes)
+
+    dados = {}
+    for nome, valores in zip(nomes, colunas):
+        if isinstance(valores, pd.Categorical) or nome in COLUNAS_CATEGORICAS:
+            cat = valores if isinstance(valores, pd.Categorical) else pd.Categorical(valores)
+            if not cat.categories.is_monotonic_increasing:
+                cat = cat.reorder_categories(cat.categories.sort_values())
+            dados[nome] = (
+                cat if nome in COLUNAS_CATEGORICAS
+                else np.asarray(cat, dtype=object)
+            )
+        elif nome in ('Energia', 'Precio'):
+            dados[nome] = np.asarray(valores, dtype=np.float64)
+        else:
+            arr = np.asarray(valores)
+            dados[nome] = arr.astype(object) if arr.dtype.kind == 'U' else arr
+    return pd.DataFrame(dados, columns=nomes)
+
+
+def carrega_bids_dia_ch(data_str: str):
+    """
+    Load one day of mibel.bids_raw as a typed DataFrame
+    (Hora, Pais, Tipo Oferta, Unidad, Energia, Precio) through a dedicated
+    numpy-mode connection: values land in arrays/categoricals directly, with
+    no Python tuple per row.
+    """
+    ch = get_ch(use_numpy=True)
+    try:
+        colunas, cols_meta = ch.execute(
+            f"""
+            SELECT {BIDS_SELECT}
+            FROM mibel.bids_raw
+            WHERE data_ficheiro = toDate(%(data)s)
+            """,
+            {'data': data_str},
+            columnar=True,
+            with_column_types=True,
+        )
+    finally:
+        try:
+            ch.disconnect()
+        except Exception:
+            pass
+    return bids_dataframe(colunas, cols_meta)
+
+
 def carrega_bids_df_ch(ch: Client, data_inicio: str, data_fim: str):
     """
     Carrega bids de mibel.bids_raw para um intervalo de datas como DataFrame.
 
     Colunas do DataFrame: Hora, hora_num, Pais, Tipo Oferta, Unidad,
                           Energia, Precio, data_ficheiro (str 'YYYY-MM-DD')
-    """
-    import pandas as pd
 
-    rows, cols_meta = ch.execute(
-        """
+    Leitura colunar (ver bids_dataframe); com um cliente get_ch(use_numpy=True)
+    os valores chegam já em arrays numpy / categoricals.
+    """
+    colunas, cols_meta = ch.execute(
+        f"""
         SELECT
-            hora_raw                         AS Hora,
+            {BIDS_SELECT.strip()},
             hora_num,
-            pais                             AS Pais,
-            tipo_oferta                      AS `Tipo Oferta`,
-            unidade                          AS Unidad,
-            energia                          AS Energia,
-            precio                           AS Precio,
-            toString(data_ficheiro)          AS data_ficheiro
+            toLowCardinality(toString(data_ficheiro)) AS data_ficheiro
         FROM mibel.bids_raw
         WHERE data_ficheiro >= toDate(%(ini)s)
           AND data_ficheiro <= toDate(%(fim)s)
         """,
         {'ini': data_inicio, 'fim': data_fim},
+        columnar=True,
         with_column_types=True,
     )
-
-    col_names = [c[0] for c in cols_meta]
-
-    if not rows:
-        return pd.DataFrame(columns=col_names)
-
-    return pd.DataFrame(rows, columns=col_names)
+    return bids_dataframe(colunas, cols_meta)
 
 
 def aplica_substituicao_pre(